@@ -0,0 +1,254 @@
+"""Cross-node routing for WebSocket traffic.
+
+Each worker process is a node. A directory maps every online user to the node
+that holds their socket, with a TTL that the owning node keeps refreshing, so
+a node that dies without cleaning up has its users age out. Each node listens
+on its own inbox channel; a node that does not hold a recipient's socket looks
+the recipient up and publishes the frame to the owner's inbox.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_PREFIX = "presence:"
+INBOX_PREFIX = "inbox:"
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LocalBackplane:
+    """Single-process deployment: every connection is local, nothing is routed"""
+
+    distributed = False
+
+    def __init__(self, node_id: str = "local"):
+        self.node_id = node_id
+
+    async def start(self, on_envelope, local_users):
+        pass
+
+    async def close(self):
+        pass
+
+    async def register(self, user: dict):
+        pass
+
+    async def unregister(self, user_id: str):
+        pass
+
+    async def locate(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        return {}
+
+    async def send(self, node_id: str, envelope: dict):
+        pass
+
+    def stats(self) -> dict:
+        return {"node_id": self.node_id, "distributed": False}
+
+
+class RedisBackplane:
+    """Directory and inboxes on Redis (or anything speaking the same commands).
+
+    ``redis`` is a ``redis.asyncio.Redis`` created with ``decode_responses=True``,
+    or a ``FakeRedis``. Directory entries are ``presence:<user_id>`` ->
+    ``{"node": ..., "user": {...}}`` and expire after ``ttl`` seconds unless the
+    heartbeat renews them.
+    """
+
+    distributed = True
+
+    def __init__(self, redis, node_id: Optional[str] = None, ttl: float = 30.0):
+        self.redis = redis
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.inbox = INBOX_PREFIX + self.node_id
+        self.counters = {"routed": 0, "received": 0, "lookups": 0, "failed": 0}
+        self._pubsub = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, on_envelope: Callable[[dict], Awaitable[None]],
+                    local_users: Callable[[], Iterable[dict]]):
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(self.inbox)
+        self._tasks = [
+            asyncio.create_task(self._listen(on_envelope)),
+            asyncio.create_task(self._heartbeat(local_users)),
+        ]
+        logger.info(f"Backplane node {self.node_id} listening on {self.inbox}")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.inbox)
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    def _entry(self, user: dict) -> str:
+        return json.dumps({"node": self.node_id, "user": user})
+
+    async def register(self, user: dict):
+        await self.redis.set(DIRECTORY_PREFIX + user["id"], self._entry(user), ex=self.ttl)
+
+    async def unregister(self, user_id: str):
+        # Only remove our own entry; if the user already reconnected elsewhere the
+        # other node owns it. A lost race is repaired by that node's next heartbeat.
+        key = DIRECTORY_PREFIX + user_id
+        raw = await self.redis.get(key)
+        if raw is not None and json.loads(raw)["node"] == self.node_id:
+            await self.redis.delete(key)
+
+    async def refresh(self, users: Iterable[dict]):
+        pipe = self.redis.pipeline(transaction=False)
+        for user in users:
+            pipe.set(DIRECTORY_PREFIX + user["id"], self._entry(user), ex=self.ttl)
+        await pipe.execute()
+
+    async def locate(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        """Directory entries for whichever of ``user_ids`` are online on any node"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        self.counters["lookups"] += 1
+        values = await self.redis.mget([DIRECTORY_PREFIX + u for u in user_ids])
+        return {u: json.loads(v) for u, v in zip(user_ids, values) if v is not None}
+
+    async def send(self, node_id: str, envelope: dict):
+        self.counters["routed"] += 1
+        await self.redis.publish(INBOX_PREFIX + node_id, json.dumps(envelope))
+
+    async def _listen(self, on_envelope):
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+            self.counters["received"] += 1
+            try:
+                await on_envelope(json.loads(message["data"]))
+            except Exception:
+                self.counters["failed"] += 1
+                logger.exception("Failed to deliver backplane envelope")
+
+    async def _heartbeat(self, local_users):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.refresh(local_users())
+            except Exception as e:
+                logger.warning(f"Backplane heartbeat failed: {e}")
+
+    def stats(self) -> dict:
+        return {"node_id": self.node_id, "distributed": True, "ttl": self.ttl, **self.counters}
+
+
+class FakeRedis:
+    """In-process stand-in for the Redis commands RedisBackplane uses.
+
+    Several backplanes sharing one instance behave like nodes sharing a Redis
+    server, which is how tests and benchmarks run a multi-node cluster in one
+    process. Values are strings and keys expire lazily, as with
+    ``decode_responses=True`` on a real client.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+        self._channels: Dict[str, set] = defaultdict(set)
+
+    def _live(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ex: Optional[float] = None):
+        self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return [self._live(key) for key in keys]
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def publish(self, channel: str, message: str) -> int:
+        subscribers = list(self._channels.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub._queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        return len(subscribers)
+
+    def pubsub(self) -> "FakePubSub":
+        return FakePubSub(self)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+class FakePubSub:
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._subscribed = set()
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self._redis._channels[channel].add(self)
+            self._subscribed.add(channel)
+            self._queue.put_nowait({"type": "subscribe", "channel": channel, "data": len(self._subscribed)})
+
+    async def unsubscribe(self, *channels: str):
+        for channel in channels or list(self._subscribed):
+            self._redis._channels[channel].discard(self)
+            self._subscribed.discard(channel)
+
+    async def listen(self):
+        while True:
+            yield await self._queue.get()
+
+    async def aclose(self):
+        await self.unsubscribe()
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+        self._commands = []
+
+    def set(self, key: str, value: str, ex: Optional[float] = None):
+        self._commands.append((key, value, ex))
+        return self
+
+    async def execute(self):
+        return [await self._redis.set(key, value, ex=ex) for key, value, ex in self._commands]
+
+
+def create_backplane(url: Optional[str], node_id: Optional[str] = None, ttl: float = 30.0):
+    """Backplane for ``BACKPLANE_URL``: unset for a single process, redis://... otherwise"""
+    if not url:
+        return LocalBackplane()
+    if url == "memory://":
+        return RedisBackplane(FakeRedis(), node_id, ttl)
+    try:
+        import redis.asyncio as aioredis
+    except ImportError as e:
+        raise RuntimeError("BACKPLANE_URL is set but the redis package is not installed") from e
+    return RedisBackplane(aioredis.from_url(url, decode_responses=True), node_id, ttl)
@@ -0,0 +1,66 @@
+"""Per-user cache of inbox (conversation list) responses"""
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class InboxCache:
+    """LRU of each user's most recent inbox, expiring after ``ttl`` seconds.
+
+    Writers call ``invalidate`` for the users a message touches. A fill that
+    started before an invalidation (``epoch`` from ``begin``) is discarded by
+    ``put``, so a slow read can't reinstate a stale inbox. The TTL bounds
+    staleness for writes that can't name their users cheaply.
+    """
+
+    def __init__(self, ttl: float = 10.0, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # user_id -> (expires_at, limit the inbox was fetched with, entries)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._invalidated: Dict[str, int] = {}
+        self._epoch = 0
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "stale_fills": 0}
+
+    def begin(self) -> int:
+        """Token to pass to ``put`` for a fill that starts now"""
+        return self._epoch
+
+    def get(self, user_id: str, limit: int) -> Optional[List[dict]]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            expires_at, fetched_limit, inbox = entry
+            # A shorter list than was asked for is the whole inbox
+            if expires_at > time.monotonic() and (limit <= fetched_limit or len(inbox) < fetched_limit):
+                self._entries.move_to_end(user_id)
+                self.counters["hits"] += 1
+                return inbox[:limit]
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, user_id: str, limit: int, inbox: List[dict], epoch: int):
+        if self._invalidated.get(user_id, -1) > epoch:
+            self.counters["stale_fills"] += 1
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, limit, inbox)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *user_ids: str):
+        self._epoch += 1
+        for user_id in user_ids:
+            self._invalidated[user_id] = self._epoch
+            if self._entries.pop(user_id, None) is not None:
+                self.counters["invalidations"] += 1
+        if len(self._invalidated) > self.max_entries:
+            # Fills in flight are short; only recent invalidations matter to them
+            cutoff = self._epoch - self.max_entries
+            self._invalidated = {u: e for u, e in self._invalidated.items() if e > cutoff}
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "ttl_ms": self.ttl * 1000,
+            **self.counters,
+        }
@@ -0,0 +1,213 @@
+"""Local write-ahead log for messages that are delivered before they are persisted"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWAL:
+    """Append-only, group-fsynced log of message writes awaiting the database.
+
+    Records are JSON lines ``{"lsn": n, "op": "insert", "doc": {...}}`` or
+    ``{"lsn": n, "op": "update", "id": ..., "fields": {...}}``. ``append``
+    returns once the record is on disk. Appends that arrive while an fsync is
+    in flight (or within ``fsync_interval``, if set) share the next write +
+    fsync, which runs off the event loop. Once the database has the write, ``ack`` advances a low-water
+    mark (``{"op": "ack", "upto": n}``) and segments wholly below it are
+    deleted. ``open`` returns the records past the last ack for replay, so
+    replayed writes must be idempotent. Writes the database keeps rejecting
+    are moved to ``dead-letter.log`` with ``dead_letter`` so they stop
+    pinning the low-water mark.
+
+    If a group's write or fsync fails, its appends raise and their lsns are
+    aborted: released from the low-water mark and listed in an
+    ``{"op": "abort", "lsns": [...]}`` record so ``open`` never replays a
+    write its caller was told had failed. Logging continues in a new
+    segment, since the failed one may end in a torn record.
+    """
+
+    def __init__(self, directory, fsync_interval: float = 0.0, segment_bytes: int = 16 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.lsn = 0
+        self.acked = 0
+        self._file = None
+        self._segment_index = 0
+        self._segment_size = 0
+        # (segment path, highest lsn in it) for closed segments, oldest first
+        self._segments: List[tuple] = []
+        self._outstanding = set()
+        self._outstanding_heap: List[int] = []
+        self._buffer: List[bytes] = []
+        # lsns of the records in _buffer, failed together if their group can't be written
+        self._buffer_lsns: List[int] = []
+        self._aborted = set()
+        self._waiters: List[asyncio.Future] = []
+        self._syncer: Optional[asyncio.Task] = None
+        self.counters = {"appended": 0, "syncs": 0, "bytes": 0, "replayed": 0, "dead_lettered": 0,
+                         "sync_failures": 0, "aborted": 0}
+
+    def _segment_path(self, index: int) -> Path:
+        return self.directory / f"wal-{index:08d}.log"
+
+    def open(self) -> List[dict]:
+        """Open the log for appending and return unacknowledged records, oldest first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        records = []
+        paths = sorted(self.directory.glob("wal-*.log"))
+        for path in paths:
+            segment_max = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn write at the tail of a crashed segment
+                        logger.warning(f"Ignoring truncated record in {path.name}")
+                        break
+                    if record["op"] == "ack":
+                        self.acked = max(self.acked, record["upto"])
+                        continue
+                    if record["op"] == "abort":
+                        self._aborted.update(record["lsns"])
+                        continue
+                    records.append(record)
+                    segment_max = max(segment_max, record["lsn"])
+            self.lsn = max(self.lsn, segment_max)
+            self._segments.append((path, segment_max))
+        if paths:
+            self._segment_index = int(paths[-1].stem.split("-")[1]) + 1
+        # Only an ack may survive once its records' segments are gone; never reuse lsns below it
+        self.lsn = max(self.lsn, self.acked)
+        pending = [r for r in records if r["lsn"] > self.acked and r["lsn"] not in self._aborted]
+        self._aborted = {lsn for lsn in self._aborted if lsn > self.acked}
+        for record in pending:
+            # Still owed to the database until the replay acknowledges them
+            self._outstanding.add(record["lsn"])
+            heapq.heappush(self._outstanding_heap, record["lsn"])
+        self.counters["replayed"] = len(pending)
+        self._open_segment()
+        return pending
+
+    def _open_segment(self):
+        self._file = open(self._segment_path(self._segment_index), "ab")
+        self._segment_size = 0
+
+    def _write(self, data: bytes, segment_max: int):
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._segment_size += len(data)
+        if self._segment_size >= self.segment_bytes:
+            self._roll_segment(segment_max)
+
+    def _roll_segment(self, segment_max: int):
+        self._file.close()
+        self._segments.append((self._segment_path(self._segment_index), segment_max))
+        self._segment_index += 1
+        self._open_segment()
+
+    async def append(self, record: dict) -> int:
+        """Durably log a write; returns its lsn"""
+        self.lsn += 1
+        record = {"lsn": self.lsn, **record}
+        self._outstanding.add(self.lsn)
+        heapq.heappush(self._outstanding_heap, self.lsn)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._buffer_lsns.append(self.lsn)
+        self._enqueue(json.dumps(record).encode() + b"\n")
+        self.counters["appended"] += 1
+        await waiter
+        return record["lsn"]
+
+    def _enqueue(self, line: bytes):
+        self._buffer.append(line)
+        if self._syncer is None or self._syncer.done():
+            self._syncer = asyncio.get_running_loop().create_task(self._sync())
+
+    async def _sync(self):
+        while self._buffer:
+            # Let appends made in the same loop iteration (or window) join this group
+            await asyncio.sleep(self.fsync_interval)
+            data, self._buffer = b"".join(self._buffer), []
+            lsns, self._buffer_lsns = self._buffer_lsns, []
+            waiters, self._waiters = self._waiters, []
+            try:
+                await asyncio.to_thread(self._write, data, self.lsn)
+            except Exception as e:
+                self.counters["sync_failures"] += 1
+                logger.error(f"WAL write failed, aborting {len(lsns)} appends: {e}")
+                try:
+                    await asyncio.to_thread(self._roll_segment, self.lsn)
+                except Exception:
+                    logger.exception("Could not start a new WAL segment")
+                self._abort(lsns)
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            self.counters["syncs"] += 1
+            self.counters["bytes"] += len(data)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _abort(self, lsns: List[int]):
+        """Release appends that never reached the disk, and log that they must not be replayed"""
+        self.counters["aborted"] += len(lsns)
+        self._aborted.update(lsns)
+        # Every abort not yet covered by an ack, in case an earlier abort record was lost too
+        aborted = sorted(lsn for lsn in self._aborted if lsn > self.acked)
+        if aborted:
+            self._enqueue(json.dumps({"op": "abort", "lsns": aborted}).encode() + b"\n")
+        self.ack(lsns)
+
+    def ack(self, lsns):
+        """Mark writes as persisted by the database"""
+        for lsn in lsns:
+            self._outstanding.discard(lsn)
+        heap = self._outstanding_heap
+        while heap and heap[0] not in self._outstanding:
+            heapq.heappop(heap)
+        low_water = heap[0] - 1 if heap else self.lsn
+        if low_water <= self.acked:
+            return
+        self.acked = low_water
+        self._aborted = {lsn for lsn in self._aborted if lsn > low_water}
+        # The ack rides along with the next group; losing it only means an idempotent replay
+        self._enqueue(json.dumps({"op": "ack", "upto": low_water}).encode() + b"\n")
+        while self._segments and self._segments[0][1] <= low_water:
+            path, _ = self._segments.pop(0)
+            path.unlink(missing_ok=True)
+
+    def dead_letter(self, record: dict, lsns: List[int]):
+        """Set aside a write the database won't take, and release its lsns"""
+        with open(self.directory / "dead-letter.log", "ab") as f:
+            f.write(json.dumps({"lsns": lsns, **record}).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.counters["dead_lettered"] += 1
+        self.ack(lsns)
+
+    async def close(self):
+        if self._syncer is not None and not self._syncer.done():
+            await self._syncer
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict:
+        return {
+            "lsn": self.lsn,
+            "acked": self.acked,
+            "outstanding": len(self._outstanding),
+            "segments": len(self._segments) + 1,
+            **self.counters,
+        }
@@ -0,0 +1,30 @@
+"""In-process metrics for the chatroom backend"""
+import bisect
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, reported in milliseconds"""
+
+    BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{b}" for b in self.BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
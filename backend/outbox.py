@@ -0,0 +1,148 @@
+"""Per-connection outbound queues for WebSocket clients"""
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Frames that are safe to lose when a client falls behind
+DROPPABLE_TYPES = {"typing", "stop-typing"}
+
+# Incremental presence frames; each carries the next per-recipient version
+PRESENCE_DELTA_TYPES = {"user-joined", "user-updated", "user-left", "presence-batch"}
+
+# Frames where only the newest queued copy matters -> the queued frames each one supersedes.
+# A presence snapshot reflects every delta before it, so it replaces them along with any
+# older snapshot and goes to the back of the queue, keeping versions in order.
+COALESCED_TYPES = {"users-update": PRESENCE_DELTA_TYPES}
+
+
+class Outbox:
+    """Bounded send queue for one WebSocket, drained by its own writer task.
+
+    Handlers only enqueue, so a slow recipient never back-pressures the
+    sender's receive loop. Once ``soft_limit`` frames are queued, typing
+    indicators are shed (new ones refused, then queued ones discarded to make
+    room). A presence snapshot replaces the snapshot and deltas already
+    queued. A queue that still reaches ``high_water`` marks the client as a
+    slow consumer and ``on_failure`` is called to disconnect it, as it is for
+    send timeouts.
+    """
+
+    def __init__(self, user_id, websocket, on_failure, soft_limit=64, high_water=256, send_timeout=5.0):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.on_failure = on_failure
+        self.soft_limit = soft_limit
+        self.high_water = high_water
+        self.send_timeout = send_timeout
+        self.queue = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+        self._failure = None
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.task = self._loop.create_task(self._writer())
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def put(self, msg_type, payload):
+        """Queue a serialized frame; returns False if it was not queued"""
+        if self.closed or self._failure:
+            return False
+
+        superseded = COALESCED_TYPES.get(msg_type)
+        if superseded is not None:
+            kept = deque(entry for entry in self.queue if entry[0] != msg_type and entry[0] not in superseded)
+            self.coalesced += len(self.queue) - len(kept)
+            self.queue = kept
+
+        if len(self.queue) >= self.soft_limit:
+            if msg_type in DROPPABLE_TYPES:
+                self.dropped += 1
+                return False
+            self._shed_droppable()
+        if len(self.queue) >= self.high_water:
+            self._fail("slow consumer")
+            return False
+
+        self.queue.append([msg_type, payload])
+        self._wake()
+        return True
+
+    def _shed_droppable(self):
+        for entry in self.queue:
+            if entry[0] in DROPPABLE_TYPES:
+                self.queue.remove(entry)
+                self.dropped += 1
+                return
+
+    def _fail(self, reason):
+        self._failure = reason
+        self.queue.clear()
+        # Interrupt a send that may be blocked on this very client
+        self._call_on_loop(self.task.cancel)
+
+    def _on_own_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _call_on_loop(self, callback):
+        # Senders may run on another event loop (TestClient gives each socket its own)
+        if self._on_own_loop():
+            callback()
+            return
+        try:
+            self._loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def _wake(self):
+        self._call_on_loop(self._wakeup.set)
+
+    async def _writer(self):
+        try:
+            while not self.closed and not self._failure:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                entry = self.queue.popleft()
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(entry[1]), self.send_timeout)
+                    self.sent += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._failure = f"send failed: {e!r}"
+        except asyncio.CancelledError:
+            if not self._failure or self.closed:
+                raise
+            asyncio.current_task().uncancel()
+
+        if self._failure and not self.closed:
+            logger.warning(f"Disconnecting {self.user_id}: {self._failure}")
+            self.closed = True
+            await self.on_failure(self.user_id, self.websocket)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        if self._on_own_loop() and asyncio.current_task() is self.task:
+            return  # the writer is closing itself and exits on its own
+        self._call_on_loop(self.task.cancel)
+
+    def stats(self):
+        return {
+            "user_id": self.user_id,
+            "depth": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,73 @@
+"""Bounded worker pool for bcrypt password hashing"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class HashingQueueFull(Exception):
+    """Raised when the hashing pool already has max_queue jobs waiting"""
+
+
+class PasswordHasher:
+    """Runs passlib hash/verify off the event loop.
+
+    bcrypt releases the GIL, so a small thread pool keeps the loop (and every
+    WebSocket on it) responsive during a login storm. At most ``max_workers``
+    jobs run at once and ``max_queue`` more may wait; beyond that callers get
+    HashingQueueFull instead of an ever-growing backlog.
+    """
+
+    def __init__(self, context, max_workers: int = 4, max_queue: int = 64):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.rejected = 0
+        self.queue_wait = LatencyHistogram()
+        self.hash_time = LatencyHistogram()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise HashingQueueFull()
+
+        self._pending += 1
+        enqueued = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            result = fn(*args)
+            return started, time.perf_counter(), result
+
+        try:
+            started, finished, result = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self._pending -= 1
+        self.queue_wait.observe(started - enqueued)
+        self.hash_time.observe(finished - started)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._pending,
+            "rejected": self.rejected,
+            "queue_wait": self.queue_wait.snapshot(),
+            "hash_time": self.hash_time.snapshot(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
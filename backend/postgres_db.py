@@ -1,22 +1,658 @@
 """PostgreSQL database layer for chatroom"""
 import os
+import json
+import time
+import zlib
+import asyncio
 import asyncpg
 import logging
-from typing import List, Dict, Optional
-from datetime import datetime, timezone
+import contextlib
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from datetime import date, datetime, timedelta, timezone
+
+from metrics import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
+# Columns stored as TIMESTAMPTZ; the API layer keeps exchanging ISO-8601 strings
+TIMESTAMP_COLUMNS = {'timestamp', 'created_at', 'edited_at', 'expires_at'}
+# JSONB columns; asyncpg exchanges them as text
+JSON_COLUMNS = {'preview'}
+
+# Rows fetched per round trip when iterating a server-side cursor
+CURSOR_PREFETCH = 500
+
+# Tables partitioned by day of expires_at; a day's partition is dropped whole once it has passed
+STATUS_PARTITIONED_TABLES = ('statuses', 'status_views')
+# Daily partitions kept ready ahead of today, so inserts never land in the default partition
+STATUS_PARTITION_DAYS_AHEAD = 2
+
+# Reaction counts are striped over this many rows per (message, emoji) so
+# concurrent toggles by different users rarely update the same row
+REACTION_COUNT_SLOTS = 16
+
+# Schema migrations, applied in order on connect and recorded in schema_migrations
+MIGRATIONS = [
+    (1, "typed timestamps", [
+        "ALTER TABLE users ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at::timestamptz",
+        "ALTER TABLE messages ALTER COLUMN timestamp TYPE TIMESTAMPTZ USING timestamp::timestamptz",
+        "ALTER TABLE messages ALTER COLUMN edited_at TYPE TIMESTAMPTZ USING edited_at::timestamptz",
+        "ALTER TABLE friends ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at::timestamptz",
+    ]),
+    (2, "query-shape indexes", [
+        # Conversation history: $or over both directions of a pair, keyset on (timestamp, id)
+        "CREATE INDEX IF NOT EXISTS idx_messages_pair_ts ON messages (from_user_id, to_user_id, timestamp, id)",
+        # Offline/unread messages: only unread rows are ever looked up this way
+        "CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages (to_user_id, timestamp) WHERE read = FALSE",
+        # Friend edges from either side, filtered by status
+        "CREATE INDEX IF NOT EXISTS idx_friends_user_status ON friends (user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_friends_friend_status ON friends (friend_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_friends_pair ON friends (user_id, friend_id)",
+    ]),
+    (3, "unread counters", [
+        """
+        CREATE TABLE IF NOT EXISTS unread_counts (
+            recipient_id TEXT NOT NULL,
+            sender_id TEXT NOT NULL,
+            unread INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (recipient_id, sender_id)
+        )
+        """,
+        # Statement-level triggers, so a batch insert or a read-up-to range
+        # UPDATE touches each (recipient, sender) counter once, not once per row
+        """
+        CREATE OR REPLACE FUNCTION unread_counts_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO unread_counts AS c (recipient_id, sender_id, unread)
+                SELECT to_user_id, from_user_id, count(*) FROM new_rows
+                WHERE NOT COALESCE(read, FALSE)
+                GROUP BY to_user_id, from_user_id
+                ON CONFLICT (recipient_id, sender_id) DO UPDATE SET unread = c.unread + EXCLUDED.unread;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO unread_counts AS c (recipient_id, sender_id, unread)
+                SELECT n.to_user_id, n.from_user_id,
+                       sum((NOT COALESCE(n.read, FALSE))::int - (NOT COALESCE(o.read, FALSE))::int)
+                FROM new_rows n JOIN old_rows o USING (id)
+                GROUP BY n.to_user_id, n.from_user_id
+                HAVING sum((NOT COALESCE(n.read, FALSE))::int - (NOT COALESCE(o.read, FALSE))::int) <> 0
+                ON CONFLICT (recipient_id, sender_id) DO UPDATE SET unread = c.unread + EXCLUDED.unread;
+            ELSE
+                UPDATE unread_counts c SET unread = c.unread - d.removed
+                FROM (
+                    SELECT to_user_id, from_user_id, count(*) AS removed FROM old_rows
+                    WHERE NOT COALESCE(read, FALSE)
+                    GROUP BY to_user_id, from_user_id
+                ) d
+                WHERE c.recipient_id = d.to_user_id AND c.sender_id = d.from_user_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER messages_unread_insert AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION unread_counts_apply()
+        """,
+        """
+        CREATE TRIGGER messages_unread_update AFTER UPDATE ON messages
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION unread_counts_apply()
+        """,
+        """
+        CREATE TRIGGER messages_unread_delete AFTER DELETE ON messages
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION unread_counts_apply()
+        """,
+        # Backfill from the rows that predate the triggers
+        """
+        INSERT INTO unread_counts (recipient_id, sender_id, unread)
+        SELECT to_user_id, from_user_id, count(*) FROM messages
+        WHERE read = FALSE
+        GROUP BY to_user_id, from_user_id
+        ON CONFLICT (recipient_id, sender_id) DO UPDATE SET unread = EXCLUDED.unread
+        """,
+    ]),
+    (4, "conversation summaries", [
+        # One row per (user, peer) holding the latest message either way, for the inbox
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_id TEXT NOT NULL,
+            peer_id TEXT NOT NULL,
+            last_message_id TEXT NOT NULL,
+            last_from_user_id TEXT NOT NULL,
+            last_message TEXT NOT NULL,
+            last_file_type TEXT,
+            last_deleted BOOLEAN NOT NULL DEFAULT FALSE,
+            last_timestamp TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (user_id, peer_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conversations_recent ON conversations (user_id, last_timestamp DESC)",
+        """
+        CREATE OR REPLACE FUNCTION conversations_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                -- Newest message of the batch per direction; older ones never win
+                INSERT INTO conversations AS c (user_id, peer_id, last_message_id, last_from_user_id,
+                                                last_message, last_file_type, last_deleted, last_timestamp)
+                SELECT DISTINCT ON (owner, peer) owner, peer, id, from_user_id,
+                       message, file_type, COALESCE(deleted, FALSE), timestamp
+                FROM (
+                    SELECT from_user_id AS owner, to_user_id AS peer, * FROM new_rows
+                    UNION ALL
+                    SELECT to_user_id AS owner, from_user_id AS peer, * FROM new_rows
+                ) m
+                ORDER BY owner, peer, timestamp DESC, id DESC
+                ON CONFLICT (user_id, peer_id) DO UPDATE SET
+                    last_message_id = EXCLUDED.last_message_id,
+                    last_from_user_id = EXCLUDED.last_from_user_id,
+                    last_message = EXCLUDED.last_message,
+                    last_file_type = EXCLUDED.last_file_type,
+                    last_deleted = EXCLUDED.last_deleted,
+                    last_timestamp = EXCLUDED.last_timestamp
+                WHERE (EXCLUDED.last_timestamp, EXCLUDED.last_message_id) > (c.last_timestamp, c.last_message_id);
+            ELSE
+                -- Edits and deletes of the latest message change the preview
+                UPDATE conversations c SET
+                    last_message = n.message,
+                    last_file_type = n.file_type,
+                    last_deleted = COALESCE(n.deleted, FALSE)
+                FROM new_rows n JOIN old_rows o USING (id)
+                WHERE (n.message IS DISTINCT FROM o.message OR n.deleted IS DISTINCT FROM o.deleted)
+                  AND c.last_message_id = n.id
+                  AND ((c.user_id = n.from_user_id AND c.peer_id = n.to_user_id)
+                    OR (c.user_id = n.to_user_id AND c.peer_id = n.from_user_id));
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER messages_conversations_insert AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION conversations_apply()
+        """,
+        """
+        CREATE TRIGGER messages_conversations_update AFTER UPDATE ON messages
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION conversations_apply()
+        """,
+        """
+        INSERT INTO conversations (user_id, peer_id, last_message_id, last_from_user_id,
+                                   last_message, last_file_type, last_deleted, last_timestamp)
+        SELECT DISTINCT ON (owner, peer) owner, peer, id, from_user_id,
+               message, file_type, COALESCE(deleted, FALSE), timestamp
+        FROM (
+            SELECT from_user_id AS owner, to_user_id AS peer, * FROM messages
+            UNION ALL
+            SELECT to_user_id AS owner, from_user_id AS peer, * FROM messages
+        ) m
+        ORDER BY owner, peer, timestamp DESC, id DESC
+        ON CONFLICT (user_id, peer_id) DO NOTHING
+        """,
+    ]),
+    (5, "symmetric friend edges", [
+        # Each accepted friendship stored once per direction, so listing a
+        # user's friends is one range scan on the primary key
+        """
+        CREATE TABLE IF NOT EXISTS friend_edges (
+            user_id TEXT NOT NULL,
+            friend_id TEXT NOT NULL,
+            friend_username TEXT NOT NULL,
+            PRIMARY KEY (user_id, friend_id)
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION friend_edges_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' AND OLD.status = 'accepted' THEN
+                -- Keep the edges if the pair is still accepted through another row
+                DELETE FROM friend_edges
+                WHERE (user_id, friend_id) IN ((OLD.user_id, OLD.friend_id), (OLD.friend_id, OLD.user_id))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM friends f
+                      WHERE f.status = 'accepted'
+                        AND ((f.user_id = OLD.user_id AND f.friend_id = OLD.friend_id)
+                          OR (f.user_id = OLD.friend_id AND f.friend_id = OLD.user_id))
+                  );
+            END IF;
+            IF TG_OP <> 'DELETE' AND NEW.status = 'accepted' THEN
+                INSERT INTO friend_edges (user_id, friend_id, friend_username)
+                VALUES (NEW.user_id, NEW.friend_id, NEW.friend_username),
+                       (NEW.friend_id, NEW.user_id, NEW.username)
+                ON CONFLICT (user_id, friend_id) DO UPDATE SET friend_username = EXCLUDED.friend_username;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER friends_edges AFTER INSERT OR UPDATE OR DELETE ON friends
+        FOR EACH ROW EXECUTE FUNCTION friend_edges_apply()
+        """,
+        """
+        INSERT INTO friend_edges (user_id, friend_id, friend_username)
+        SELECT user_id, friend_id, friend_username FROM friends WHERE status = 'accepted'
+        UNION ALL
+        SELECT friend_id, user_id, username FROM friends WHERE status = 'accepted'
+        ON CONFLICT (user_id, friend_id) DO NOTHING
+        """,
+    ]),
+    (6, "message reactions", [
+        """
+        CREATE TABLE IF NOT EXISTS message_reactions (
+            message_id TEXT NOT NULL,
+            emoji TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (message_id, emoji, user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_message_reactions_user ON message_reactions (user_id, message_id)",
+        """
+        CREATE TABLE IF NOT EXISTS message_reaction_counts (
+            message_id TEXT NOT NULL,
+            emoji TEXT NOT NULL,
+            slot SMALLINT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (message_id, emoji, slot)
+        )
+        """,
+    ]),
+    (7, "message previews", [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS preview JSONB",
+    ]),
+    # Statuses and their views expire by dropping daily partitions (see
+    # PostgresStatusesCollection.expire); the default partitions only catch
+    # rows that arrive before their day's partition exists
+    (8, "expiring statuses", [
+        """
+        CREATE TABLE IF NOT EXISTS statuses (
+            id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            content TEXT NOT NULL DEFAULT '',
+            media_url TEXT,
+            media_type TEXT,
+            created_at TIMESTAMPTZ NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            view_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (id, expires_at)
+        ) PARTITION BY RANGE (expires_at)
+        """,
+        "CREATE TABLE IF NOT EXISTS statuses_default PARTITION OF statuses DEFAULT",
+        "CREATE INDEX IF NOT EXISTS idx_statuses_author ON statuses (user_id, expires_at)",
+        """
+        CREATE TABLE IF NOT EXISTS status_views (
+            status_id TEXT NOT NULL,
+            viewer_id TEXT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            viewed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (status_id, viewer_id, expires_at)
+        ) PARTITION BY RANGE (expires_at)
+        """,
+        "CREATE TABLE IF NOT EXISTS status_views_default PARTITION OF status_views DEFAULT",
+        "CREATE INDEX IF NOT EXISTS idx_status_views_recent ON status_views (status_id, viewed_at DESC)",
+    ]),
+    # Views from clients that don't send expires_at can't be pruned to one
+    # partition; this keeps their lookup to an index probe per partition
+    (9, "status id lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_statuses_id ON statuses (id)",
+    ]),
+]
+
+
+def to_db_value(column: str, value):
+    """Convert an API value to the column's database representation"""
+    if column in TIMESTAMP_COLUMNS and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if column in JSON_COLUMNS and value is not None:
+        return json.dumps(value)
+    return value
+
+
+def row_to_doc(row) -> dict:
+    """Convert a record to the document shape the API layer expects"""
+    doc = dict(row)
+    for column in TIMESTAMP_COLUMNS:
+        if isinstance(doc.get(column), datetime):
+            doc[column] = doc[column].isoformat()
+    for column in JSON_COLUMNS:
+        if isinstance(doc.get(column), str):
+            doc[column] = json.loads(doc[column])
+    return doc
+
+
+# Mongo-style comparison operators understood by the query translator
+SQL_OPERATORS = {
+    '$lt': '<',
+    '$lte': '<=',
+    '$gt': '>',
+    '$gte': '>=',
+    '$ne': '<>',
+}
+
+
+def build_where(query: dict, params: list) -> str:
+    """Translate a (minimal) Mongo-style query into a SQL boolean expression.
+
+    Supports equality, ``$or``/``$and``, ``$in`` and the comparison operators
+    in SQL_OPERATORS. Values are appended to ``params`` as positional arguments.
+    """
+    parts = []
+    for key, value in query.items():
+        if key in ('$or', '$and'):
+            joiner = ' OR ' if key == '$or' else ' AND '
+            clauses = [f"({build_where(clause, params)})" for clause in value]
+            parts.append(f"({joiner.join(clauses)})")
+        elif isinstance(value, dict):
+            for op, operand in value.items():
+                if op == '$in':
+                    # One array parameter, so the statement shape doesn't vary with its length
+                    params.append([to_db_value(key, v) for v in operand])
+                    parts.append(f"{key} = ANY(${len(params)})")
+                    continue
+                params.append(to_db_value(key, operand))
+                parts.append(f"{key} {SQL_OPERATORS[op]} ${len(params)}")
+        elif isinstance(value, bool):
+            # Inline booleans so partial indexes (e.g. WHERE read = FALSE) stay usable
+            parts.append(f"{key} = {'TRUE' if value else 'FALSE'}")
+        else:
+            params.append(to_db_value(key, value))
+            parts.append(f"{key} = ${len(params)}")
+    return ' AND '.join(parts) if parts else 'TRUE'
+
+
+def build_order_by(sort: list) -> str:
+    return ', '.join(f"{field} {'ASC' if direction == 1 else 'DESC'}" for field, direction in sort)
+
+
+# Columns the query builder will put into SQL; anything else is rejected
+TABLE_COLUMNS = {
+    'users': {'id', 'username', 'hashed_password', 'created_at'},
+    'messages': {
+        'id', 'from_user_id', 'from_username', 'to_user_id', 'message', 'timestamp',
+        'read', 'deleted', 'edited_at', 'file_url', 'file_type', 'file_name', 'preview',
+    },
+    'friends': {'id', 'user_id', 'username', 'friend_id', 'friend_username', 'status', 'created_at'},
+}
+
+
+def _check_columns(table: str, query: dict):
+    for key, value in query.items():
+        if key in ('$or', '$and'):
+            for clause in value:
+                _check_columns(table, clause)
+        elif key not in TABLE_COLUMNS[table]:
+            raise ValueError(f"Unknown column {key!r} for {table}")
+
+
+def canonical_query(query: dict) -> dict:
+    """Same query with keys in a fixed order at every level, so one query
+    shape always produces the same SQL text (and prepared statement)"""
+    result = {}
+    for key in sorted(query):
+        value = query[key]
+        if key in ('$or', '$and'):
+            value = [canonical_query(clause) for clause in value]
+        elif isinstance(value, dict):
+            value = {op: value[op] for op in sorted(value)}
+        result[key] = value
+    return result
+
+
+def build_select(table: str, query: dict, sort: Optional[list] = None,
+                 limit: Optional[int] = None) -> Tuple[str, list]:
+    """Canonical, parameterized SELECT for a Mongo-style query; LIMIT is a parameter too.
+
+    A sorted, limited query with a top-level ``$or`` (a conversation's two
+    directions) becomes a UNION ALL of one sorted, limited subquery per branch,
+    so each branch is an ordered index scan that stops after ``limit`` rows
+    instead of a BitmapOr that sorts every matching row.
+    """
+    _check_columns(table, query)
+    for field, _ in sort or ():
+        if field not in TABLE_COLUMNS[table]:
+            raise ValueError(f"Unknown column {field!r} for {table}")
+    query = canonical_query(query)
+    params = []
+    if sort and limit and '$or' in query:
+        rest = {key: value for key, value in query.items() if key != '$or'}
+        wheres = [build_where(_merge_clause(branch, rest), params) for branch in query['$or']]
+        params.append(limit)
+        tail = f" ORDER BY {build_order_by(sort)} LIMIT ${len(params)}"
+        branches = ' UNION ALL '.join(f"(SELECT * FROM {table} WHERE {where}{tail})" for where in wheres)
+        return f"SELECT * FROM ({branches}) AS branches{tail}", params
+    sql = f"SELECT * FROM {table} WHERE {build_where(query, params)}"
+    if sort:
+        sql += f" ORDER BY {build_order_by(sort)}"
+    if limit:
+        params.append(limit)
+        sql += f" LIMIT ${len(params)}"
+    return sql, params
+
+
+def _merge_clause(branch: dict, rest: dict) -> dict:
+    """``branch AND rest`` as one flat query where their keys don't overlap"""
+    if rest.keys() & branch.keys():
+        return {'$and': [branch, rest]}
+    return canonical_query({**branch, **rest})
+
+
+def build_update(table: str, query: dict, fields: dict) -> Tuple[str, list]:
+    """Canonical, parameterized UPDATE ... SET fields WHERE query"""
+    _check_columns(table, query)
+    _check_columns(table, fields)
+    params = []
+    set_parts = []
+    for column in sorted(fields):
+        params.append(to_db_value(column, fields[column]))
+        set_parts.append(f"{column} = ${len(params)}")
+    where = build_where(canonical_query(query), params)
+    return f"UPDATE {table} SET {', '.join(set_parts)} WHERE {where}", params
+
+
+def modified_count(status: str) -> int:
+    """Row count from a command status such as 'UPDATE 3'"""
+    return int(status.split()[-1]) if status else 0
+
+
+def update_result(count: int):
+    return type('Result', (), {'modified_count': count})()
+
+
+class CachingConnection(asyncpg.Connection):
+    """Pooled connection that carries its own prepared statements (see StatementCache)"""
+
+    __slots__ = ('prepared_statements',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: "OrderedDict[str, asyncpg.prepared_stmt.PreparedStatement]" = OrderedDict()
+
+
+class DatabaseBusy(Exception):
+    """No pooled connection became free within the acquire timeout"""
+
+
+class QueryMonitor:
+    """Query latency histogram and slow-query log shared by a pool's connections"""
+
+    def __init__(self, slow_query_ms: float = 200):
+        self.slow_query_ms = slow_query_ms
+        self.query_time = LatencyHistogram()
+        self.counters = {"slow": 0, "errors": 0}
+
+    def observe(self, query: str, elapsed: float, exception: Optional[BaseException] = None):
+        self.query_time.observe(elapsed)
+        if exception is not None:
+            self.counters["errors"] += 1
+        if self.slow_query_ms and elapsed * 1000 >= self.slow_query_ms:
+            self.counters["slow"] += 1
+            logger.warning(f"Slow query ({elapsed * 1000:.0f} ms): {' '.join(query.split())[:500]}")
+
+    def log_record(self, record):
+        """asyncpg query logger callback (plain conn.fetch/execute calls)"""
+        self.observe(record.query, record.elapsed, record.exception)
+
+    def stats(self) -> dict:
+        return {"slow_query_ms": self.slow_query_ms, **self.counters, "query_time": self.query_time.snapshot()}
+
+
+class InstrumentedPool:
+    """asyncpg pool whose ``acquire`` is timed and bounded.
+
+    Waiting longer than ``acquire_timeout`` raises DatabaseBusy, so a burst
+    that saturates the pool fails fast instead of queueing without limit.
+    """
+
+    def __init__(self, acquire_timeout: Optional[float], monitor: QueryMonitor):
+        self.pool = None
+        self.acquire_timeout = acquire_timeout
+        self.monitor = monitor
+        self.in_use = 0
+        self.waiting = 0
+        self.acquire_wait = LatencyHistogram()
+        self.counters = {"acquired": 0, "timeouts": 0}
+
+    @classmethod
+    async def create(cls, dsn: str, acquire_timeout: Optional[float], monitor: QueryMonitor, **pool_kwargs):
+        instrumented = cls(acquire_timeout, monitor)
+        instrumented.pool = await asyncpg.create_pool(dsn, init=instrumented._init_connection, **pool_kwargs)
+        return instrumented
+
+    async def _init_connection(self, conn):
+        conn.add_query_logger(self.monitor.log_record)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise DatabaseBusy(f"No database connection free within {self.acquire_timeout}s") from None
+        finally:
+            self.waiting -= 1
+            self.acquire_wait.observe(time.perf_counter() - started)
+        self.counters["acquired"] += 1
+        self.in_use += 1
+        try:
+            yield conn
+        finally:
+            self.in_use -= 1
+            await self.pool.release(conn)
+
+    async def close(self):
+        await self.pool.close()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquire_timeout_s": self.acquire_timeout,
+            **self.counters,
+            "acquire_wait": self.acquire_wait.snapshot(),
+        }
+
+
+class StatementCache:
+    """Prepared statements per connection, keyed by the builder's canonical SQL.
+
+    Each connection keeps an LRU of at most ``max_size`` statements; the
+    hit/miss counters are shared across the pool. Prepared statements bypass
+    asyncpg's query loggers, so they are timed here for ``monitor``.
+    """
+
+    def __init__(self, max_size: int = 256, monitor: Optional[QueryMonitor] = None):
+        self.max_size = max_size
+        self.monitor = monitor
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidated": 0}
+
+    async def prepare(self, conn, sql: str):
+        cache = conn.prepared_statements
+        statement = cache.get(sql)
+        if statement is not None:
+            cache.move_to_end(sql)
+            self.counters["hits"] += 1
+            return statement
+        self.counters["misses"] += 1
+        statement = await conn.prepare(sql)
+        cache[sql] = statement
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+            self.counters["evictions"] += 1
+        return statement
+
+    async def _run(self, conn, sql: str, params: list, method: str):
+        started = time.perf_counter()
+        error = None
+        try:
+            statement = await self.prepare(conn, sql)
+            try:
+                return statement, await getattr(statement, method)(*params)
+            except asyncpg.exceptions.InvalidCachedStatementError:
+                # The schema changed under the statement (e.g. a migration); prepare it again
+                conn.prepared_statements.pop(sql, None)
+                self.counters["invalidated"] += 1
+                statement = await self.prepare(conn, sql)
+                return statement, await getattr(statement, method)(*params)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if self.monitor is not None:
+                self.monitor.observe(sql, time.perf_counter() - started, error)
+
+    async def fetch(self, conn, sql: str, params: list):
+        return (await self._run(conn, sql, params, 'fetch'))[1]
+
+    async def fetchrow(self, conn, sql: str, params: list):
+        return (await self._run(conn, sql, params, 'fetchrow'))[1]
+
+    async def execute(self, conn, sql: str, params: list) -> str:
+        """Run a statement; returns its command status (e.g. 'UPDATE 3')"""
+        statement, _ = await self._run(conn, sql, params, 'fetch')
+        return statement.get_statusmsg()
+
+    def stats(self) -> dict:
+        return {"max_size": self.max_size, **self.counters}
+
 class PostgresDB:
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, min_size: int = 1, max_size: int = 10,
+                 command_timeout: Optional[float] = None, max_inactive_lifetime: float = 300.0,
+                 acquire_timeout: Optional[float] = None, slow_query_ms: float = 200):
         self.database_url = database_url
         self.pool = None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self.max_inactive_lifetime = max_inactive_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.queries = QueryMonitor(slow_query_ms)
+        self.statements = StatementCache(monitor=self.queries)
         
     async def connect(self):
         """Create connection pool"""
         try:
-            self.pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=10)
+            self.pool = await InstrumentedPool.create(
+                self.database_url, self.acquire_timeout, self.queries,
+                min_size=self.min_size, max_size=self.max_size,
+                command_timeout=self.command_timeout,
+                max_inactive_connection_lifetime=self.max_inactive_lifetime,
+                connection_class=CachingConnection,
+            )
             await self._create_tables()
+            await self._migrate()
+            await self.statuses.expire()
             logger.info("PostgreSQL connected successfully")
         except Exception as e:
             logger.error(f"Failed to connect to PostgreSQL: {e}")
@@ -26,6 +662,13 @@ class PostgresDB:
         """Close connection pool"""
         if self.pool:
             await self.pool.close()
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.pool.stats() if self.pool else None,
+            "queries": self.queries.stats(),
+            "statements": self.statements.stats(),
+        }
     
     async def _create_tables(self):
         """Create tables if they don't exist"""
@@ -73,17 +716,65 @@ class PostgresDB:
             
             logger.info("PostgreSQL tables created/verified")
     
+    async def _migrate(self, conn=None):
+        """Apply pending schema migrations.
+
+        Type changes, index builds and backfills can run far longer than the
+        pool's command_timeout, so by default they get a dedicated connection
+        with no client-side timeout and statement_timeout turned off.
+        """
+        if conn is None:
+            conn = await asyncpg.connect(
+                self.database_url, command_timeout=None, server_settings={'statement_timeout': '0'},
+            )
+            try:
+                return await self._migrate(conn)
+            finally:
+                await conn.close()
+
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        ''')
+        for version, description, statements in MIGRATIONS:
+            async with conn.transaction():
+                # Serialize concurrent workers starting up against the same database
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+                applied = await conn.fetchval(
+                    'SELECT 1 FROM schema_migrations WHERE version = $1', version
+                )
+                if applied:
+                    continue
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute(
+                    'INSERT INTO schema_migrations (version, description) VALUES ($1, $2)',
+                    version, description
+                )
+                logger.info(f"Applied PostgreSQL migration {version}: {description}")
+    
     @property
     def users(self):
         return PostgresUsersCollection(self.pool)
     
     @property
     def messages(self):
-        return PostgresMessagesCollection(self.pool)
+        return PostgresMessagesCollection(self.pool, self.statements)
     
     @property
     def friends(self):
-        return PostgresFriendsCollection(self.pool)
+        return PostgresFriendsCollection(self.pool, self.statements)
+    
+    @property
+    def reactions(self):
+        return PostgresReactionsCollection(self.pool)
+
+    @property
+    def statuses(self):
+        return PostgresStatusesCollection(self.pool)
 
 
 class PostgresUsersCollection:
@@ -94,7 +785,7 @@ class PostgresUsersCollection:
         async with self.pool.acquire() as conn:
             await conn.execute(
                 'INSERT INTO users (id, username, hashed_password, created_at) VALUES ($1, $2, $3, $4)',
-                doc['id'], doc['username'], doc['hashed_password'], doc['created_at']
+                doc['id'], doc['username'], doc['hashed_password'], to_db_value('created_at', doc['created_at'])
             )
         return {"inserted_id": doc['id']}
     
@@ -108,112 +799,169 @@ class PostgresUsersCollection:
                 return None
             
             if row:
-                return dict(row)
+                return row_to_doc(row)
             return None
 
 
 class PostgresMessagesCollection:
-    def __init__(self, pool):
+    def __init__(self, pool, statements: StatementCache):
         self.pool = pool
+        self.statements = statements
     
     async def insert_one(self, doc: dict):
         async with self.pool.acquire() as conn:
             await conn.execute('''
-                INSERT INTO messages (id, from_user_id, from_username, to_user_id, message, timestamp, read, deleted, edited_at, file_url, file_type, file_name)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                INSERT INTO messages (id, from_user_id, from_username, to_user_id, message, timestamp, read, deleted, edited_at, file_url, file_type, file_name, preview)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
             ''', doc['id'], doc['from_user_id'], doc['from_username'], doc['to_user_id'], 
-                doc['message'], doc['timestamp'], doc.get('read', False), doc.get('deleted', False),
-                doc.get('edited_at'), doc.get('file_url'), doc.get('file_type'), doc.get('file_name'))
+                doc['message'], to_db_value('timestamp', doc['timestamp']), doc.get('read', False),
+                doc.get('deleted', False), to_db_value('edited_at', doc.get('edited_at')),
+                doc.get('file_url'), doc.get('file_type'), doc.get('file_name'),
+                to_db_value('preview', doc.get('preview')))
         return {"inserted_id": doc['id']}
-    
+
+    async def insert_many(self, docs: List[dict]):
+        """Insert a batch as one INSERT ... SELECT FROM unnest(column arrays).
+
+        Being a single statement, the statement-level unread_counts and
+        conversations triggers run once with the whole batch in their
+        transition table, rather than once per row as under executemany.
+        Rows whose id already exists are skipped, so replaying a batch is harmless.
+        """
+        if not docs:
+            return {"inserted_ids": []}
+        records = [
+            (doc['id'], doc['from_user_id'], doc['from_username'], doc['to_user_id'],
+             doc['message'], to_db_value('timestamp', doc['timestamp']), doc.get('read', False),
+             doc.get('deleted', False), to_db_value('edited_at', doc.get('edited_at')),
+             doc.get('file_url'), doc.get('file_type'), doc.get('file_name'),
+             to_db_value('preview', doc.get('preview')))
+            for doc in docs
+        ]
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO messages (id, from_user_id, from_username, to_user_id, message, timestamp, read, deleted, edited_at, file_url, file_type, file_name, preview)
+                SELECT * FROM unnest(
+                    $1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::timestamptz[],
+                    $7::boolean[], $8::boolean[], $9::timestamptz[], $10::text[], $11::text[], $12::text[],
+                    $13::jsonb[]
+                )
+                ON CONFLICT (id) DO NOTHING
+            ''', *(list(column) for column in zip(*records)))
+        return {"inserted_ids": [doc['id'] for doc in docs]}
+
+    async def bulk_set(self, updates: Dict[str, dict]):
+        """Apply {id: {column: value}} updates, one executemany per distinct column set"""
+        groups: Dict[tuple, list] = {}
+        for message_id, fields in updates.items():
+            _check_columns('messages', fields)
+            columns = tuple(sorted(fields))
+            groups.setdefault(columns, []).append(
+                [to_db_value(k, fields[k]) for k in columns] + [message_id]
+            )
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for columns, rows in groups.items():
+                    set_clause = ', '.join(f"{k} = ${i}" for i, k in enumerate(columns, 1))
+                    await conn.executemany(
+                        f"UPDATE messages SET {set_clause} WHERE id = ${len(columns) + 1}", rows
+                    )
+        return len(updates)
+
+    async def unread_counts(self, recipient_id: str) -> Dict[str, int]:
+        """Unread messages per sender, read from the trigger-maintained counters"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                'SELECT sender_id, unread FROM unread_counts WHERE recipient_id = $1 AND unread > 0',
+                recipient_id
+            )
+        return {row['sender_id']: row['unread'] for row in rows}
+
+    async def inbox(self, user_id: str, limit: int) -> List[dict]:
+        """Most recent conversations from the trigger-maintained summaries, newest first"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT c.peer_id, c.last_message_id, c.last_from_user_id, c.last_message,
+                       c.last_file_type, c.last_deleted, c.last_timestamp, COALESCE(u.unread, 0) AS unread
+                FROM conversations c
+                LEFT JOIN unread_counts u ON u.recipient_id = c.user_id AND u.sender_id = c.peer_id
+                WHERE c.user_id = $1
+                ORDER BY c.last_timestamp DESC
+                LIMIT $2
+            ''', user_id, limit)
+        return [
+            {
+                "peer_id": row['peer_id'],
+                "last_message": {
+                    "id": row['last_message_id'],
+                    "from_user_id": row['last_from_user_id'],
+                    "message": row['last_message'],
+                    "file_type": row['last_file_type'],
+                    "deleted": row['last_deleted'],
+                    "timestamp": row['last_timestamp'].isoformat(),
+                },
+                "unread": row['unread'],
+            }
+            for row in rows
+        ]
+
+    async def find_one(self, query: dict):
+        sql, params = build_select('messages', query, limit=1)
+        async with self.pool.acquire() as conn:
+            row = await self.statements.fetchrow(conn, sql, params)
+        return row_to_doc(row) if row else None
+
     def find(self, query=None, projection=None):
-        return PostgresMessagesCursor(self.pool, query or {})
+        return PostgresMessagesCursor(self.pool, self.statements, query or {})
     
     async def update_one(self, query: dict, update: dict):
+        # Messages are only ever updated by primary key, so "one" is the same statement
+        if 'id' not in query:
+            return update_result(0)
+        return await self.update_many(query, update)
+
+    async def update_many(self, query: dict, update: dict):
+        """Single UPDATE over every row matching ``query`` (e.g. a read-up-to range)"""
+        set_clause = update.get('$set', {})
+        if not set_clause:
+            return update_result(0)
+        sql, params = build_update('messages', query, set_clause)
         async with self.pool.acquire() as conn:
-            if '$set' in update:
-                set_clause = update['$set']
-                if 'id' in query:
-                    # Build dynamic UPDATE query
-                    set_parts = []
-                    values = []
-                    idx = 1
-                    for k, v in set_clause.items():
-                        set_parts.append(f"{k} = ${idx}")
-                        values.append(v)
-                        idx += 1
-                    values.append(query['id'])
-                    
-                    sql = f"UPDATE messages SET {', '.join(set_parts)} WHERE id = ${idx}"
-                    result = await conn.execute(sql, *values)
-                    count = int(result.split()[-1]) if result else 0
-                    return type('Result', (), {'modified_count': count})()
-        return type('Result', (), {'modified_count': 0})()
+            status = await self.statements.execute(conn, sql, params)
+        return update_result(modified_count(status))
 
 
 class PostgresMessagesCursor:
-    def __init__(self, pool, query):
+    def __init__(self, pool, statements: StatementCache, query):
         self.pool = pool
+        self.statements = statements
         self.query = query
-        self._sort_field = None
-        self._sort_direction = 'ASC'
+        self._sort = []
+        self._limit = None
     
     def sort(self, field, direction=1):
-        self._sort_field = field
-        self._sort_direction = 'ASC' if direction == 1 else 'DESC'
+        if isinstance(field, (list, tuple)):
+            self._sort = list(field)
+        else:
+            self._sort = [(field, direction)]
+        return self
+    
+    def limit(self, count):
+        self._limit = count or None
         return self
     
     async def to_list(self, max_size):
+        limit = min(filter(None, (self._limit, max_size)), default=None)
+        sql, params = build_select('messages', self.query, self._sort, limit if limit and limit > 0 else None)
         async with self.pool.acquire() as conn:
-            # Handle complex queries
-            if '$or' in self.query:
-                # Handle OR queries for messages between two users
-                or_conditions = self.query['$or']
-                conditions = []
-                params = []
-                idx = 1
-                
-                for cond in or_conditions:
-                    cond_parts = []
-                    for k, v in cond.items():
-                        cond_parts.append(f"{k} = ${idx}")
-                        params.append(v)
-                        idx += 1
-                    conditions.append(f"({' AND '.join(cond_parts)})")
-                
-                where_clause = ' OR '.join(conditions)
-                sql = f"SELECT * FROM messages WHERE {where_clause}"
-            elif 'to_user_id' in self.query and 'read' in self.query:
-                sql = "SELECT * FROM messages WHERE to_user_id = $1 AND read = $2"
-                params = [self.query['to_user_id'], self.query['read']]
-            else:
-                # Simple query
-                parts = []
-                params = []
-                idx = 1
-                for k, v in self.query.items():
-                    parts.append(f"{k} = ${idx}")
-                    params.append(v)
-                    idx += 1
-                
-                if parts:
-                    sql = f"SELECT * FROM messages WHERE {' AND '.join(parts)}"
-                else:
-                    sql = "SELECT * FROM messages"
-            
-            if self._sort_field:
-                sql += f" ORDER BY {self._sort_field} {self._sort_direction}"
-            
-            if max_size and max_size > 0:
-                sql += f" LIMIT {max_size}"
-            
-            rows = await conn.fetch(sql, *params) if params else await conn.fetch(sql)
-            return [dict(row) for row in rows]
+            rows = await self.statements.fetch(conn, sql, params)
+        return [row_to_doc(row) for row in rows]
 
 
 class PostgresFriendsCollection:
-    def __init__(self, pool):
+    def __init__(self, pool, statements: StatementCache):
         self.pool = pool
+        self.statements = statements
     
     async def insert_one(self, doc: dict):
         async with self.pool.acquire() as conn:
@@ -221,91 +969,232 @@ class PostgresFriendsCollection:
                 INSERT INTO friends (user_id, username, friend_id, friend_username, status, created_at)
                 VALUES ($1, $2, $3, $4, $5, $6)
             ''', doc['user_id'], doc['username'], doc['friend_id'], 
-                doc['friend_username'], doc['status'], doc['created_at'])
+                doc['friend_username'], doc['status'], to_db_value('created_at', doc['created_at']))
         return {"inserted_id": "ok"}
     
     async def find_one(self, query: dict):
+        if not query:
+            return None
+        sql, params = build_select('friends', query, limit=1)
         async with self.pool.acquire() as conn:
-            parts = []
-            params = []
-            idx = 1
-            for k, v in query.items():
-                parts.append(f"{k} = ${idx}")
-                params.append(v)
-                idx += 1
-            
-            if parts:
-                sql = f"SELECT * FROM friends WHERE {' AND '.join(parts)} LIMIT 1"
-                row = await conn.fetchrow(sql, *params)
-                if row:
-                    return dict(row)
-        return None
+            row = await self.statements.fetchrow(conn, sql, params)
+        return row_to_doc(row) if row else None
     
     def find(self, query=None, projection=None):
-        return PostgresFriendsCursor(self.pool, query or {})
+        return PostgresFriendsCursor(self.pool, self.statements, query or {})
+
+    async def accepted(self, user_id: str, after: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        """A user's friends ordered by friend_id, keyset-paged past ``after``"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT friend_id, friend_username FROM friend_edges
+                WHERE user_id = $1 AND ($2::text IS NULL OR friend_id > $2)
+                ORDER BY friend_id
+                LIMIT $3
+            ''', user_id, after, limit)
+        return [dict(row) for row in rows]
     
     async def update_one(self, query: dict, update: dict):
+        set_clause = update.get('$set')
+        if not set_clause or not query:
+            return update_result(0)
+        sql, params = build_update('friends', query, set_clause)
         async with self.pool.acquire() as conn:
-            if '$set' in update:
-                set_clause = update['$set']
-                # Build UPDATE query
-                set_parts = []
-                values = []
-                idx = 1
-                for k, v in set_clause.items():
-                    set_parts.append(f"{k} = ${idx}")
-                    values.append(v)
-                    idx += 1
-                
-                where_parts = []
-                for k, v in query.items():
-                    where_parts.append(f"{k} = ${idx}")
-                    values.append(v)
-                    idx += 1
-                
-                sql = f"UPDATE friends SET {', '.join(set_parts)} WHERE {' AND '.join(where_parts)}"
-                result = await conn.execute(sql, *values)
-                count = int(result.split()[-1]) if result else 0
-                return type('Result', (), {'modified_count': count})()
-        return type('Result', (), {'modified_count': 0})()
+            status = await self.statements.execute(conn, sql, params)
+        return update_result(modified_count(status))
 
 
 class PostgresFriendsCursor:
-    def __init__(self, pool, query):
+    def __init__(self, pool, statements: StatementCache, query):
         self.pool = pool
+        self.statements = statements
         self.query = query
     
     async def to_list(self, max_size):
+        sql, params = build_select('friends', self.query, limit=max_size if max_size and max_size > 0 else None)
         async with self.pool.acquire() as conn:
-            parts = []
-            params = []
-            idx = 1
-            for k, v in self.query.items():
-                parts.append(f"{k} = ${idx}")
-                params.append(v)
-                idx += 1
-            
-            if parts:
-                sql = f"SELECT * FROM friends WHERE {' AND '.join(parts)}"
-            else:
-                sql = "SELECT * FROM friends"
-            
-            if max_size and max_size > 0:
-                sql += f" LIMIT {max_size}"
-            
-            rows = await conn.fetch(sql, *params) if params else await conn.fetch(sql)
-            return [dict(row) for row in rows]
+            rows = await self.statements.fetch(conn, sql, params)
+        return [row_to_doc(row) for row in rows]
     
     def __aiter__(self):
-        self._results = None
-        return self
+        return self._stream()
     
-    async def __anext__(self):
-        if self._results is None:
-            self._results = await self.to_list(None)
-            self._iter = iter(self._results)
-        
-        try:
-            return next(self._iter)
-        except StopIteration:
-            raise StopAsyncIteration
+    async def _stream(self):
+        """Yield rows from a server-side cursor instead of materializing the result"""
+        sql, params = build_select('friends', self.query)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                statement = await self.statements.prepare(conn, sql)
+                async for row in statement.cursor(*params, prefetch=CURSOR_PREFETCH):
+                    yield row_to_doc(row)
+
+
+class PostgresReactionsCollection:
+    """One row per (message, emoji, user) plus striped per-emoji counts"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def toggle(self, message_id: str, emoji: str, user_id: str):
+        """Add the reaction, or remove it if present, in one statement.
+
+        Toggles of the same (message, emoji, user), e.g. a double-click or two
+        tabs, are serialized on an advisory lock; otherwise both could see
+        the reaction absent and add it. Returns ``(added, counts)`` with the
+        message's counts per emoji.
+        """
+        slot = zlib.crc32(user_id.encode()) % REACTION_COUNT_SLOTS
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute(
+                "SELECT pg_advisory_xact_lock(hashtextextended($1 || chr(31) || $2 || chr(31) || $3, 0))",
+                message_id, emoji, user_id,
+            )
+            delta = await conn.fetchval('''
+                WITH removed AS (
+                    DELETE FROM message_reactions
+                    WHERE message_id = $1 AND emoji = $2 AND user_id = $3
+                    RETURNING 1
+                ), added AS (
+                    INSERT INTO message_reactions (message_id, emoji, user_id)
+                    SELECT $1, $2, $3 WHERE NOT EXISTS (SELECT 1 FROM removed)
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                ), delta AS (
+                    SELECT (SELECT count(*) FROM added) - (SELECT count(*) FROM removed) AS n
+                ), counted AS (
+                    INSERT INTO message_reaction_counts AS c (message_id, emoji, slot, count)
+                    SELECT $1, $2, $4, n FROM delta WHERE n <> 0
+                    ON CONFLICT (message_id, emoji, slot) DO UPDATE SET count = c.count + EXCLUDED.count
+                )
+                SELECT n FROM delta
+            ''', message_id, emoji, user_id, slot)
+            rows = await conn.fetch('''
+                SELECT emoji, sum(count) AS count FROM message_reaction_counts
+                WHERE message_id = $1
+                GROUP BY emoji HAVING sum(count) > 0
+            ''', message_id)
+        return delta > 0, {row['emoji']: row['count'] for row in rows}
+
+    async def summaries(self, message_ids: List[str], viewer_id: str) -> Dict[str, dict]:
+        """{message_id: {"counts": {emoji: n}, "mine": [emoji]}} for messages with reactions"""
+        async with self.pool.acquire() as conn:
+            counts = await conn.fetch('''
+                SELECT message_id, emoji, sum(count) AS count FROM message_reaction_counts
+                WHERE message_id = ANY($1)
+                GROUP BY message_id, emoji HAVING sum(count) > 0
+            ''', message_ids)
+            mine = await conn.fetch('''
+                SELECT message_id, emoji FROM message_reactions
+                WHERE user_id = $1 AND message_id = ANY($2)
+            ''', viewer_id, message_ids)
+        result: Dict[str, dict] = {}
+        for row in counts:
+            result.setdefault(row['message_id'], {"counts": {}, "mine": []})["counts"][row['emoji']] = row['count']
+        for row in mine:
+            result.setdefault(row['message_id'], {"counts": {}, "mine": []})["mine"].append(row['emoji'])
+        return result
+
+
+def status_partition_ddl(table: str, day: date) -> str:
+    # Explicit UTC bounds: a bare date would be read in the session TimeZone,
+    # shifting partitions off the UTC days expire() drops them by
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table}_p{day:%Y%m%d} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+    )
+
+
+class PostgresStatusesCollection:
+    """Statuses that expire with their daily ``expires_at`` partition, plus who viewed them"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def create(self, doc: dict):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO statuses (id, user_id, username, content, media_url, media_type, created_at, expires_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+            ''', doc['id'], doc['user_id'], doc['username'], doc['content'], doc.get('media_url'),
+                doc.get('media_type'), to_db_value('created_at', doc['created_at']),
+                to_db_value('expires_at', doc['expires_at']))
+
+    async def feed(self, user_id: str, viewers_limit: int, limit: int) -> List[dict]:
+        """Live statuses by the user and their friends, newest first.
+
+        ``viewed`` says whether ``user_id`` has seen each one; ``viewers``
+        lists the latest ``viewers_limit`` viewers of the user's own statuses
+        (None for anyone else's).
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT s.id, s.user_id, s.username, s.content, s.media_url, s.media_type,
+                       s.created_at, s.expires_at, s.view_count,
+                       EXISTS (
+                           SELECT 1 FROM status_views v WHERE v.status_id = s.id AND v.viewer_id = $1
+                       ) AS viewed,
+                       CASE WHEN s.user_id = $1 THEN ARRAY(
+                           SELECT v.viewer_id FROM status_views v
+                           WHERE v.status_id = s.id ORDER BY v.viewed_at DESC LIMIT $2
+                       ) END AS viewers
+                FROM statuses s
+                WHERE s.expires_at > now()
+                  AND (s.user_id = $1 OR s.user_id IN (SELECT friend_id FROM friend_edges WHERE user_id = $1))
+                ORDER BY s.created_at DESC
+                LIMIT $3
+            ''', user_id, viewers_limit, limit)
+        return [row_to_doc(row) for row in rows]
+
+    async def view(self, status_id: str, viewer_id: str, expires_at: Optional[str] = None) -> Optional[bool]:
+        """Record a view; None if the status doesn't exist (or expired), else whether it was counted.
+
+        Each viewer counts once, and authors viewing their own status don't
+        count. ``expires_at`` (as the feed returned it) pins the lookup to one
+        partition.
+        """
+        params = [status_id, viewer_id]
+        pinned = pinned_update = ""
+        if expires_at is not None:
+            params.append(to_db_value('expires_at', expires_at))
+            pinned, pinned_update = " AND expires_at = $3", " AND s.expires_at = $3"
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(f'''
+                WITH target AS (
+                    SELECT id, user_id, expires_at FROM statuses
+                    WHERE id = $1 AND expires_at > now(){pinned}
+                ), added AS (
+                    INSERT INTO status_views (status_id, viewer_id, expires_at)
+                    SELECT id, $2, expires_at FROM target WHERE user_id <> $2
+                    ON CONFLICT DO NOTHING
+                    RETURNING expires_at
+                ), counted AS (
+                    UPDATE statuses s SET view_count = view_count + 1
+                    FROM added WHERE s.id = $1 AND s.expires_at = added.expires_at{pinned_update}
+                    RETURNING 1
+                )
+                SELECT EXISTS (SELECT 1 FROM target) AS found, EXISTS (SELECT 1 FROM counted) AS counted
+            ''', *params)
+        return row['counted'] if row['found'] else None
+
+    async def expire(self, today: Optional[date] = None):
+        """Create the coming days' partitions and drop the ones that have passed"""
+        today = today or datetime.now(timezone.utc).date()
+        async with self.pool.acquire() as conn:
+            for table in STATUS_PARTITIONED_TABLES:
+                for offset in range(STATUS_PARTITION_DAYS_AHEAD + 1):
+                    day = today + timedelta(days=offset)
+                    try:
+                        await conn.execute(status_partition_ddl(table, day))
+                    except asyncpg.PostgresError as e:
+                        # Rows for that day already sit in the default partition
+                        logger.warning(f"Could not create partition {table}_p{day:%Y%m%d}: {e}")
+                partitions = await conn.fetch('''
+                    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = $1::regclass
+                ''', table)
+                for row in partitions:
+                    suffix = row['relname'][len(table) + 2:]
+                    if row['relname'].startswith(f"{table}_p") and suffix.isdigit() \
+                            and datetime.strptime(suffix, "%Y%m%d").date() < today:
+                        await conn.execute(f"DROP TABLE IF EXISTS {row['relname']}")
+                await conn.execute(f"DELETE FROM {table}_default WHERE expires_at <= now()")
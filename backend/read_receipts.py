@@ -0,0 +1,60 @@
+"""Coalescing of per-message read receipts"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ReadReceiptCoalescer:
+    """Collects ``message-read`` events per (reader, sender) pair for ``window`` seconds.
+
+    Clients acknowledge every message they display, so opening a busy chat
+    produces a burst of receipts for the same conversation. Each burst is
+    handed to ``apply(reader_id, sender_id, message_ids)`` once, which turns it
+    into one UPDATE and one receipt frame. With ``window <= 0`` receipts are
+    applied as they arrive.
+    """
+
+    def __init__(self, apply: Callable[[str, str, List[str]], Awaitable[None]], window: float = 0.1):
+        self.apply = apply
+        self.window = window
+        self._pending: Dict[Tuple[str, str], List[str]] = {}
+        self._timer = None
+        self.counters = {"received": 0, "applied": 0, "flushes": 0}
+
+    async def add(self, reader_id: str, sender_id: str, message_id: str):
+        self.counters["received"] += 1
+        ids = self._pending.setdefault((reader_id, sender_id), [])
+        if message_id not in ids:
+            ids.append(message_id)
+        if self.window <= 0:
+            await self.flush()
+            return
+        timer = self._timer
+        # The loop that armed the timer may be gone (TestClient runs one per socket)
+        if timer is None or timer.done() or timer.get_loop().is_closed():
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        self._timer = None
+        for (reader_id, sender_id), message_ids in pending.items():
+            self.counters["flushes"] += 1
+            self.counters["applied"] += len(message_ids)
+            try:
+                await self.apply(reader_id, sender_id, message_ids)
+            except Exception:
+                logger.exception(f"Failed to apply read receipts from {reader_id} to {sender_id}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(len(ids) for ids in self._pending.values()),
+            "window_ms": self.window * 1000,
+            **self.counters,
+            "coalesced": self.counters["applied"] - self.counters["flushes"],
+        }
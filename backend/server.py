@@ -1,22 +1,40 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status, File, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status, Query, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Set
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import json
 from passlib.context import CryptContext
 import asyncio
-import shutil
 import mimetypes
-from postgres_db import PostgresDB
+import bisect
+from collections import deque
+import heapq
+import itertools
+import operator
+from postgres_db import PostgresDB, DatabaseBusy
+from password_hashing import PasswordHasher, HashingQueueFull
+from outbox import Outbox
+from backplane import create_backplane
+from write_behind import WriteBehind
+from message_wal import MessageWAL
+from read_receipts import ReadReceiptCoalescer
+from inbox_cache import InboxCache
+from thumbnails import ThumbnailPool
+from ws_dispatch import FrameDispatcher
+from static_files import CachedStaticFiles, IMMUTABLE, REVALIDATE
+from upload_store import (
+    UploadStore, UploadError, UploadTooLarge, UploadNotFound, UploadOffsetMismatch, UploadIncomplete,
+)
 
 import certifi
 
@@ -24,30 +42,49 @@ ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # In-Memory Database for testing/fallback
+# Secondary hash indexes per collection; the query planner picks the widest one
+# whose fields are all equality keys of a query.
+# Entries are field tuples, or (fields, order_by) for buckets kept sorted so
+# keyset pages can be sliced out with a binary search.
+IN_MEMORY_INDEXES = {
+    "messages": [("id",), (("from_user_id", "to_user_id"), ("timestamp", "id")), ("to_user_id", "read")],
+    "users": [("id",), ("username",)],
+    "friends": [("user_id", "status"), ("friend_id", "status"), ("user_id", "friend_id")],
+    "friend_requests": [],
+}
+
 class InMemoryDB:
     def __init__(self):
-        self.data = {
-            "messages": [],
-            "users": [],
-            "friends": [],
-            "friend_requests": []
+        self.collections = {
+            name: IN_MEMORY_COLLECTION_TYPES.get(name, InMemoryCollection)(name, indexes)
+            for name, indexes in IN_MEMORY_INDEXES.items()
         }
+        self._reactions = InMemoryReactionsCollection()
+        self._statuses = InMemoryStatusesCollection(self.collections["friends"], STATUS_VIEWERS_LIMIT)
     
     @property
     def messages(self):
-        return InMemoryCollection(self.data, "messages")
+        return self.collections["messages"]
     
     @property
     def users(self):
-        return InMemoryCollection(self.data, "users")
+        return self.collections["users"]
     
     @property
     def friends(self):
-        return InMemoryCollection(self.data, "friends")
+        return self.collections["friends"]
     
     @property
     def friend_requests(self):
-        return InMemoryCollection(self.data, "friend_requests")
+        return self.collections["friend_requests"]
+
+    @property
+    def reactions(self):
+        return self._reactions
+
+    @property
+    def statuses(self):
+        return self._statuses
 
 class MockUpdateResult:
     def __init__(self, modified_count):
@@ -57,38 +94,551 @@ class MockDeleteResult:
     def __init__(self, deleted_count):
         self.deleted_count = deleted_count
 
+COMPARISON_OPERATORS = {
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$ne": operator.ne,
+    "$in": lambda value, options: value in options,
+}
+
+def _is_equality(key, value):
+    return not key.startswith("$") and not isinstance(value, (dict, list))
+
+def _matches(doc, query):
+    """Evaluate a (minimal) MongoDB-style query against a document"""
+    for k, v in query.items():
+        if k == "$or":
+            if not any(_matches(doc, clause) for clause in v):
+                return False
+        elif k == "$and":
+            if not all(_matches(doc, clause) for clause in v):
+                return False
+        elif isinstance(v, dict):
+            value = doc.get(k)
+            for op, operand in v.items():
+                if op != "$ne" and value is None:
+                    return False
+                if not COMPARISON_OPERATORS[op](value, operand):
+                    return False
+        elif doc.get(k) != v:
+            return False
+    return True
+
+def _normalize_sort(key, direction=1):
+    """Accept both cursor.sort("field", dir) and cursor.sort([("field", dir), ...])"""
+    if isinstance(key, (list, tuple)):
+        return [(k, d) for k, d in key]
+    return [(key, direction)]
+
+def _sort_value(doc, key):
+    value = doc.get(key)
+    return "" if value is None else value
+
+class InMemoryIndex:
+    """Hash index mapping a tuple of field values to the matching documents.
+
+    Buckets are insertion-ordered dicts keyed by ``id(doc)``. When ``order_by``
+    is given, buckets are instead lists kept sorted on those fields, so range
+    bounds on the leading order field become a binary search.
+    """
+    def __init__(self, fields, order_by=()):
+        self.fields = tuple(fields)
+        self.order_by = tuple(order_by)
+        self.buckets: Dict[tuple, object] = {}
+
+    def key_for(self, doc):
+        return tuple(doc.get(f) for f in self.fields)
+
+    def order_key(self, doc):
+        return tuple(_sort_value(doc, f) for f in self.order_by)
+
+    def covers(self, equality):
+        return all(f in equality for f in self.fields)
+
+    def add(self, doc):
+        key = self.key_for(doc)
+        if not self.order_by:
+            self.buckets.setdefault(key, {})[id(doc)] = doc
+            return
+        bucket = self.buckets.setdefault(key, [])
+        # Messages arrive in timestamp order, so this is almost always an append
+        if not bucket or self.order_key(bucket[-1]) <= self.order_key(doc):
+            bucket.append(doc)
+        else:
+            bisect.insort(bucket, doc, key=self.order_key)
+
+    def remove(self, doc):
+        key = self.key_for(doc)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return
+        if not self.order_by:
+            bucket.pop(id(doc), None)
+        else:
+            pos = bisect.bisect_left(bucket, self.order_key(doc), key=self.order_key)
+            while pos < len(bucket) and bucket[pos] is not doc:
+                pos += 1
+            if pos < len(bucket):
+                del bucket[pos]
+        if not bucket:
+            del self.buckets[key]
+
+    def provides(self, order):
+        """Whether lookups can stream documents already sorted by ``order``"""
+        if not order or not self.order_by or len(order) > len(self.order_by):
+            return False
+        directions = {d for _, d in order}
+        return len(directions) == 1 and all(k == f for (k, _), f in zip(order, self.order_by))
+
+    def lookup(self, equality, bounds=None, descending=False):
+        bucket = self.buckets.get(tuple(equality[f] for f in self.fields))
+        if bucket is None:
+            return ()
+        if not self.order_by:
+            return bucket.values()
+
+        lo, hi = 0, len(bucket)
+        lead = self.order_by[0]
+        lead_value = lambda d: _sort_value(d, lead)
+        lead_bounds = (bounds or {}).get(lead)
+        for op, operand in (lead_bounds.items() if isinstance(lead_bounds, dict) else ()):
+            if op == "$gt":
+                lo = max(lo, bisect.bisect_right(bucket, operand, key=lead_value))
+            elif op == "$gte":
+                lo = max(lo, bisect.bisect_left(bucket, operand, key=lead_value))
+            elif op == "$lt":
+                hi = min(hi, bisect.bisect_left(bucket, operand, key=lead_value))
+            elif op == "$lte":
+                hi = min(hi, bisect.bisect_right(bucket, operand, key=lead_value))
+        if descending:
+            return (bucket[i] for i in range(hi - 1, lo - 1, -1))
+        return (bucket[i] for i in range(lo, hi))
+
 class InMemoryCollection:
-    def __init__(self, db, collection_name):
-        self.db = db
+    def __init__(self, collection_name, indexes=()):
         self.name = collection_name
+        self.docs: Dict[int, dict] = {}
+        self.indexes = [
+            InMemoryIndex(*spec) if isinstance(spec[0], tuple) else InMemoryIndex(spec)
+            for spec in indexes
+        ]
+    
+    def _plan(self, query, order=None):
+        """Pick index lookups for a query.
+
+        Returns ``(runs, ordered)`` where ``runs`` is a list of candidate
+        iterables (None when only a full scan will do) and ``ordered`` says
+        whether every run already yields documents in ``order``.
+        """
+        equality = {k: v for k, v in query.items() if _is_equality(k, v)}
+        best = None
+        for index in self.indexes:
+            if index.covers(equality) and (best is None or len(index.fields) > len(best.fields)):
+                best = index
+        if best is not None:
+            ordered = best.provides(order)
+            descending = ordered and order[0][1] == -1
+            return [best.lookup(equality, query, descending)], ordered
+        
+        rest = {k: v for k, v in query.items() if k not in ("$or", "$and")}
+        if "$or" in query:
+            # Union of per-clause index lookups
+            runs, ordered = [], True
+            for clause in query["$or"]:
+                clause_runs, clause_ordered = self._plan({**rest, **clause}, order)
+                if clause_runs is None:
+                    return None, False
+                runs.extend(clause_runs)
+                ordered = ordered and clause_ordered
+            return runs, ordered
+        for clause in query.get("$and", ()):
+            # Any plannable conjunct narrows the candidates
+            runs, ordered = self._plan({**rest, **clause}, order)
+            if runs is not None:
+                return runs, ordered
+        return None, False
+    
+    def _scan(self, query, order=None, limit=None):
+        """Yield matching documents, sorted by ``order`` and capped at ``limit``"""
+        runs, ordered = self._plan(query, order)
+        if runs is None:
+            runs, ordered = [self.docs.values()], not order
+        
+        if ordered and order and len(runs) > 1:
+            keys = [k for k, _ in order]
+            candidates = heapq.merge(
+                *runs,
+                key=lambda d: tuple(_sort_value(d, k) for k in keys),
+                reverse=order[0][1] == -1,
+            )
+        else:
+            candidates = itertools.chain.from_iterable(runs)
+        
+        seen = set()
+        matched = []
+        for doc in candidates:
+            if id(doc) in seen or not _matches(doc, query):
+                continue
+            seen.add(id(doc))
+            matched.append(doc)
+            if ordered and limit and len(matched) >= limit:
+                break
+        
+        if not ordered:
+            # Stable sorts applied from the least significant key
+            for key, direction in reversed(order or []):
+                matched.sort(key=lambda d: _sort_value(d, key), reverse=(direction == -1))
+            if limit:
+                matched = matched[:limit]
+        return matched
+    
+    def _select(self, query):
+        return self._scan(query)
+    
+    def _first(self, query):
+        matched = self._scan(query, limit=1)
+        return matched[0] if matched else None
     
     async def insert_one(self, doc):
-        self.db[self.name].append(doc)
+        self.docs[id(doc)] = doc
+        for index in self.indexes:
+            index.add(doc)
         return {"inserted_id": doc.get("id")}
-    
+
+    async def insert_many(self, docs):
+        # "id" acts as the primary key, so replaying a batch doesn't duplicate it
+        for doc in docs:
+            if "id" in doc and self._first({"id": doc["id"]}) is not None:
+                continue
+            await self.insert_one(doc)
+        return {"inserted_ids": [doc.get("id") for doc in docs]}
+
+    async def bulk_set(self, updates):
+        """Apply {id: {field: value}} updates; returns the number of documents changed"""
+        modified = 0
+        for doc_id, fields in updates.items():
+            result = await self.update_one({"id": doc_id}, {"$set": fields})
+            modified += result.modified_count
+        return modified
+
     async def find_one(self, query):
-        for doc in self.db[self.name]:
-            if all(doc.get(k) == v for k, v in query.items()):
-                return doc
-        return None
+        return self._first(query)
     
     def find(self, query=None, projection=None):
-        return InMemoryCursor(self.db[self.name], query or {}, projection or {})
+        return InMemoryCursor(self, query or {}, projection or {})
     
     async def update_one(self, query, update):
-        for doc in self.db[self.name]:
-            if all(doc.get(k) == v for k, v in query.items()):
-                if "$set" in update:
-                    doc.update(update["$set"])
-                return MockUpdateResult(1)
-        return MockUpdateResult(0)
+        doc = self._first(query)
+        if doc is None:
+            return MockUpdateResult(0)
+        self._apply(doc, update)
+        return MockUpdateResult(1)
+
+    async def update_many(self, query, update):
+        docs = list(self._select(query))
+        for doc in docs:
+            self._apply(doc, update)
+        return MockUpdateResult(len(docs))
+
+    def _apply(self, doc, update):
+        if "$set" in update:
+            changed = update["$set"].keys()
+            touched = [
+                index for index in self.indexes
+                if any(f in changed for f in index.fields + index.order_by)
+            ]
+            for index in touched:
+                index.remove(doc)
+            doc.update(update["$set"])
+            for index in touched:
+                index.add(doc)
     
     async def delete_one(self, query):
-        for i, doc in enumerate(self.db[self.name]):
-            if all(doc.get(k) == v for k, v in query.items()):
-                self.db[self.name].pop(i)
-                return MockDeleteResult(1)
-        return MockDeleteResult(0)
+        doc = self._first(query)
+        if doc is None:
+            return MockDeleteResult(0)
+        self._remove(doc)
+        return MockDeleteResult(1)
+
+    def _remove(self, doc):
+        for index in self.indexes:
+            index.remove(doc)
+        del self.docs[id(doc)]
+
+class InMemoryMessagesCollection(InMemoryCollection):
+    """Messages collection that keeps per-(recipient, sender) unread counters
+    and the latest message of every conversation.
+
+    Both move with every insert, update and delete, mirroring the
+    ``unread_counts`` and ``conversations`` triggers on PostgreSQL.
+    """
+
+    def __init__(self, collection_name, indexes=()):
+        super().__init__(collection_name, indexes)
+        self.unread: Dict[str, Dict[str, int]] = {}
+        # user -> peer -> latest message document (edits show through in place)
+        self.latest: Dict[str, Dict[str, dict]] = {}
+
+    def _count(self, doc, delta):
+        if not delta or doc.get("read", False):
+            return
+        senders = self.unread.setdefault(doc.get("to_user_id"), {})
+        count = senders.get(doc.get("from_user_id"), 0) + delta
+        if count > 0:
+            senders[doc.get("from_user_id")] = count
+        else:
+            senders.pop(doc.get("from_user_id"), None)
+            if not senders:
+                del self.unread[doc.get("to_user_id")]
+
+    def _summarize(self, doc):
+        key = (doc.get("timestamp"), doc.get("id"))
+        for user, peer in ((doc.get("from_user_id"), doc.get("to_user_id")),
+                           (doc.get("to_user_id"), doc.get("from_user_id"))):
+            peers = self.latest.setdefault(user, {})
+            current = peers.get(peer)
+            if current is None or key > (current.get("timestamp"), current.get("id")):
+                peers[peer] = doc
+
+    def _resummarize(self, doc):
+        # The latest message went away; fall back to the one before it
+        a, b = doc.get("from_user_id"), doc.get("to_user_id")
+        for user, peer in ((a, b), (b, a)):
+            if self.latest.get(user, {}).get(peer) is doc:
+                del self.latest[user][peer]
+        previous = self._scan(
+            {"$or": [{"from_user_id": a, "to_user_id": b}, {"from_user_id": b, "to_user_id": a}]},
+            [("timestamp", -1), ("id", -1)], limit=1,
+        )
+        if previous:
+            self._summarize(previous[0])
+
+    async def insert_one(self, doc):
+        result = await super().insert_one(doc)
+        self._count(doc, 1)
+        self._summarize(doc)
+        return result
+
+    def _apply(self, doc, update):
+        self._count(doc, -1)
+        super()._apply(doc, update)
+        self._count(doc, 1)
+
+    def _remove(self, doc):
+        self._count(doc, -1)
+        super()._remove(doc)
+        self._resummarize(doc)
+
+    async def unread_counts(self, recipient_id):
+        return dict(self.unread.get(recipient_id, {}))
+
+    async def inbox(self, user_id, limit):
+        peers = self.latest.get(user_id, {})
+        unread = self.unread.get(user_id, {})
+        recent = heapq.nlargest(limit, peers.items(), key=lambda item: (item[1].get("timestamp"), item[1].get("id")))
+        return [
+            {
+                "peer_id": peer,
+                "last_message": {
+                    "id": doc.get("id"),
+                    "from_user_id": doc.get("from_user_id"),
+                    "message": doc.get("message"),
+                    "file_type": doc.get("file_type"),
+                    "deleted": doc.get("deleted", False),
+                    "timestamp": doc.get("timestamp"),
+                },
+                "unread": unread.get(peer, 0),
+            }
+            for peer, doc in recent
+        ]
+
+class InMemoryFriendsCollection(InMemoryCollection):
+    """Friends collection that keeps accepted friendships as symmetric edges,
+    mirroring the ``friend_edges`` table on PostgreSQL.
+    """
+
+    def __init__(self, collection_name, indexes=()):
+        super().__init__(collection_name, indexes)
+        # user -> friend ids in order (for keyset pages) and friend -> username
+        self.edge_ids: Dict[str, List[str]] = {}
+        self.edge_names: Dict[str, Dict[str, str]] = {}
+
+    def _link(self, user_id, friend_id, friend_username):
+        names = self.edge_names.setdefault(user_id, {})
+        if friend_id not in names:
+            bisect.insort(self.edge_ids.setdefault(user_id, []), friend_id)
+        names[friend_id] = friend_username
+
+    def _unlink(self, user_id, friend_id):
+        names = self.edge_names.get(user_id, {})
+        if names.pop(friend_id, None) is None:
+            return
+        ids = self.edge_ids[user_id]
+        del ids[bisect.bisect_left(ids, friend_id)]
+        if not ids:
+            del self.edge_ids[user_id], self.edge_names[user_id]
+
+    def _track(self, doc, accepted):
+        if doc.get("status") != "accepted":
+            return
+        user_id, friend_id = doc.get("user_id"), doc.get("friend_id")
+        if accepted:
+            self._link(user_id, friend_id, doc.get("friend_username"))
+            self._link(friend_id, user_id, doc.get("username"))
+            return
+        # Keep the edges if the pair is still accepted through another row
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            other = self._first({"user_id": a, "friend_id": b, "status": "accepted"})
+            if other is not None and other is not doc:
+                return
+        self._unlink(user_id, friend_id)
+        self._unlink(friend_id, user_id)
+
+    async def insert_one(self, doc):
+        result = await super().insert_one(doc)
+        self._track(doc, True)
+        return result
+
+    def _apply(self, doc, update):
+        self._track(doc, False)
+        super()._apply(doc, update)
+        self._track(doc, True)
+
+    def _remove(self, doc):
+        super()._remove(doc)
+        self._track(doc, False)
+
+    async def accepted(self, user_id, after=None, limit=None):
+        ids = self.edge_ids.get(user_id, [])
+        names = self.edge_names.get(user_id, {})
+        start = bisect.bisect_right(ids, after) if after is not None else 0
+        end = len(ids) if limit is None else start + limit
+        return [{"friend_id": f, "friend_username": names[f]} for f in ids[start:end]]
+
+class InMemoryReactionsCollection:
+    """Reactions keyed by (message, emoji, user) with per-emoji counts,
+    mirroring ``message_reactions`` / ``message_reaction_counts`` on PostgreSQL.
+    """
+
+    def __init__(self):
+        # message -> emoji -> users who reacted
+        self.users: Dict[str, Dict[str, Set[str]]] = {}
+
+    async def toggle(self, message_id, emoji, user_id):
+        emojis = self.users.setdefault(message_id, {})
+        reactors = emojis.setdefault(emoji, set())
+        added = user_id not in reactors
+        if added:
+            reactors.add(user_id)
+        else:
+            reactors.discard(user_id)
+            if not reactors:
+                del emojis[emoji]
+                if not emojis:
+                    del self.users[message_id]
+        return added, {e: len(u) for e, u in self.users.get(message_id, {}).items()}
+
+    async def summaries(self, message_ids, viewer_id):
+        result = {}
+        for message_id in message_ids:
+            emojis = self.users.get(message_id)
+            if emojis:
+                result[message_id] = {
+                    "counts": {e: len(u) for e, u in emojis.items()},
+                    "mine": [e for e, u in emojis.items() if viewer_id in u],
+                }
+        return result
+
+class InMemoryStatusesCollection:
+    """Statuses filed into hourly buckets by expiry; a bucket is dropped whole
+    once its hour has passed, mirroring the daily ``statuses`` /
+    ``status_views`` partitions on PostgreSQL.
+    """
+
+    BUCKET_SECONDS = 3600
+
+    def __init__(self, friends, recent_viewers: int = 50):
+        self.friends = friends
+        self.recent_viewers = recent_viewers
+        self.docs: Dict[str, dict] = {}
+        self.expiry: Dict[str, float] = {}
+        # author -> status id -> doc, in creation order
+        self.by_user: Dict[str, Dict[str, dict]] = {}
+        # status -> everyone who viewed it (for idempotent counting) and the latest few, newest last
+        self.viewers: Dict[str, Set[str]] = {}
+        self.recent: Dict[str, deque] = {}
+        # bucket -> status ids expiring within it, plus a heap of the buckets
+        self.buckets: Dict[int, List[str]] = {}
+        self.bucket_heap: List[int] = []
+
+    def _live(self, status_id, now):
+        return status_id in self.docs and self.expiry[status_id] > now
+
+    async def create(self, doc):
+        expires = datetime.fromisoformat(doc["expires_at"]).timestamp()
+        self.docs[doc["id"]] = doc
+        self.expiry[doc["id"]] = expires
+        self.by_user.setdefault(doc["user_id"], {})[doc["id"]] = doc
+        self.viewers[doc["id"]] = set()
+        self.recent[doc["id"]] = deque(maxlen=self.recent_viewers)
+        bucket = int(expires // self.BUCKET_SECONDS)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = []
+            heapq.heappush(self.bucket_heap, bucket)
+        self.buckets[bucket].append(doc["id"])
+
+    async def feed(self, user_id, viewers_limit, limit):
+        now = await self.expire()
+        authors = [user_id] + [f["friend_id"] for f in await self.friends.accepted(user_id)]
+        docs = [
+            doc for author in authors for doc in self.by_user.get(author, {}).values()
+            if self.expiry[doc["id"]] > now
+        ]
+        docs.sort(key=lambda doc: doc["created_at"], reverse=True)
+        result = []
+        for doc in docs[:limit]:
+            viewers = self.viewers[doc["id"]]
+            own = doc["user_id"] == user_id
+            result.append({
+                **doc,
+                "view_count": len(viewers),
+                "viewed": user_id in viewers,
+                "viewers": list(itertools.islice(reversed(self.recent[doc["id"]]), viewers_limit)) if own else None,
+            })
+        return result
+
+    async def view(self, status_id, viewer_id, expires_at=None):
+        now = await self.expire()
+        if not self._live(status_id, now):
+            return None
+        viewers = self.viewers[status_id]
+        if self.docs[status_id]["user_id"] == viewer_id or viewer_id in viewers:
+            return False
+        viewers.add(viewer_id)
+        self.recent[status_id].append(viewer_id)
+        return True
+
+    async def expire(self):
+        """Drop every bucket whose hour has passed; returns the current time"""
+        now = datetime.now(timezone.utc).timestamp()
+        current = int(now // self.BUCKET_SECONDS)
+        while self.bucket_heap and self.bucket_heap[0] < current:
+            for status_id in self.buckets.pop(heapq.heappop(self.bucket_heap)):
+                doc = self.docs.pop(status_id)
+                del self.expiry[status_id], self.viewers[status_id], self.recent[status_id]
+                authored = self.by_user[doc["user_id"]]
+                del authored[status_id]
+                if not authored:
+                    del self.by_user[doc["user_id"]]
+        return now
+
+# Collections that maintain derived state (counters, summaries, edges) on write
+IN_MEMORY_COLLECTION_TYPES = {
+    "messages": InMemoryMessagesCollection,
+    "friends": InMemoryFriendsCollection,
+}
 
 class InMemoryCursor:
     def __init__(self, collection, query, projection):
@@ -96,54 +646,27 @@ class InMemoryCursor:
         self.query = query
         self.projection = projection
         self._results = None
-        self._sort_key = None
-        self._sort_dir = 1
+        self._sort = []
+        self._limit = None
         self._iterator = None
     
     def sort(self, key, direction=1):
-        self._sort_key = key
-        self._sort_dir = direction
+        self._sort = _normalize_sort(key, direction)
+        return self
+    
+    def limit(self, count):
+        self._limit = count or None
         return self
     
-    def _execute_query(self):
+    def _execute_query(self, max_size=None):
         if self._results is not None:
             return
 
-        results = []
-        for doc in self.collection:
-            # Complex filtering logic matching MongoDB query structure minimally
-            match = True
-            for k, v in self.query.items():
-                if k == "$or":
-                    # Handle $or: list of conditions, one must be true
-                    or_match = False
-                    for or_clause in v:
-                        clause_match = True
-                        for k2, v2 in or_clause.items():
-                            if doc.get(k2) != v2:
-                                clause_match = False
-                                break
-                        if clause_match:
-                            or_match = True
-                            break
-                    if not or_match:
-                        match = False
-                        break
-                elif doc.get(k) != v:
-                    match = False
-                    break
-            
-            if match:
-                results.append(doc)
-        
-        if self._sort_key:
-            results.sort(key=lambda x: x.get(self._sort_key, ""), reverse=(self._sort_dir == -1))
-
-        
-        self._results = results
+        limit = min(filter(None, (self._limit, max_size)), default=None)
+        self._results = self.collection._scan(self.query, self._sort, limit)
 
     async def to_list(self, max_size):
-        self._execute_query()
+        self._execute_query(max_size)
         if max_size is None or max_size == 0:
             return self._results
         return self._results[:max_size]
@@ -178,6 +701,18 @@ database_url = os.environ.get('DATABASE_URL', '')  # PostgreSQL URL from Render
 mongo_url = os.environ.get('MONGO_URL', '')  # MongoDB URL (legacy)
 db_name = os.environ.get('DB_NAME', 'chatroom_db')
 
+# PostgreSQL pool sizing and timeouts
+PG_POOL_MIN_SIZE = int(os.environ.get('PG_POOL_MIN_SIZE', '1'))
+PG_POOL_MAX_SIZE = int(os.environ.get('PG_POOL_MAX_SIZE', '10'))
+# Per-statement limit; a runaway query gives its connection back instead of pinning it.
+# Schema migrations run on their own connection without it.
+PG_COMMAND_TIMEOUT = float(os.environ.get('PG_COMMAND_TIMEOUT', '10'))
+# Idle connections above min size are closed after this long
+PG_MAX_INACTIVE_LIFETIME = float(os.environ.get('PG_MAX_INACTIVE_LIFETIME', '300'))
+# How long a request waits for a free connection before it gets a 503
+PG_ACQUIRE_TIMEOUT = float(os.environ.get('PG_ACQUIRE_TIMEOUT', '5'))
+PG_SLOW_QUERY_MS = float(os.environ.get('PG_SLOW_QUERY_MS', '200'))
+
 # Initialize database
 client = None
 db = None
@@ -191,7 +726,15 @@ async def init_db():
     if database_url:
         try:
             logger.info("Attempting PostgreSQL connection...")
-            postgres_db = PostgresDB(database_url)
+            postgres_db = PostgresDB(
+                database_url,
+                min_size=PG_POOL_MIN_SIZE,
+                max_size=PG_POOL_MAX_SIZE,
+                command_timeout=PG_COMMAND_TIMEOUT,
+                max_inactive_lifetime=PG_MAX_INACTIVE_LIFETIME,
+                acquire_timeout=PG_ACQUIRE_TIMEOUT,
+                slow_query_ms=PG_SLOW_QUERY_MS,
+            )
             await postgres_db.connect()
             db = postgres_db
             logger.info("[OK] PostgreSQL connected successfully")
@@ -215,6 +758,16 @@ async def init_db():
                 tlsAllowInvalidCertificates=True
             )
             db = client[db_name]
+            # The reaction toggle relies on one document per (message, emoji, user)
+            await db.message_reactions.create_index(
+                [("message_id", 1), ("emoji", 1), ("user_id", 1)], unique=True
+            )
+            # Statuses and their views are removed by TTL indexes on expires_at;
+            # one view document per (status, viewer) makes view counting idempotent
+            await db.statuses.create_index("expires_at", expireAfterSeconds=0)
+            await db.statuses.create_index([("user_id", 1), ("expires_at", 1)])
+            await db.status_views.create_index("expires_at", expireAfterSeconds=0)
+            await db.status_views.create_index([("status_id", 1), ("viewer_id", 1)], unique=True)
             logger.info("[OK] MongoDB connected")
             return
         except Exception as e:
@@ -232,24 +785,108 @@ async def close_db():
         client.close()
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    max_queue=int(os.environ.get('PASSWORD_HASH_QUEUE', '64')),
+)
+
+# Messages and message updates from WebSocket traffic are persisted in batches
+message_writer = WriteBehind(
+    lambda: db.messages,
+    max_batch=int(os.environ.get('MESSAGE_WRITE_BATCH', '500')),
+    flush_interval=int(os.environ.get('MESSAGE_WRITE_FLUSH_MS', '50')) / 1000,
+    max_pending=int(os.environ.get('MESSAGE_WRITE_MAX_PENDING', '10000')),
+    max_retries=int(os.environ.get('MESSAGE_WRITE_RETRIES', '3')),
+    retry_delay=int(os.environ.get('MESSAGE_WRITE_RETRY_MS', '500')) / 1000,
+)
+
+# Messages are logged here before fan-out and replayed on startup if the database
+# never got them; set MESSAGE_WAL_DIR to an empty string to disable
+MESSAGE_WAL_DIR = os.environ.get('MESSAGE_WAL_DIR', str(ROOT_DIR / 'wal'))
+MESSAGE_WAL_FSYNC_MS = float(os.environ.get('MESSAGE_WAL_FSYNC_MS', '0'))
+message_wal: Optional[MessageWAL] = None
+
+async def open_message_wal():
+    """Replay writes the last run logged but never persisted, then log new ones"""
+    global message_wal
+    # InMemoryDB doesn't survive a restart, so there is nothing to recover into
+    if not MESSAGE_WAL_DIR or db is None or isinstance(db, InMemoryDB):
+        return
+    wal = MessageWAL(MESSAGE_WAL_DIR, fsync_interval=MESSAGE_WAL_FSYNC_MS / 1000)
+    pending = await asyncio.to_thread(wal.open)
+    if pending:
+        failed = await message_writer.replay(pending)
+        logger.info(f"Replayed {len(pending)} logged message writes ({len(failed)} still failing)")
+        wal.ack(
+            record["lsn"] for record in pending
+            if (record["doc"]["id"] if record["op"] == "insert" else record["id"]) not in failed
+        )
+    message_writer.wal = wal
+    message_wal = wal
 
 # Create uploads directory
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Per-type upload size limits; larger files should use the resumable endpoints
+UPLOAD_LIMITS_MB = {
+    "image": int(os.environ.get('UPLOAD_MAX_IMAGE_MB', '25')),
+    "video": int(os.environ.get('UPLOAD_MAX_VIDEO_MB', '1024')),
+    "file": int(os.environ.get('UPLOAD_MAX_FILE_MB', '100')),
+}
+UPLOAD_CHUNK_KB = int(os.environ.get('UPLOAD_CHUNK_KB', '1024'))
+# Resumable uploads idle for longer than this are discarded
+UPLOAD_SESSION_TTL = float(os.environ.get('UPLOAD_SESSION_TTL', '3600'))
+upload_store = UploadStore(
+    UPLOAD_DIR,
+    limits={file_type: mb * 1024 * 1024 for file_type, mb in UPLOAD_LIMITS_MB.items()},
+    chunk_size=UPLOAD_CHUNK_KB * 1024,
+    session_ttl=UPLOAD_SESSION_TTL,
+)
+# Thumbnails, video posters and blur placeholders, generated after upload
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_QUEUE = int(os.environ.get('THUMBNAIL_QUEUE', '256'))
+thumbnail_pool = ThumbnailPool(
+    UPLOAD_DIR / "thumbs", "/uploads/thumbs", workers=THUMBNAIL_WORKERS, max_queue=THUMBNAIL_QUEUE,
+)
+
 app = FastAPI()
 
+@app.exception_handler(DatabaseBusy)
+async def database_busy_handler(request, exc):
+    # Pool saturated: shed the request rather than queue it behind the others
+    return JSONResponse(status_code=503, content={"detail": "Database busy, retry shortly"},
+                        headers={"Retry-After": "1"})
+
 # Startup and shutdown events
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    thumbnail_pool.start()
+    global status_sweeper
+    status_sweeper = asyncio.create_task(sweep_expired_statuses())
+    await open_message_wal()
+    await manager.backplane.start(manager.receive_envelope, lambda: list(manager.users.values()))
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if status_sweeper is not None:
+        status_sweeper.cancel()
+    await manager.backplane.close()
+    if db is not None:
+        await read_receipts.flush()
+        await message_writer.close()
+    if message_wal is not None:
+        await message_wal.close()
     await close_db()
+    password_hasher.shutdown()
+    upload_store.close()
+    await thumbnail_pool.close()
 
 # Mount static files for serving uploaded files
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+# Every upload path is written once (randomly keyed blobs and their thumbs, uuid legacy names)
+app.mount("/uploads", CachedStaticFiles(directory=str(UPLOAD_DIR), cache_control=lambda path: IMMUTABLE), name="uploads")
 
 # Serve React Frontend
 # We expect the frontend build to be in the 'frontend/build' directory relative to the project root
@@ -257,18 +894,29 @@ app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 FRONTEND_BUILD_DIR = ROOT_DIR.parent / "frontend" / "build"
 
 if FRONTEND_BUILD_DIR.exists():
-    # Mount static assets (JS, CSS, media)
-    app.mount("/static", StaticFiles(directory=str(FRONTEND_BUILD_DIR / "static")), name="static")
+    # Mount static assets (JS, CSS, media); the build puts a content hash in every name
+    app.mount("/static", CachedStaticFiles(
+        directory=str(FRONTEND_BUILD_DIR / "static"), cache_control=lambda path: IMMUTABLE, precompressed=True,
+    ), name="static")
+    # index.html, manifest.json etc. keep their names across builds, so are revalidated
+    frontend_root = CachedStaticFiles(
+        directory=str(FRONTEND_BUILD_DIR), cache_control=lambda path: REVALIDATE, precompressed=True,
+    )
     
     # Catch-all route to serve index.html for React Router
     @app.get("/{full_path:path}")
-    async def serve_react_app(full_path: str):
+    async def serve_react_app(full_path: str, request: Request):
         # Allow API calls to pass through
         if full_path.startswith("api/") or full_path.startswith("uploads/"):
              raise HTTPException(status_code=404, detail="Not found")
-             
-        # Serve index.html
-        return FileResponse(str(FRONTEND_BUILD_DIR / "index.html"))
+        
+        # Files at the root of the build (favicon, manifest), else index.html
+        if full_path and "/" not in full_path:
+            try:
+                return await frontend_root.get_response(full_path, request.scope)
+            except StarletteHTTPException:
+                pass
+        return await frontend_root.get_response("index.html", request.scope)
 else:
     logger.warning(f"Frontend build directory not found at {FRONTEND_BUILD_DIR}. API only mode.")
 
@@ -283,15 +931,65 @@ app.add_middleware(
 
 api_router = APIRouter(prefix="/api")
 
+# Conversation history paging
+MESSAGE_PAGE_SIZE = int(os.environ.get('MESSAGE_PAGE_SIZE', '100'))
+MAX_MESSAGE_PAGE_SIZE = 1000
+
+# Sends that take longer than this are treated as a stuck client
+WS_SEND_TIMEOUT = float(os.environ.get('WS_SEND_TIMEOUT', '5'))
+# Outbound queue depth at which typing indicators are shed
+WS_OUTBOX_SOFT_LIMIT = int(os.environ.get('WS_OUTBOX_SOFT_LIMIT', '64'))
+# Outbound queue depth at which a client is disconnected as a slow consumer
+WS_OUTBOX_HIGH_WATER = int(os.environ.get('WS_OUTBOX_HIGH_WATER', '256'))
+# Presence changes within this window are batched into one notification
+PRESENCE_COALESCE_MS = int(os.environ.get('PRESENCE_COALESCE_MS', '250'))
+# Cross-worker routing; unset for a single process, redis://host:6379/0 to scale out
+BACKPLANE_URL = os.environ.get('BACKPLANE_URL')
+BACKPLANE_TTL = float(os.environ.get('BACKPLANE_TTL', '30'))
+
+def _presence_subject(event: dict) -> str:
+    return event["user_id"] if event["type"] == "user-left" else event["user"]["id"]
+
 # WebSocket Connection Manager
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, send_timeout: float = WS_SEND_TIMEOUT,
+                 soft_limit: int = WS_OUTBOX_SOFT_LIMIT, high_water: int = WS_OUTBOX_HIGH_WATER,
+                 presence_window: float = PRESENCE_COALESCE_MS / 1000, backplane=None):
         self.active_connections: Dict[str, WebSocket] = {}
         self.users: Dict[str, dict] = {}
+        self.outboxes: Dict[str, Outbox] = {}
+        self.send_timeout = send_timeout
+        self.soft_limit = soft_limit
+        self.high_water = high_water
+        self.evicted = 0
+        # Per-recipient presence frame counter; clients that see a gap ask for a snapshot
+        self.presence_seq: Dict[str, int] = {}
+        self.presence_window = presence_window
+        # user_id -> (event, epoch); epochs order presence changes against snapshots
+        self._pending_presence: Dict[str, tuple] = {}
+        self._presence_epoch = 0
+        self._snapshot_epoch: Dict[str, int] = {}
+        self._presence_flush = None
+        self.presence_stats = {"events": 0, "emitted": 0, "broadcasts": 0, "deliveries": 0}
+        # Accepted friendships (user_id -> friend ids), loaded per user on connect;
+        # presence is only fanned out along these edges
+        self.friends: Dict[str, Set[str]] = {}
+        # Routes frames for users whose socket lives on another worker
+        self.backplane = backplane or create_backplane(None)
+
+    def open_outbox(self, user_id: str, websocket: WebSocket):
+        previous = self.outboxes.get(user_id)
+        if previous is not None:
+            previous.close()
+        self.outboxes[user_id] = Outbox(
+            user_id, websocket, self.evict,
+            soft_limit=self.soft_limit, high_water=self.high_water, send_timeout=self.send_timeout
+        )
 
     async def connect(self, websocket: WebSocket, user_id: str, username: str):
         await websocket.accept()
         self.active_connections[user_id] = websocket
+        self.open_outbox(user_id, websocket)
         
         # Fetch user details (like avatar) from DB if possible, or use defaults
         avatar_url = None
@@ -307,35 +1005,276 @@ class ConnectionManager:
             "connected_at": datetime.now(timezone.utc).isoformat()
         }
         logger.info(f"User {username} ({user_id}) connected")
-        await self.broadcast_users_update()
-
-    def disconnect(self, user_id: str):
+        await self.load_friends(user_id)
+        await self.backplane.register(self.users[user_id])
+        self.presence_seq[user_id] = 0
+        await self.send_presence_snapshot(user_id)
+        await self.publish_presence("user-joined", user_id)
+
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """Forget a connection; returns True if the user went offline"""
+        # Ignore stale sockets so a late disconnect can't drop the user's newer connection
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return False
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+        outbox = self.outboxes.pop(user_id, None)
+        if outbox is not None:
+            outbox.close()
+        self.presence_seq.pop(user_id, None)
+        self._snapshot_epoch.pop(user_id, None)
         if user_id in self.users:
             username = self.users[user_id]["username"]
             del self.users[user_id]
             logger.info(f"User {username} ({user_id}) disconnected")
+            return True
+        return False
 
-    async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(json.dumps(message))
+    async def load_friends(self, user_id: str):
+        """Cache a user's accepted friendships, both directions"""
+        friend_ids = set()
+        if db is not None:
+            friend_ids = {friend["friend_id"] for friend in await list_friends(user_id)}
+        self.friends[user_id] = friend_ids
+
+    def online_friends(self, user_id: str) -> List[str]:
+        return [f for f in self.friends.get(user_id, ()) if f in self.active_connections]
+
+    async def locate(self, user_ids) -> Dict[str, dict]:
+        """Directory entries ({"node", "user"}) for online users, local or on other workers"""
+        located = {}
+        remote = []
+        for user_id in user_ids:
+            if user_id in self.users:
+                located[user_id] = {"node": self.backplane.node_id, "user": self.users[user_id]}
+            else:
+                remote.append(user_id)
+        if remote and self.backplane.distributed:
+            located.update(await self.backplane.locate(remote))
+        return located
+
+    async def add_friendship(self, user_id: str, friend_id: str):
+        """Record a newly accepted friendship and introduce the two if both are online"""
+        located = await self.locate([user_id, friend_id])
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            friend = located[b]["user"] if b in located else None
+            if a not in located or located[a]["node"] == self.backplane.node_id:
+                self._apply_friendship(a, b, friend)
+            else:
+                await self.backplane.send(located[a]["node"], {
+                    "kind": "friendship", "user_id": a, "friend_id": b, "friend": friend
+                })
+
+    def _apply_friendship(self, user_id: str, friend_id: str, friend: Optional[dict]):
+        if user_id in self.friends:
+            self.friends[user_id].add(friend_id)
+        if friend is not None and user_id in self.active_connections:
+            self._send_presence(user_id, *self._presence_body([{"type": "user-joined", "user": friend}]))
+
+    def _forget_friends(self, user_id: str):
+        # Offline users' edges are reloaded on their next connect
+        if user_id not in self.active_connections and user_id not in self._pending_presence:
+            self.friends.pop(user_id, None)
+
+    async def drop(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnect a user and tell everyone else they left"""
+        if self.disconnect(user_id, websocket):
+            await self.backplane.unregister(user_id)
+            await self.publish_presence("user-left", user_id)
+
+    def _outbox_for(self, user_id: str) -> Optional[Outbox]:
+        outbox = self.outboxes.get(user_id)
+        websocket = self.active_connections.get(user_id)
+        if outbox is None or websocket is None or outbox.websocket is not websocket:
+            return None
+        return outbox
 
-    async def broadcast_users_update(self):
-        message = {
+    async def send_personal_message(self, message: dict, user_id: str):
+        outbox = self._outbox_for(user_id)
+        if outbox is not None:
+            outbox.put(message.get("type"), json.dumps(message))
+        elif user_id not in self.active_connections and self.backplane.distributed:
+            # Not ours: hand the frame to whichever worker holds the recipient's socket
+            entry = (await self.backplane.locate([user_id])).get(user_id)
+            if entry is not None and entry["node"] != self.backplane.node_id:
+                await self.backplane.send(entry["node"], {
+                    "kind": "direct", "to": user_id,
+                    "type": message.get("type"), "payload": json.dumps(message)
+                })
+
+    async def receive_envelope(self, envelope: dict):
+        """Deliver a frame another worker routed to one of our sockets"""
+        kind = envelope["kind"]
+        if kind == "direct":
+            outbox = self._outbox_for(envelope["to"])
+            if outbox is not None:
+                outbox.put(envelope["type"], envelope["payload"])
+        elif kind == "presence":
+            events = envelope["events"]
+            bodies = {}
+            for recipient, indexes in envelope["views"].items():
+                view = tuple(indexes)
+                if view not in bodies:
+                    bodies[view] = (*self._presence_body([events[i] for i in view]), {})
+                self._send_presence(recipient, *bodies[view])
+        elif kind == "friendship":
+            self._apply_friendship(envelope["user_id"], envelope["friend_id"], envelope["friend"])
+
+    async def send_presence_snapshot(self, user_id: str):
+        """Full presence state, sent on connect and when a client detects a gap"""
+        # Pending deltas up to now are already reflected in the snapshot
+        self._snapshot_epoch[user_id] = self._presence_epoch
+        online = await self.locate([user_id, *self.friends.get(user_id, ())])
+        await self.send_personal_message({
             "type": "users-update",
-            "users": list(self.users.values())
+            "users": [entry["user"] for entry in online.values()],
+            "version": self.presence_seq.get(user_id, 0)
+        }, user_id)
+
+    async def publish_presence(self, event: str, user_id: str):
+        """Queue a presence delta (user-joined / user-updated / user-left).
+
+        Deltas are batched for ``presence_window`` seconds so a reconnect storm
+        turns into a handful of notifications. Within a window only the net
+        change per user is kept, and a join followed by a leave cancels out.
+        """
+        self.presence_stats["events"] += 1
+        self._presence_epoch += 1
+        previous, _ = self._pending_presence.pop(user_id, (None, None))
+        if previous == "user-joined" and event == "user-left":
+            self._forget_friends(user_id)
+            return
+        if previous == "user-joined" or (previous == "user-left" and event != "user-left"):
+            event = "user-joined"
+        self._pending_presence[user_id] = (event, self._presence_epoch)
+
+        if self.presence_window <= 0:
+            await self.flush_presence()
+            return
+        flush = self._presence_flush
+        # The loop that scheduled a pending flush may be gone (TestClient runs one per socket)
+        if flush is None or flush.done() or flush.get_loop().is_closed():
+            self._presence_flush = asyncio.get_running_loop().create_task(self._flush_presence_later())
+
+    async def _flush_presence_later(self):
+        await asyncio.sleep(self.presence_window)
+        await self.flush_presence()
+
+    async def flush_presence(self):
+        pending, self._pending_presence = self._pending_presence, {}
+        self._presence_flush = None
+        events, epochs = [], []
+        for user_id, (event, epoch) in pending.items():
+            if event == "user-left":
+                events.append({"type": event, "user_id": user_id})
+            elif user_id in self.users:
+                events.append({"type": event, "user": self.users[user_id]})
+            else:
+                continue
+            epochs.append(epoch)
+        if not events:
+            return
+        self.presence_stats["emitted"] += len(events)
+        self.presence_stats["broadcasts"] += 1
+
+        # Walk each subject's friend list, so the cost is O(friends) per event rather
+        # than O(online users); skip anything a recipient's snapshot already covered
+        views: Dict[str, List[int]] = {}
+        for i, event in enumerate(events):
+            subject = _presence_subject(event)
+            for recipient in self.online_friends(subject):
+                if epochs[i] > self._snapshot_epoch.get(recipient, 0):
+                    views.setdefault(recipient, []).append(i)
+        if self.backplane.distributed:
+            await self._route_presence(events)
+        for user_id in pending:
+            self._forget_friends(user_id)
+
+        # One body per distinct view; friends who share a view and version share the bytes
+        bodies = {}
+        for recipient, indexes in views.items():
+            view = tuple(indexes)
+            if view not in bodies:
+                bodies[view] = (*self._presence_body([events[i] for i in view]), {})
+            self._send_presence(recipient, *bodies[view])
+
+    async def _route_presence(self, events: List[dict]):
+        """Forward presence events to friends connected to other workers, one envelope per worker"""
+        subjects = [_presence_subject(event) for event in events]
+        candidates = {
+            f for subject in subjects for f in self.friends.get(subject, ())
+            if f not in self.active_connections
+        }
+        located = await self.backplane.locate(candidates)
+        by_node: Dict[str, Dict[str, List[int]]] = {}
+        for i, subject in enumerate(subjects):
+            for friend in self.friends.get(subject, ()):
+                entry = located.get(friend)
+                if entry is not None and entry["node"] != self.backplane.node_id:
+                    by_node.setdefault(entry["node"], {}).setdefault(friend, []).append(i)
+        for node, views in by_node.items():
+            await self.backplane.send(node, {"kind": "presence", "events": events, "views": views})
+
+    @staticmethod
+    def _presence_body(events):
+        """(type, frame without its version) for one event or a batch"""
+        if len(events) == 1:
+            return events[0]["type"], events[0]
+        return "presence-batch", {"type": "presence-batch", "events": events}
+
+    def _send_presence(self, recipient: str, msg_type: str, body: dict, encoded: Optional[Dict[int, str]] = None):
+        """Send a presence frame with the recipient's next version.
+
+        ``encoded`` caches the serialized frame per version, for a body sent to many recipients.
+        """
+        outbox = self._outbox_for(recipient)
+        if outbox is None:
+            return
+        seq = self.presence_seq.get(recipient, 0) + 1
+        self.presence_seq[recipient] = seq
+        self.presence_stats["deliveries"] += 1
+        payload = encoded.get(seq) if encoded is not None else None
+        if payload is None:
+            frame = {"version": seq, **body}
+            frame["version"] = seq  # ours, even if the event carried one
+            payload = json.dumps(frame)
+            if encoded is not None:
+                encoded[seq] = payload
+        outbox.put(msg_type, payload)
+
+    async def broadcast(self, message: dict, exclude: Optional[str] = None):
+        # Encode once; each connection's writer task sends it concurrently and
+        # evicts the client if the send times out
+        payload = json.dumps(message)
+        msg_type = message.get("type")
+        for user_id in list(self.active_connections):
+            if user_id == exclude:
+                continue
+            outbox = self._outbox_for(user_id)
+            if outbox is not None:
+                outbox.put(msg_type, payload)
+
+    def queue_stats(self, limit: int = 50) -> dict:
+        """Outbound queue depth per user, deepest first, to spot slow consumers"""
+        outboxes = list(self.outboxes.values())
+        deepest = sorted(outboxes, key=lambda o: o.depth, reverse=True)[:limit]
+        return {
+            "total_depth": sum(o.depth for o in outboxes),
+            "dropped": sum(o.dropped for o in outboxes),
+            "coalesced": sum(o.coalesced for o in outboxes),
+            "deepest": [o.stats() for o in deepest],
         }
-        await self.broadcast(message)
 
-    async def broadcast(self, message: dict):
-        for connection in list(self.active_connections.values()):
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting message: {e}")
+    async def evict(self, user_id: str, websocket: WebSocket):
+        """Drop a stuck or broken client; its receive loop then winds down on the closed socket"""
+        await self.drop(user_id, websocket)
+        self.evicted += 1
+        try:
+            await asyncio.wait_for(websocket.close(code=status.WS_1011_INTERNAL_ERROR), self.send_timeout)
+        except Exception:
+            pass
 
-manager = ConnectionManager()
+manager = ConnectionManager(backplane=create_backplane(BACKPLANE_URL, os.environ.get('NODE_ID'), BACKPLANE_TTL))
 
 # Pydantic Models
 class UserCreate(BaseModel):
@@ -371,7 +1310,10 @@ class Message(BaseModel):
     file_url: str | None = None
     file_type: str | None = None  # "image", "video", "file", "audio"
     file_name: str | None = None
-    reactions: Dict[str, List[str]] = Field(default_factory=dict)  # emoji -> [user_ids]
+    # thumbnail_url (+ poster_url for video) and, once generated, placeholder/width/height
+    preview: Dict[str, Any] | None = None
+    reactions: Dict[str, int] = Field(default_factory=dict)  # emoji -> count, from the reactions store
+    my_reactions: List[str] = Field(default_factory=list)  # emojis the requesting user reacted with
     reply_to_id: str | None = None  # ID of message being replied to
     reply_to_text: str | None = None  # Original message text
     reply_to_username: str | None = None  # Original sender username
@@ -397,6 +1339,18 @@ class MessageEdit(BaseModel):
 class MessageReaction(BaseModel):
     emoji: str
 
+class UploadBegin(BaseModel):
+    file_name: str
+    size: int = Field(ge=0)
+
+class UploadCommit(BaseModel):
+    sha256: Optional[str] = None
+
+class ReadUpTo(BaseModel):
+    reader_id: str
+    sender_id: str
+    message_id: str
+
 class Friend(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
@@ -413,12 +1367,32 @@ class FriendRequest(BaseModel):
     to_user_id: Optional[str] = None
     to_username: str
 
+class StatusCreate(BaseModel):
+    user_id: str
+    username: str
+    content: str = ""
+    media_url: Optional[str] = None
+    media_type: Optional[str] = None
+
+class StatusView(BaseModel):
+    user_id: str
+    # As returned by the feed; lets PostgreSQL go straight to the status's partition
+    expires_at: Optional[str] = None
+
 # Helper functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashingQueueFull:
+        raise HTTPException(status_code=429, detail="Too many login attempts in progress, retry shortly",
+                            headers={"Retry-After": "1"})
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashingQueueFull:
+        raise HTTPException(status_code=429, detail="Too many registrations in progress, retry shortly",
+                            headers={"Retry-After": "1"})
 
 def get_file_type(filename: str) -> str:
     """Determine file type based on extension"""
@@ -435,30 +1409,123 @@ def get_file_type(filename: str) -> str:
 async def root():
     return {"message": "ConnectHub API"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    """In-process runtime metrics"""
+    return {
+        "password_hashing": password_hasher.stats(),
+        "connections": {
+            "active": len(manager.active_connections),
+            "evicted": manager.evicted,
+            "outbound_queues": manager.queue_stats(),
+        },
+        "presence": {
+            **manager.presence_stats,
+            "coalesced": manager.presence_stats["events"] - manager.presence_stats["emitted"],
+            "window_ms": manager.presence_window * 1000,
+            "cached_friend_lists": len(manager.friends),
+        },
+        "backplane": manager.backplane.stats(),
+        "message_writes": message_writer.stats(),
+        "read_receipts": read_receipts.stats(),
+        "inbox_cache": inbox_cache.stats(),
+        "message_wal": message_wal.stats() if message_wal is not None else None,
+        "postgres": db.stats() if isinstance(db, PostgresDB) else None,
+        "uploads": upload_store.stats(),
+        "thumbnails": thumbnail_pool.stats(),
+        "websocket_frames": ws_dispatcher.stats(),
+    }
+
+def upload_http_error(e: UploadError) -> HTTPException:
+    if isinstance(e, UploadTooLarge):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, UploadNotFound):
+        return HTTPException(status_code=404, detail="Upload not found or expired")
+    if isinstance(e, UploadOffsetMismatch):
+        # Tell the client where to resume from
+        return HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    return HTTPException(status_code=400, detail=str(e))
+
+def uploaded_file(stored: dict, file_name: str, file_type: str) -> dict:
+    # Every finished upload passes through here; start its preview in the background
+    thumbnail_pool.submit(stored["key"], upload_store.directory / stored["name"], file_type)
+    file_url = f"/uploads/{stored['name']}"
+    return {
+        "file_url": file_url,
+        "file_name": file_name,
+        "file_type": file_type,
+        "size": stored["size"],
+        "sha256": stored["sha256"],
+        "upload_id": stored["upload_id"],
+        "deduplicated": stored["deduplicated"],
+        "preview": thumbnail_pool.preview_for(file_url, file_type),
+    }
+
 @api_router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """Upload a file and return its URL"""
+async def upload_file(request: Request):
+    """Upload the multipart ``file`` field and return its URL.
+
+    The body is parsed as it arrives rather than spooled by the framework
+    first, so an oversized file is refused on its Content-Length or cut off
+    at its type's limit, and its bytes are written to disk once.
+    """
     try:
-        # Generate unique filename
-        file_ext = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = UPLOAD_DIR / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Get file type
-        file_type = get_file_type(file.filename)
-        
-        return {
-            "file_url": f"/uploads/{unique_filename}",
-            "file_name": file.filename,
-            "file_type": file_type
-        }
+        stored, file_name, file_type = await upload_store.save_multipart(
+            request.stream(), request.headers.get("content-type", ""),
+            request.headers.get("content-length"), get_file_type,
+        )
+    except UploadError as e:
+        raise upload_http_error(e)
     except Exception as e:
         logger.error(f"File upload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return uploaded_file(stored, file_name, file_type)
+
+# Resumable uploads: POST /uploads declares the file, PUT /uploads/{id}?offset=n
+# appends the raw request body, GET /uploads/{id} reports the offset to resume
+# from, and POST /uploads/{id}/commit publishes it. Content already stored is
+# only matched once its bytes have arrived and been hashed, so a checksum alone
+# can't claim (or probe for) someone else's file.
+@api_router.post("/uploads")
+async def begin_upload(req: UploadBegin):
+    file_type = get_file_type(req.file_name)
+    try:
+        session = upload_store.begin(req.file_name, file_type, req.size)
+    except UploadError as e:
+        raise upload_http_error(e)
+    return {"upload_id": session.id, "offset": 0, "chunk_size": upload_store.chunk_size}
+
+@api_router.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    try:
+        session = upload_store.status(upload_id)
+    except UploadError as e:
+        raise upload_http_error(e)
+    return {"upload_id": upload_id, "offset": session.received, "size": session.size}
+
+@api_router.put("/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    try:
+        received = await upload_store.append(upload_id, offset, request.stream())
+    except UploadError as e:
+        raise upload_http_error(e)
+    return {"upload_id": upload_id, "offset": received}
+
+@api_router.post("/uploads/{upload_id}/commit")
+async def commit_upload(upload_id: str, req: UploadCommit):
+    try:
+        session = upload_store.status(upload_id)
+        stored = await upload_store.commit(upload_id, req.sha256)
+    except UploadError as e:
+        raise upload_http_error(e)
+    return uploaded_file(stored, session.filename, session.file_type)
+
+@api_router.delete("/uploads/{upload_id}")
+async def release_upload(upload_id: str):
+    """Drop an upload; the stored file goes once no other upload shares its content"""
+    if not await upload_store.release(upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"status": "released"}
 
 @api_router.post("/register", response_model=User)
 async def register(user: UserCreate):
@@ -471,7 +1538,7 @@ async def register(user: UserCreate):
             raise HTTPException(status_code=400, detail="Username already registered")
         
         user_id = str(uuid.uuid4())
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash(user.password)
         
         new_user = {
             "id": user_id,
@@ -489,7 +1556,7 @@ async def register(user: UserCreate):
             avatar_url=user.avatar_url,
             created_at=new_user["created_at"]
         )
-    except HTTPException:
+    except (HTTPException, DatabaseBusy):
         raise
     except Exception as e:
         logger.error(f"Registration error: {e}", exc_info=True)
@@ -501,7 +1568,7 @@ async def login(user_in: UserLogin):
         raise HTTPException(status_code=503, detail="Database not available")
     
     user = await db.users.find_one({"username": user_in.username})
-    if not user or not verify_password(user_in.password, user["hashed_password"]):
+    if not user or not await verify_password(user_in.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -535,7 +1602,7 @@ async def update_profile(user_id: str, user_update: UserUpdate):
         # Update connection manager cache
         if user_id in manager.users:
             manager.users[user_id].update(update_data)
-            await manager.broadcast_users_update()
+            await manager.publish_presence("user-updated", user_id)
     
     updated_user = await db.users.find_one({"id": user_id})
     return User(
@@ -557,36 +1624,246 @@ async def get_unread_messages(user_id: str):
             "read": False
         }, {"_id": 0}).sort("timestamp", 1).to_list(1000)
         return unread
+    except DatabaseBusy:
+        raise
     except Exception as e:
         logger.error(f"Error fetching unread messages: {e}")
         return []
 
-@api_router.get("/messages/{user1_id}/{user2_id}", response_model=List[Message])
-async def get_messages(user1_id: str, user2_id: str):
+async def _stored_unread_counts(user_id: str) -> Dict[str, int]:
+    """Unread counts per sender as the database has them (write-behind buffer not included)"""
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        return await db.messages.unread_counts(user_id)
+    # MongoDB keeps no counters; group the unread rows server-side instead
+    rows = await db.messages.aggregate([
+        {"$match": {"to_user_id": user_id, "read": False}},
+        {"$group": {"_id": "$from_user_id", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    return {row["_id"]: row["count"] for row in rows}
+
+@api_router.get("/messages/unread-counts/{user_id}")
+async def get_unread_counts(user_id: str):
+    """Unread message counts per sender, for badges, without fetching the messages"""
     if db is None:
-        return []
-    
+        return {"total": 0, "by_sender": {}}
+
     try:
-        messages = await db.messages.find(
-            {
-                "$or": [
-                    {"from_user_id": user1_id, "to_user_id": user2_id},
-                    {"from_user_id": user2_id, "to_user_id": user1_id}
-                ]
+        # Snapshot before reading, so a batch written meanwhile isn't missed
+        pending, _ = message_writer.pending_writes()
+        counts = await _stored_unread_counts(user_id)
+        for doc in pending.values():
+            if doc["to_user_id"] == user_id and not doc.get("read"):
+                counts[doc["from_user_id"]] = counts.get(doc["from_user_id"], 0) + 1
+        return {"total": sum(counts.values()), "by_sender": counts}
+    except DatabaseBusy:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching unread counts: {e}")
+        return {"total": 0, "by_sender": {}}
+
+# Inbox responses are cached per user and invalidated by message writes and
+# reads; writes addressed only by message id (REST edit/delete/read) age out
+INBOX_CACHE_TTL_MS = int(os.environ.get('INBOX_CACHE_TTL_MS', '10000'))
+INBOX_CACHE_SIZE = int(os.environ.get('INBOX_CACHE_SIZE', '10000'))
+INBOX_PAGE_SIZE = 50
+MAX_INBOX_PAGE_SIZE = 200
+
+inbox_cache = InboxCache(ttl=INBOX_CACHE_TTL_MS / 1000, max_entries=INBOX_CACHE_SIZE)
+
+async def _mongo_inbox(user_id: str, limit: int) -> List[dict]:
+    # MongoDB keeps no summaries; take the newest message per peer server-side
+    rows = await db.messages.aggregate([
+        {"$match": {"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]}},
+        {"$sort": {"timestamp": -1, "id": -1}},
+        {"$group": {
+            "_id": {"$cond": [{"$eq": ["$from_user_id", user_id]}, "$to_user_id", "$from_user_id"]},
+            "last": {"$first": "$$ROOT"},
+        }},
+        {"$sort": {"last.timestamp": -1}},
+        {"$limit": limit},
+    ]).to_list(limit)
+    unread = await db.messages.aggregate([
+        {"$match": {"to_user_id": user_id, "read": False}},
+        {"$group": {"_id": "$from_user_id", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    unread = {row["_id"]: row["count"] for row in unread}
+    return [
+        {
+            "peer_id": row["_id"],
+            "last_message": {
+                "id": row["last"]["id"],
+                "from_user_id": row["last"]["from_user_id"],
+                "message": row["last"]["message"],
+                "file_type": row["last"].get("file_type"),
+                "deleted": row["last"].get("deleted", False),
+                "timestamp": row["last"]["timestamp"],
             },
-            {"_id": 0}
-        ).sort("timestamp", 1).to_list(1000)
-        return messages
-    except Exception:
-        # Gracefully return empty list if DB unavailable
+            "unread": unread.get(row["_id"], 0),
+        }
+        for row in rows
+    ]
+
+@api_router.get("/conversations/{user_id}")
+async def get_inbox(user_id: str, limit: int = Query(INBOX_PAGE_SIZE, ge=1, le=MAX_INBOX_PAGE_SIZE)):
+    """A user's conversations, newest first: peer, last message and unread count"""
+    if db is None:
+        return []
+    cached = inbox_cache.get(user_id, limit)
+    if cached is not None:
+        return cached
+
+    epoch = inbox_cache.begin()
+    try:
+        # Summaries are maintained as messages reach the database; buffered ones are laid over them
+        inserts, updates = message_writer.pending_writes()
+        if isinstance(db, (InMemoryDB, PostgresDB)):
+            inbox = await db.messages.inbox(user_id, limit)
+        else:
+            inbox = await _mongo_inbox(user_id, limit)
+        overlaid = await _inbox_with_pending_writes(user_id, inbox, limit, inserts, updates)
+    except DatabaseBusy:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching inbox: {e}")
+        return []
+    if overlaid is None:
+        inbox_cache.put(user_id, limit, inbox, epoch)
+        return inbox
+    # Not cached: once the buffer is written the stored summaries say the same
+    return overlaid
+
+def _inbox_summary(doc: dict) -> dict:
+    return {
+        "id": doc["id"],
+        "from_user_id": doc["from_user_id"],
+        "message": doc["message"],
+        "file_type": doc.get("file_type"),
+        "deleted": doc.get("deleted", False),
+        "timestamp": doc["timestamp"],
+    }
+
+async def _inbox_with_pending_writes(user_id: str, inbox: List[dict], limit: int,
+                                     inserts: Dict[str, dict], updates: Dict[str, dict]) -> Optional[List[dict]]:
+    """The stored inbox with write-behind messages applied; None if none of them are this user's"""
+    mine = sorted(
+        (doc for doc in inserts.values() if user_id in (doc["from_user_id"], doc["to_user_id"])),
+        key=lambda doc: (doc["timestamp"], doc["id"]),
+    )
+    edited = [entry for entry in inbox if entry["last_message"]["id"] in updates]
+    if not mine and not edited:
+        return None
+    entries = {entry["peer_id"]: {**entry, "last_message": dict(entry["last_message"])} for entry in inbox}
+    fresh = set()
+    for doc in mine:
+        peer = doc["to_user_id"] if doc["from_user_id"] == user_id else doc["from_user_id"]
+        entry = entries.get(peer)
+        if entry is None:
+            entry = entries[peer] = {"peer_id": peer, "last_message": _inbox_summary(doc), "unread": 0}
+            fresh.add(peer)
+        elif (doc["timestamp"], doc["id"]) >= (entry["last_message"]["timestamp"], entry["last_message"]["id"]):
+            entry["last_message"] = _inbox_summary(doc)
+        if doc["to_user_id"] == user_id and not doc.get("read"):
+            entry["unread"] += 1
+    for entry in entries.values():
+        fields = updates.get(entry["last_message"]["id"])
+        if fields:
+            entry["last_message"].update({k: v for k, v in fields.items() if k in ("message", "deleted")})
+    merged = sorted(
+        entries.values(),
+        key=lambda entry: (entry["last_message"]["timestamp"], entry["last_message"]["id"]),
+        reverse=True,
+    )[:limit]
+    # A full stored page may have cut off an older conversation with this peer, and its unread messages
+    if len(inbox) >= limit and any(entry["peer_id"] in fresh for entry in merged):
+        stored = await _stored_unread_counts(user_id)
+        for entry in merged:
+            if entry["peer_id"] in fresh:
+                entry["unread"] += stored.get(entry["peer_id"], 0)
+    return merged
+
+def _keyset_bound(query: dict, op: str, timestamp: str, message_id: Optional[str], inclusive: bool = False):
+    """Restrict a query to rows past the (timestamp, id) cursor in ``op`` direction.
+
+    The inclusive bound on ``timestamp`` alone lets the index range scan; the
+    ``$and`` clause breaks ties between messages sharing a timestamp. With
+    ``inclusive`` the cursor row itself matches too. A cursor whose timestamp
+    isn't ISO 8601 is rejected with 422.
+    """
+    try:
+        datetime.fromisoformat(timestamp)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid cursor timestamp {timestamp!r}")
+    bounds = query.setdefault("timestamp", {})
+    if message_id is None:
+        bounds[op + "e" if inclusive else op] = timestamp
+        return
+    bounds[op + "e"] = timestamp
+    query.setdefault("$and", []).append(
+        {"$or": [{"timestamp": {op: timestamp}}, {"id": {op + "e" if inclusive else op: message_id}}]}
+    )
+
+@api_router.get("/messages/{user1_id}/{user2_id}", response_model=List[Message])
+async def get_messages(
+    user1_id: str,
+    user2_id: str,
+    before: Optional[str] = None,
+    before_id: Optional[str] = None,
+    after: Optional[str] = None,
+    after_id: Optional[str] = None,
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MAX_MESSAGE_PAGE_SIZE),
+):
+    """Page through a conversation using (timestamp, id) keyset cursors.
+
+    Without cursors the newest ``limit`` messages are returned. ``before`` /
+    ``before_id`` page back through history and ``after`` / ``after_id`` fetch
+    newer messages. Pages are always returned oldest first.
+    """
+    if db is None:
         return []
+    
+    query = {
+        "$or": [
+            {"from_user_id": user1_id, "to_user_id": user2_id},
+            {"from_user_id": user2_id, "to_user_id": user1_id}
+        ]
+    }
+    if before is not None:
+        _keyset_bound(query, "$lt", before, before_id)
+    if after is not None:
+        _keyset_bound(query, "$gt", after, after_id)
+    
+    # Walk the index from the end nearest the cursor
+    direction = 1 if after is not None else -1
+    # Snapshot before reading, so a batch written meanwhile is on one side or the other
+    inserts, updates = message_writer.pending_writes()
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("timestamp", direction), ("id", direction)]
+    ).limit(limit).to_list(limit)
+    # Buffered messages would otherwise be missing from the page and skipped by cursors built from it
+    buffered = [doc for doc in inserts.values() if _matches(doc, query)]
+    if buffered or updates:
+        page = {m["id"]: {**m, **updates.get(m["id"], {})} for m in messages}
+        page.update((doc["id"], doc) for doc in buffered)
+        messages = sorted(page.values(), key=lambda m: (m["timestamp"], m["id"]), reverse=direction == -1)[:limit]
+    if direction == -1:
+        messages.reverse()
+    if messages:
+        summaries = await reaction_summaries([m["id"] for m in messages], user1_id)
+        empty = {"counts": {}, "mine": []}
+        messages = [
+            {**m, "reactions": summaries.get(m["id"], empty)["counts"], "my_reactions": summaries.get(m["id"], empty)["mine"]}
+            for m in messages
+        ]
+    return messages
 
 @api_router.post("/messages", response_model=Message)
 async def create_message(message_input: MessageCreate):
     message = Message(**message_input.model_dump())
+    message.preview = thumbnail_pool.preview_for(message.file_url, message.file_type)
     message_doc = message.model_dump()
     if db is not None:
         await db.messages.insert_one(message_doc)
+        inbox_cache.invalidate(message.from_user_id, message.to_user_id)
     return message
 
 # Friends Management Endpoints
@@ -638,34 +1915,50 @@ async def send_friend_request(req_data: FriendRequest):
     await db.friends.insert_one(friend_request_doc)
     return {"status": "success", "message": "Friend request sent"}
 
+MAX_FRIENDS_PAGE_SIZE = 1000
+
+async def list_friends(user_id: str, after: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    """Accepted friends ({"friend_id", "friend_username"}) ordered by friend_id, past ``after``"""
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        # Symmetric edges: one range scan whichever side sent the request
+        return await db.friends.accepted(user_id, after, limit)
+    # MongoDB: both directions in one $or, projected onto the other side
+    mine = {"$eq": ["$user_id", user_id]}
+    pipeline = [
+        {"$match": {"status": "accepted", "$or": [{"user_id": user_id}, {"friend_id": user_id}]}},
+        {"$group": {
+            "_id": {"$cond": [mine, "$friend_id", "$user_id"]},
+            "friend_username": {"$first": {"$cond": [mine, "$friend_username", "$username"]}},
+        }},
+    ]
+    if after is not None:
+        pipeline.append({"$match": {"_id": {"$gt": after}}})
+    pipeline.append({"$sort": {"_id": 1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    rows = await db.friends.aggregate(pipeline).to_list(limit)
+    return [{"friend_id": row["_id"], "friend_username": row["friend_username"]} for row in rows]
+
 @api_router.get("/friends/{user_id}")
-async def get_friends(user_id: str):
-    """Get all friends for a user"""
+async def get_friends(
+    user_id: str,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_FRIENDS_PAGE_SIZE),
+):
+    """Get a user's friends, ordered by friend_id.
+
+    Without ``limit`` every friend is returned; otherwise pass the last
+    ``friend_id`` of a page as ``after`` to get the next one.
+    """
     if db is None:
         return []
     
-    # Logic: Find where I am user_id AND status=accepted, OR where I am friend_id AND status=accepted
-    friends_list = []
-    
-    # Case 1: I sent request and it was accepted
-    cursor1 = db.friends.find({"user_id": user_id, "status": "accepted"}, {"_id": 0})
-    async for doc in cursor1:
-        friends_list.append({
-            "friend_id": doc["friend_id"],
-            "friend_username": doc["friend_username"]
-        })
-        
-    # Case 2: Someone sent me request and it was accepted
-    cursor2 = db.friends.find({"friend_id": user_id, "status": "accepted"}, {"_id": 0})
-    async for doc in cursor2:
-        friends_list.append({
-            "friend_id": doc["user_id"],
-            "friend_username": doc["username"]
-        })
+    friends_list = await list_friends(user_id, after, limit)
 
-    # Add online status for each friend
+    # Add online status for each friend, wherever their socket is connected
+    online = await manager.locate([friend["friend_id"] for friend in friends_list])
     for friend in friends_list:
-        friend["is_online"] = friend["friend_id"] in manager.active_connections
+        friend["is_online"] = friend["friend_id"] in online
     
     return friends_list
 
@@ -707,367 +2000,570 @@ async def accept_friend_request(request_from_user_id: str, current_user_id: str)
         )
         if result.modified_count == 0:
              raise HTTPException(status_code=404, detail="Friend request not found")
+        await manager.add_friendship(request_from_user_id, current_user_id)
         return {"status": "success"}
     return {"status": "success"}
 
 
+# Per-message read receipts arriving within this window are applied together
+READ_RECEIPT_WINDOW_MS = int(os.environ.get('READ_RECEIPT_WINDOW_MS', '100'))
+
+async def apply_read_receipts(reader_id: str, sender_id: str, message_ids: List[str]):
+    """Mark a burst of messages read with one UPDATE and send the sender one receipt"""
+    if db is not None:
+        # Messages still in the write-behind buffer get the flag folded into their insert
+        buffered = {m for m in message_ids if message_writer.holds(m)}
+        for message_id in buffered:
+            await message_writer.update(message_id, {"read": True})
+        stored = [m for m in message_ids if m not in buffered]
+        if stored:
+            await db.messages.update_many(
+                {"id": {"$in": stored}, "to_user_id": reader_id},
+                {"$set": {"read": True}}
+            )
+        inbox_cache.invalidate(reader_id)
+    if len(message_ids) == 1:
+        receipt = {"type": "message-read", "message_id": message_ids[0], "read_by": reader_id}
+    else:
+        receipt = {"type": "messages-read", "message_ids": message_ids, "read_by": reader_id}
+    await manager.send_personal_message(receipt, sender_id)
+
+read_receipts = ReadReceiptCoalescer(apply_read_receipts, window=READ_RECEIPT_WINDOW_MS / 1000)
+
+async def mark_read_up_to(reader_id: str, sender_id: str, message_id: str) -> Optional[int]:
+    """Mark everything sender sent reader up to and including message_id as read.
+
+    One range UPDATE over the unread rows of the conversation and one receipt
+    to the sender. Returns None if the message isn't in that conversation.
+    """
+    # The range UPDATE can only see what has been written
+    if message_writer.pending:
+        await message_writer.flush()
+    anchor = await db.messages.find_one({"id": message_id})
+    if anchor is None or anchor["from_user_id"] != sender_id or anchor["to_user_id"] != reader_id:
+        return None
+    query = {"from_user_id": sender_id, "to_user_id": reader_id, "read": False}
+    _keyset_bound(query, "$lt", anchor["timestamp"], anchor["id"], inclusive=True)
+    result = await db.messages.update_many(query, {"$set": {"read": True}})
+    inbox_cache.invalidate(reader_id)
+    await manager.send_personal_message({
+        "type": "messages-read-up-to",
+        "read_by": reader_id,
+        "up_to": {"id": anchor["id"], "timestamp": anchor["timestamp"]},
+        "count": result.modified_count
+    }, sender_id)
+    return result.modified_count
+
+@api_router.post("/messages/read-up-to")
+async def read_messages_up_to(receipt: ReadUpTo):
+    """Mark a conversation read up to (and including) a message"""
+    if db is None:
+        return {"status": "success", "updated": 0}
+    updated = await mark_read_up_to(receipt.reader_id, receipt.sender_id, receipt.message_id)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Message not found in this conversation")
+    return {"status": "success", "updated": updated}
+
 @api_router.post("/messages/{message_id}/read")
 async def mark_message_read(message_id: str):
     """Mark a message as read"""
     if db is not None:
-        await db.messages.update_one(
-            {"id": message_id},
-            {"$set": {"read": True}}
-        )
+        await update_message(message_id, {"read": True})
         return {"status": "success"}
     return {"status": "success"}
 
+async def update_message(message_id: str, fields: dict):
+    """Set fields on a message, even one the write-behind buffer hasn't persisted yet"""
+    if message_writer.holds(message_id):
+        await message_writer.update(message_id, fields)
+    else:
+        await db.messages.update_one({"id": message_id}, {"$set": fields})
+
 @api_router.delete("/messages/{message_id}")
 async def delete_message(message_id: str):
     """Delete a message (soft delete)"""
     if db is not None:
-        await db.messages.update_one(
-            {"id": message_id},
-            {"$set": {"deleted": True}}
-        )
+        await update_message(message_id, {"deleted": True})
     return {"status": "success"}
 
 @api_router.put("/messages/{message_id}")
 async def edit_message(message_id: str, message_edit: MessageEdit):
     """Edit a message"""
     if db is not None:
-        await db.messages.update_one(
-            {"id": message_id},
-            {"$set": {"message": message_edit.message, "edited_at": datetime.now(timezone.utc).isoformat()}}
+        await update_message(
+            message_id, {"message": message_edit.message, "edited_at": datetime.now(timezone.utc).isoformat()}
         )
     return {"status": "success"}
 
+async def toggle_reaction(message_id: str, emoji: str, user_id: str):
+    """Atomically add or remove a user's reaction; returns (added, counts per emoji)"""
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        return await db.reactions.toggle(message_id, emoji, user_id)
+    # MongoDB: unique (message_id, emoji, user_id) documents; the delete or
+    # insert is the toggle, so concurrent reactors never overwrite each other
+    key = {"message_id": message_id, "emoji": emoji, "user_id": user_id}
+    removed = await db.message_reactions.delete_one(key)
+    added = removed.deleted_count == 0
+    if added:
+        try:
+            await db.message_reactions.update_one(key, {"$setOnInsert": key}, upsert=True)
+        except DuplicateKeyError:
+            pass  # A concurrent toggle by the same user added it first
+    summaries = await reaction_summaries([message_id], user_id)
+    return added, summaries.get(message_id, {}).get("counts", {})
+
+async def reaction_summaries(message_ids: List[str], viewer_id: str) -> Dict[str, dict]:
+    """{message_id: {"counts": {emoji: n}, "mine": [emoji]}} for messages that have reactions"""
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        return await db.reactions.summaries(message_ids, viewer_id)
+    rows = await db.message_reactions.aggregate([
+        {"$match": {"message_id": {"$in": message_ids}}},
+        {"$group": {
+            "_id": {"message_id": "$message_id", "emoji": "$emoji"},
+            "count": {"$sum": 1},
+            "mine": {"$max": {"$eq": ["$user_id", viewer_id]}},
+        }},
+    ]).to_list(None)
+    result: Dict[str, dict] = {}
+    for row in rows:
+        summary = result.setdefault(row["_id"]["message_id"], {"counts": {}, "mine": []})
+        summary["counts"][row["_id"]["emoji"]] = row["count"]
+        if row["mine"]:
+            summary["mine"].append(row["_id"]["emoji"])
+    return result
+
 @api_router.post("/messages/{message_id}/react")
 async def react_to_message(message_id: str, user_id: str, reaction: MessageReaction):
     """Add or remove a reaction to a message"""
     if db is None:
         raise HTTPException(status_code=503, detail="Database not available")
     
-    message = await db.messages.find_one({"id": message_id})
-    if not message:
+    if not message_writer.holds(message_id) and await db.messages.find_one({"id": message_id}) is None:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    reactions = message.get("reactions", {})
-    emoji = reaction.emoji
-    
-    if emoji not in reactions:
-        reactions[emoji] = []
-    
-    # Toggle reaction: remove if exists, add if doesn't
-    if user_id in reactions[emoji]:
-        reactions[emoji].remove(user_id)
-        if not reactions[emoji]:  # Remove emoji if no users
-            del reactions[emoji]
-    else:
-        reactions[emoji].append(user_id)
-    
-    await db.messages.update_one(
-        {"id": message_id},
-        {"$set": {"reactions": reactions}}
+    added, reactions = await toggle_reaction(message_id, reaction.emoji, user_id)
+    return {"status": "success", "added": added, "reactions": reactions}
+
+# Statuses disappear STATUS_TTL_HOURS after posting
+STATUS_TTL_HOURS = float(os.environ.get('STATUS_TTL_HOURS', '24'))
+# Viewers listed on each of the author's own statuses (the count covers everyone)
+STATUS_VIEWERS_LIMIT = int(os.environ.get('STATUS_VIEWERS_LIMIT', '50'))
+STATUS_FEED_LIMIT = int(os.environ.get('STATUS_FEED_LIMIT', '500'))
+# How often expired statuses are physically removed; reads skip them regardless
+STATUS_SWEEP_INTERVAL = float(os.environ.get('STATUS_SWEEP_INTERVAL', '600'))
+status_sweeper: Optional[asyncio.Task] = None
+
+async def sweep_expired_statuses():
+    """Drop expired status partitions/buckets; MongoDB's TTL monitor does this itself"""
+    while True:
+        await asyncio.sleep(STATUS_SWEEP_INTERVAL)
+        if isinstance(db, (InMemoryDB, PostgresDB)):
+            try:
+                await db.statuses.expire()
+            except Exception as e:
+                logger.error(f"Status sweep failed: {e}")
+
+def utc_isoformat(value) -> str:
+    # PyMongo hands back naive UTC datetimes
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    return value
+
+async def save_status(doc: dict):
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        return await db.statuses.create(doc)
+    await db.statuses.insert_one({**doc, "expires_at": datetime.fromisoformat(doc["expires_at"])})
+
+async def status_feed(user_id: str) -> List[dict]:
+    """Live statuses by the user and their friends, newest first, with view_count,
+    viewed (by ``user_id``) and viewers (latest first, own statuses only)
+    """
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        return await db.statuses.feed(user_id, STATUS_VIEWERS_LIMIT, STATUS_FEED_LIMIT)
+    authors = [user_id] + [f["friend_id"] for f in await list_friends(user_id)]
+    docs = await db.statuses.find(
+        {"user_id": {"$in": authors}, "expires_at": {"$gt": datetime.now(timezone.utc)}}, {"_id": 0}
+    ).sort("created_at", -1).to_list(STATUS_FEED_LIMIT)
+    ids = [doc["id"] for doc in docs]
+    viewed = {
+        row["status_id"] for row in await db.status_views.find(
+            {"status_id": {"$in": ids}, "viewer_id": user_id}, {"status_id": 1}
+        ).to_list(None)
+    }
+    for doc in docs:
+        doc["expires_at"] = utc_isoformat(doc["expires_at"])
+        doc["viewed"] = doc["id"] in viewed
+        doc["viewers"] = None
+        if doc["user_id"] == user_id:
+            rows = await db.status_views.find({"status_id": doc["id"]}, {"viewer_id": 1}) \
+                .sort("viewed_at", -1).to_list(STATUS_VIEWERS_LIMIT)
+            doc["viewers"] = [row["viewer_id"] for row in rows]
+    return docs
+
+async def record_status_view(status_id: str, viewer_id: str, expires_at: Optional[str] = None) -> Optional[bool]:
+    """None if the status is gone, else whether this view was counted (once per viewer, never the author)"""
+    if isinstance(db, (InMemoryDB, PostgresDB)):
+        return await db.statuses.view(status_id, viewer_id, expires_at)
+    status_doc = await db.statuses.find_one(
+        {"id": status_id, "expires_at": {"$gt": datetime.now(timezone.utc)}}, {"user_id": 1, "expires_at": 1}
     )
-    
-    return {"status": "success", "reactions": reactions}
+    if status_doc is None:
+        return None
+    if status_doc["user_id"] == viewer_id:
+        return False
+    try:
+        await db.status_views.insert_one({
+            "status_id": status_id, "viewer_id": viewer_id,
+            "viewed_at": datetime.now(timezone.utc), "expires_at": status_doc["expires_at"],
+        })
+    except DuplicateKeyError:
+        return False
+    await db.statuses.update_one({"id": status_id}, {"$inc": {"view_count": 1}})
+    return True
+
+@api_router.post("/statuses")
+async def create_status(status_create: StatusCreate):
+    """Post a status that expires after STATUS_TTL_HOURS"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    if not status_create.content and not status_create.media_url:
+        raise HTTPException(status_code=400, detail="Status needs text or media")
+    now = datetime.now(timezone.utc)
+    doc = {
+        "id": str(uuid.uuid4()),
+        **status_create.model_dump(),
+        "created_at": now.isoformat(),
+        "expires_at": (now + timedelta(hours=STATUS_TTL_HOURS)).isoformat(),
+        "view_count": 0,
+    }
+    await save_status(doc)
+    return {**doc, "views": []}
+
+@api_router.get("/statuses/{user_id}")
+async def get_statuses(user_id: str):
+    """Live statuses from the user and their friends.
+
+    Authors are ordered by their latest status and each author's statuses
+    oldest first, the order they are played in. ``views`` lists recent viewers
+    of the user's own statuses; on anyone else's it is just the user, if seen.
+    """
+    if db is None:
+        return []
+    by_author: Dict[str, List[dict]] = {}
+    for doc in await status_feed(user_id):
+        viewers = doc.pop("viewers")
+        viewed = doc.pop("viewed")
+        doc["views"] = viewers if viewers is not None else ([user_id] if viewed else [])
+        by_author.setdefault(doc["user_id"], []).append(doc)
+    return [doc for statuses in by_author.values() for doc in reversed(statuses)]
+
+@api_router.post("/statuses/{status_id}/view")
+async def view_status(status_id: str, status_view: StatusView):
+    """Record that a user has seen a status"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    counted = await record_status_view(status_id, status_view.user_id, status_view.expires_at)
+    if counted is None:
+        raise HTTPException(status_code=404, detail="Status not found")
+    return {"status": "success", "counted": counted}
+
+# WebSocket frames, validated per type before their handler runs
+class WSFrame(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+class PeerFrame(WSFrame):
+    from_user_id: str
+    to_user_id: str
+
+class SendMessageFrame(PeerFrame):
+    from_username: str
+    message: str
+    file_url: Optional[str] = None
+    file_type: Optional[str] = None
+    file_name: Optional[str] = None
+    reply_to_id: Optional[str] = None
+    reply_to_text: Optional[str] = None
+    reply_to_username: Optional[str] = None
+
+class TypingFrame(PeerFrame):
+    from_username: str
+
+class MessageIdFrame(PeerFrame):
+    message_id: str
+
+class EditMessageFrame(MessageIdFrame):
+    new_message: str
+
+class ReactMessageFrame(MessageIdFrame):
+    emoji: str
+    user_id: str
+
+class CallUserFrame(PeerFrame):
+    from_username: str
+    video_enabled: bool = True
+
+class CallLogFrame(PeerFrame):
+    from_username: str = ""
+    duration: int = 0
+
+class OfferFrame(PeerFrame):
+    offer: Any
+
+class AnswerFrame(PeerFrame):
+    answer: Any
+
+class IceCandidateFrame(PeerFrame):
+    candidate: Any
+
+ws_dispatcher = FrameDispatcher()
+
+@ws_dispatcher.on("presence-sync", WSFrame)
+async def ws_presence_sync(user_id: str, frame: WSFrame):
+    await manager.send_presence_snapshot(user_id)
+
+@ws_dispatcher.on("send-message", SendMessageFrame)
+async def ws_send_message(user_id: str, frame: SendMessageFrame):
+    # Create message object with optional file data and reply
+    message = Message(
+        from_user_id=frame.from_user_id,
+        from_username=frame.from_username,
+        to_user_id=frame.to_user_id,
+        message=frame.message,
+        file_url=frame.file_url,
+        file_type=frame.file_type,
+        file_name=frame.file_name,
+        preview=thumbnail_pool.preview_for(frame.file_url, frame.file_type),
+        reply_to_id=frame.reply_to_id,
+        reply_to_text=frame.reply_to_text,
+        reply_to_username=frame.reply_to_username
+    )
+    # Persisted by the write-behind batcher; delivery doesn't wait for the DB
+    if db is not None:
+        await message_writer.insert(message.model_dump())
+        inbox_cache.invalidate(message.from_user_id, message.to_user_id)
+
+    # Send to recipient immediately without waiting for DB
+    receive_message = {
+        "type": "receive-message",
+        "message": message.model_dump()
+    }
+    await manager.send_personal_message(receive_message, frame.to_user_id)
+    # Confirm to sender
+    await manager.send_personal_message(receive_message, frame.from_user_id)
+
+@ws_dispatcher.on("typing", TypingFrame)
+async def ws_typing(user_id: str, frame: TypingFrame):
+    typing_msg = {
+        "type": "typing",
+        "from_user_id": frame.from_user_id,
+        "from_username": frame.from_username
+    }
+    await manager.send_personal_message(typing_msg, frame.to_user_id)
+
+@ws_dispatcher.on("stop-typing", PeerFrame)
+async def ws_stop_typing(user_id: str, frame: PeerFrame):
+    stop_typing_msg = {
+        "type": "stop-typing",
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(stop_typing_msg, frame.to_user_id)
+
+@ws_dispatcher.on("message-read", MessageIdFrame)
+async def ws_message_read(user_id: str, frame: MessageIdFrame):
+    # Coalesced per conversation; the sender gets one receipt per burst
+    await read_receipts.add(frame.from_user_id, frame.to_user_id, frame.message_id)
+
+@ws_dispatcher.on("read-up-to", MessageIdFrame)
+async def ws_read_up_to(user_id: str, frame: MessageIdFrame):
+    # Mark the conversation read up to a message and notify the sender
+    if db is not None:
+        await mark_read_up_to(frame.from_user_id, frame.to_user_id, frame.message_id)
+
+@ws_dispatcher.on("delete-message", MessageIdFrame)
+async def ws_delete_message(user_id: str, frame: MessageIdFrame):
+    if db is not None:
+        await message_writer.update(frame.message_id, {"deleted": True})
+        inbox_cache.invalidate(frame.from_user_id, frame.to_user_id)
+    # Notify both users
+    delete_msg = {
+        "type": "delete-message",
+        "message_id": frame.message_id
+    }
+    await manager.send_personal_message(delete_msg, frame.to_user_id)
+    await manager.send_personal_message(delete_msg, frame.from_user_id)
+
+@ws_dispatcher.on("edit-message", EditMessageFrame)
+async def ws_edit_message(user_id: str, frame: EditMessageFrame):
+    edited_at = datetime.now(timezone.utc).isoformat()
+    if db is not None:
+        await message_writer.update(frame.message_id, {"message": frame.new_message, "edited_at": edited_at})
+        inbox_cache.invalidate(frame.from_user_id, frame.to_user_id)
+    # Notify both users
+    edit_msg = {
+        "type": "edit-message",
+        "message_id": frame.message_id,
+        "new_message": frame.new_message,
+        "edited_at": edited_at
+    }
+    await manager.send_personal_message(edit_msg, frame.to_user_id)
+    await manager.send_personal_message(edit_msg, frame.from_user_id)
+
+@ws_dispatcher.on("react-message", ReactMessageFrame)
+async def ws_react_message(user_id: str, frame: ReactMessageFrame):
+    # Add/remove reaction: one atomic toggle, no read-modify-write of the message
+    if db is None:
+        return
+    added, reactions = await toggle_reaction(frame.message_id, frame.emoji, frame.user_id)
+    # Notify both users
+    reaction_msg = {
+        "type": "message-reaction",
+        "message_id": frame.message_id,
+        "emoji": frame.emoji,
+        "user_id": frame.user_id,
+        "added": added,
+        "reactions": reactions
+    }
+    await manager.send_personal_message(reaction_msg, frame.to_user_id)
+    await manager.send_personal_message(reaction_msg, frame.from_user_id)
+
+# WebRTC Signaling
+@ws_dispatcher.on("call-user", CallUserFrame)
+async def ws_call_user(user_id: str, frame: CallUserFrame):
+    # Create call-started log message
+    call_started = Message(
+        from_user_id=frame.from_user_id,
+        from_username=frame.from_username,
+        to_user_id=frame.to_user_id,
+        message="",
+        type="call-log",
+        call_status="ongoing"
+    )
+
+    logger.info(f"[CALL-USER] Creating call-started message: {call_started.model_dump()}")
+
+    # Send call-started message to both users
+    call_started_msg = {
+        "type": "receive-message",
+        "message": call_started.model_dump()
+    }
+    logger.info(f"[CALL-USER] Sending call-started to receiver: {frame.to_user_id}")
+    await manager.send_personal_message(call_started_msg, frame.to_user_id)
+    logger.info(f"[CALL-USER] Sending call-started to caller: {frame.from_user_id}")
+    await manager.send_personal_message(call_started_msg, frame.from_user_id)
+
+    # Also send incoming-call notification
+    incoming_msg = {
+        "type": "incoming-call",
+        "from_user_id": frame.from_user_id,
+        "from_username": frame.from_username,
+        "video_enabled": frame.video_enabled
+    }
+    await manager.send_personal_message(incoming_msg, frame.to_user_id)
+
+@ws_dispatcher.on("accept-call", PeerFrame)
+async def ws_accept_call(user_id: str, frame: PeerFrame):
+    accept_msg = {
+        "type": "call-accepted",
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(accept_msg, frame.to_user_id)
+
+async def save_call_log(frame: CallLogFrame, call_status: str, **fields) -> Message:
+    call_log = Message(
+        from_user_id=frame.from_user_id,
+        from_username=frame.from_username,
+        to_user_id=frame.to_user_id,
+        message="",
+        type="call-log",
+        call_status=call_status,
+        **fields
+    )
+    logger.info(f"[CALL-LOG] Creating {call_status} call log: {call_log.model_dump()}")
+    if db is not None:
+        await message_writer.insert(call_log.model_dump())
+        inbox_cache.invalidate(call_log.from_user_id, call_log.to_user_id)
+    return call_log
+
+@ws_dispatcher.on("reject-call", CallLogFrame)
+async def ws_reject_call(user_id: str, frame: CallLogFrame):
+    call_log = await save_call_log(frame, "rejected")
+    reject_msg = {
+        "type": "call-rejected",
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(reject_msg, frame.to_user_id)
+
+    # Send call log to both users
+    call_log_msg = {
+        "type": "receive-message",
+        "message": call_log.model_dump()
+    }
+    await manager.send_personal_message(call_log_msg, frame.to_user_id)
+    await manager.send_personal_message(call_log_msg, frame.from_user_id)
+
+@ws_dispatcher.on("offer", OfferFrame)
+async def ws_offer(user_id: str, frame: OfferFrame):
+    offer_msg = {
+        "type": "offer",
+        "offer": frame.offer,
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(offer_msg, frame.to_user_id)
+
+@ws_dispatcher.on("answer", AnswerFrame)
+async def ws_answer(user_id: str, frame: AnswerFrame):
+    answer_msg = {
+        "type": "answer",
+        "answer": frame.answer,
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(answer_msg, frame.to_user_id)
+
+@ws_dispatcher.on("ice-candidate", IceCandidateFrame)
+async def ws_ice_candidate(user_id: str, frame: IceCandidateFrame):
+    ice_msg = {
+        "type": "ice-candidate",
+        "candidate": frame.candidate,
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(ice_msg, frame.to_user_id)
+
+@ws_dispatcher.on("end-call", CallLogFrame)
+async def ws_end_call(user_id: str, frame: CallLogFrame):
+    call_log = await save_call_log(frame, "completed", duration=frame.duration)
+
+    # Send call-ended notification to the other user, wherever their socket lives
+    end_msg = {
+        "type": "call-ended",
+        "from_user_id": frame.from_user_id
+    }
+    await manager.send_personal_message(end_msg, frame.to_user_id)
+
+    # Send call log to both users
+    call_log_msg = {
+        "type": "receive-message",
+        "message": call_log.model_dump()
+    }
+    await manager.send_personal_message(call_log_msg, frame.to_user_id)
+    await manager.send_personal_message(call_log_msg, frame.from_user_id)
 
 # WebSocket Route
 @app.websocket("/api/ws/{user_id}/{username}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str, username: str):
     await manager.connect(websocket, user_id, username)
-    try:
-        while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            msg_type = message_data.get("type")
-
-            if msg_type == "send-message":
-                # Create message object with optional file data and reply
-                message = Message(
-                    from_user_id=message_data["from_user_id"],
-                    from_username=message_data["from_username"],
-                    to_user_id=message_data["to_user_id"],
-                    message=message_data["message"],
-                    file_url=message_data.get("file_url"),
-                    file_type=message_data.get("file_type"),
-                    file_name=message_data.get("file_name"),
-                    reply_to_id=message_data.get("reply_to_id"),
-                    reply_to_text=message_data.get("reply_to_text"),
-                    reply_to_username=message_data.get("reply_to_username")
-                )
-                # Save to DB asynchronously (don't wait - fire and forget)
-                if db is not None:
-                    try:
-                        asyncio.create_task(db.messages.insert_one(message.model_dump()))
-                    except Exception:
-                        pass
-                
-                # Send to recipient immediately without waiting for DB
-                msg_dict = message.model_dump()
-                receive_message = {
-                    "type": "receive-message",
-                    "message": msg_dict
-                }
-                await manager.send_personal_message(receive_message, message_data["to_user_id"])
-                # Confirm to sender
-                await manager.send_personal_message(receive_message, message_data["from_user_id"])
-
-            elif msg_type == "typing":
-                typing_msg = {
-                    "type": "typing",
-                    "from_user_id": message_data["from_user_id"],
-                    "from_username": message_data["from_username"]
-                }
-                await manager.send_personal_message(typing_msg, message_data["to_user_id"])
 
-            elif msg_type == "stop-typing":
-                stop_typing_msg = {
-                    "type": "stop-typing",
-                    "from_user_id": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(stop_typing_msg, message_data["to_user_id"])
-
-            elif msg_type == "message-read":
-                # Mark message as read and notify sender
-                if db is not None:
-                    asyncio.create_task(db.messages.update_one(
-                        {"id": message_data["message_id"]},
-                        {"$set": {"read": True}}
-                    ))
-                # Notify the sender that message was read
-                read_msg = {
-                    "type": "message-read",
-                    "message_id": message_data["message_id"],
-                    "read_by": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(read_msg, message_data["to_user_id"])
-
-            elif msg_type == "delete-message":
-                # Delete message
-                if db is not None:
-                    asyncio.create_task(db.messages.update_one(
-                        {"id": message_data["message_id"]},
-                        {"$set": {"deleted": True}}
-                    ))
-                # Notify both users
-                delete_msg = {
-                    "type": "delete-message",
-                    "message_id": message_data["message_id"]
-                }
-                await manager.send_personal_message(delete_msg, message_data["to_user_id"])
-                await manager.send_personal_message(delete_msg, message_data["from_user_id"])
-
-            elif msg_type == "edit-message":
-                # Edit message
-                if db is not None:
-                    asyncio.create_task(db.messages.update_one(
-                        {"id": message_data["message_id"]},
-                        {"$set": {"message": message_data["new_message"], "edited_at": datetime.now(timezone.utc).isoformat()}}
-                    ))
-                # Notify both users
-                edit_msg = {
-                    "type": "edit-message",
-                    "message_id": message_data["message_id"],
-                    "new_message": message_data["new_message"],
-                    "edited_at": datetime.now(timezone.utc).isoformat()
-                }
-                await manager.send_personal_message(edit_msg, message_data["to_user_id"])
-                await manager.send_personal_message(edit_msg, message_data["from_user_id"])
-
-            elif msg_type == "react-message":
-                # Add/remove reaction
-                if db is not None:
-                    message = await db.messages.find_one({"id": message_data["message_id"]})
-                    if message:
-                        reactions = message.get("reactions", {})
-                        emoji = message_data["emoji"]
-                        reactor_id = message_data["user_id"]
-                        
-                        if emoji not in reactions:
-                            reactions[emoji] = []
-                        
-                        # Toggle reaction
-                        if reactor_id in reactions[emoji]:
-                            reactions[emoji].remove(reactor_id)
-                            if not reactions[emoji]:
-                                del reactions[emoji]
-                        else:
-                            reactions[emoji].append(reactor_id)
-                        
-                        asyncio.create_task(db.messages.update_one(
-                            {"id": message_data["message_id"]},
-                            {"$set": {"reactions": reactions}}
-                        ))
-                        
-                        # Notify both users
-                        reaction_msg = {
-                            "type": "message-reaction",
-                            "message_id": message_data["message_id"],
-                            "reactions": reactions
-                        }
-                        await manager.send_personal_message(reaction_msg, message_data["to_user_id"])
-                        await manager.send_personal_message(reaction_msg, message_data["from_user_id"])
-
-            # WebRTC Signaling
-            elif msg_type == "call-user":
-                # Create call-started log message
-                call_started = Message(
-                    from_user_id=message_data["from_user_id"],
-                    from_username=message_data.get("from_username", ""),
-                    to_user_id=message_data["to_user_id"],
-                    message="",
-                    type="call-log",
-                    call_status="ongoing"
-                )
-                
-                logger.info(f"[CALL-USER] Creating call-started message: {call_started.model_dump()}")
-                
-                # Send call-started message to both users
-                call_started_msg = {
-                    "type": "receive-message",
-                    "message": call_started.model_dump()
-                }
-                logger.info(f"[CALL-USER] Sending call-started to receiver: {message_data['to_user_id']}")
-                await manager.send_personal_message(call_started_msg, message_data["to_user_id"])
-                logger.info(f"[CALL-USER] Sending call-started to caller: {message_data['from_user_id']}")
-                await manager.send_personal_message(call_started_msg, message_data["from_user_id"])
-                
-                # Also send incoming-call notification
-                incoming_msg = {
-                    "type": "incoming-call",
-                    "from_user_id": message_data["from_user_id"],
-                    "from_username": message_data["from_username"],
-                    "video_enabled": message_data.get("video_enabled", True)
-                }
-                await manager.send_personal_message(incoming_msg, message_data["to_user_id"])
-
-            elif msg_type == "accept-call":
-                accept_msg = {
-                    "type": "call-accepted",
-                    "from_user_id": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(accept_msg, message_data["to_user_id"])
-
-            elif msg_type == "reject-call":
-                # Save call log as rejected
-                call_log = Message(
-                    from_user_id=message_data["from_user_id"],
-                    from_username=message_data.get("from_username", ""),
-                    to_user_id=message_data["to_user_id"],
-                    message="",
-                    type="call-log",
-                    call_status="rejected"
-                )
-                
-                logger.info(f"[REJECT-CALL] Creating call log: {call_log.model_dump()}")
-                
-                # Save to DB
-                if db is not None:
-                    try:
-                        asyncio.create_task(db.messages.insert_one(call_log.model_dump()))
-                        logger.info(f"[REJECT-CALL] Saved to database")
-                    except Exception as e:
-                        logger.error(f"Error saving call log: {e}")
-                
-                reject_msg = {
-                    "type": "call-rejected",
-                    "from_user_id": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(reject_msg, message_data["to_user_id"])
-                
-                # Send call log to both users
-                call_log_msg = {
-                    "type": "receive-message",
-                    "message": call_log.model_dump()
-                }
-                logger.info(f"[REJECT-CALL] Sending call log message to both users")
-                await manager.send_personal_message(call_log_msg, message_data["to_user_id"])
-                await manager.send_personal_message(call_log_msg, message_data["from_user_id"])
-
-            elif msg_type == "offer":
-                offer_msg = {
-                    "type": "offer",
-                    "offer": message_data["offer"],
-                    "from_user_id": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(offer_msg, message_data["to_user_id"])
-
-            elif msg_type == "answer":
-                answer_msg = {
-                    "type": "answer",
-                    "answer": message_data["answer"],
-                    "from_user_id": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(answer_msg, message_data["to_user_id"])
-
-            elif msg_type == "ice-candidate":
-                ice_msg = {
-                    "type": "ice-candidate",
-                    "candidate": message_data["candidate"],
-                    "from_user_id": message_data["from_user_id"]
-                }
-                await manager.send_personal_message(ice_msg, message_data["to_user_id"])
-
-            elif msg_type == "end-call":
-                # Get call duration if provided
-                duration = message_data.get("duration", 0)
-                
-                # Save call log as completed
-                call_log = Message(
-                    from_user_id=message_data["from_user_id"],
-                    from_username=message_data.get("from_username", ""),
-                    to_user_id=message_data["to_user_id"],
-                    message="",
-                    type="call-log",
-                    call_status="completed",
-                    duration=duration
-                )
-                
-                logger.info(f"[END-CALL] Creating call log: {call_log.model_dump()}")
-                
-                # Save to DB
-                if db is not None:
-                    try:
-                        asyncio.create_task(db.messages.insert_one(call_log.model_dump()))
-                        logger.info(f"[END-CALL] Saved to database")
-                    except Exception as e:
-                        logger.error(f"Error saving call log: {e}")
-                
-                # Send call-ended notification to BOTH users
-                end_msg = {
-                    "type": "call-ended",
-                    "from_user_id": message_data["from_user_id"]
-                }
-                remote_user_id = message_data["to_user_id"]
-                logger.info(f"[END-CALL] Attempting to send call-ended to user: {remote_user_id}")
-                logger.info(f"[END-CALL] Active connections: {list(manager.active_connections.keys())}")
-                logger.info(f"[END-CALL] Is remote user connected? {remote_user_id in manager.active_connections}")
-                
-                if remote_user_id in manager.active_connections:
-                    await manager.send_personal_message(end_msg, remote_user_id)
-                    logger.info(f"[END-CALL] Successfully sent call-ended to {remote_user_id}")
-                else:
-                    logger.warning(f"[END-CALL] Remote user {remote_user_id} is not connected")
-
-                
-                # Send call log to both users
-                call_log_msg = {
-                    "type": "receive-message",
-                    "message": call_log.model_dump()
-                }
-                logger.info(f"[END-CALL] Sending call log message to both users")
-                await manager.send_personal_message(call_log_msg, message_data["to_user_id"])
-                await manager.send_personal_message(call_log_msg, message_data["from_user_id"])
+    async def reply(frame: dict):
+        await manager.send_personal_message(frame, user_id)
 
+    try:
+        while True:
+            # Bad frames are answered with an error frame; only the socket going away ends the loop
+            await ws_dispatcher.dispatch(user_id, await websocket.receive_text(), reply)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        await manager.broadcast_users_update()
+        await manager.drop(user_id, websocket)
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        manager.disconnect(user_id)
-        await manager.broadcast_users_update()
+        await manager.drop(user_id, websocket)
 
 
 app.include_router(api_router)
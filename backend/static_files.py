@@ -0,0 +1,164 @@
+"""Static file serving with cache policies, byte ranges and precompressed variants"""
+import os
+import re
+from email.utils import formatdate
+from mimetypes import guess_type
+from typing import Callable, Dict, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Cacheable, but revalidated (cheaply, via ETag) on every use
+REVALIDATE = "no-cache"
+
+# Content-Encoding -> file suffix, in order of preference
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def strong_etag(stat_result: os.stat_result) -> str:
+    # Files here are only ever replaced whole (os.replace), never rewritten in place
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(first, last) byte of a single ``bytes=`` range; None to send the whole file.
+
+    Multi-range requests get the whole file, which HTTP allows. Raises
+    ValueError if the range lies entirely past the end.
+    """
+    match = RANGE.match(header.replace(" ", ""))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the final N bytes
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError(header)
+    if last < first:
+        return None
+    return first, last
+
+
+class RangeFileResponse(FileResponse):
+    """206 response with bytes ``first``..``last`` (inclusive) of a file"""
+
+    def __init__(self, path, first: int, last: int, stat_result: os.stat_result, headers: Dict[str, str],
+                 media_type: Optional[str] = None):
+        headers = {
+            **headers,
+            "content-length": str(last - first + 1),
+            "content-range": f"bytes {first}-{last}/{stat_result.st_size}",
+        }
+        super().__init__(path, status_code=206, headers=headers, media_type=media_type, stat_result=stat_result)
+        self.first = first
+        self.last = last
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.last - self.first + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.first)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank under us; end the body rather than hang the client
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with an explicit cache policy, strong ETags and byte ranges.
+
+    ``cache_control(relative_path)`` picks the Cache-Control header per file.
+    ``If-None-Match`` gets a 304 and a single ``Range`` (honouring
+    ``If-Range``) gets a 206, so video seeking fetches only what it plays.
+    With ``precompressed``, ``<file>.br`` / ``<file>.gz`` siblings found at
+    startup are served to clients that accept them; build outputs don't
+    change while the process runs, so they are only looked up once.
+    """
+
+    def __init__(self, *, directory, cache_control: Callable[[str], str], precompressed: bool = False, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.cache_control = cache_control
+        # real path -> {encoding: (variant path, its stat)}
+        self.variants: Dict[str, Dict[str, Tuple[str, os.stat_result]]] = {}
+        if precompressed:
+            self._find_variants()
+
+    def _find_variants(self):
+        for root, _, files in os.walk(self.directory):
+            names = set(files)
+            for name in names:
+                path = os.path.realpath(os.path.join(root, name))
+                found = {
+                    encoding: (path + suffix, os.stat(path + suffix))
+                    for encoding, suffix in PRECOMPRESSED if name + suffix in names
+                }
+                if found:
+                    self.variants[path] = found
+
+    def _pick_variant(self, full_path: str, request_headers: Headers) -> Optional[Tuple[str, str, os.stat_result]]:
+        variants = self.variants.get(os.path.realpath(full_path))
+        if not variants:
+            return None
+        accepted = {token.split(";")[0].strip() for token in request_headers.get("accept-encoding", "").split(",")}
+        for encoding, _ in PRECOMPRESSED:
+            if encoding in variants and encoding in accepted:
+                return (encoding, *variants[encoding])
+        return None
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        headers = {
+            "cache-control": self.cache_control(relative),
+            "etag": strong_etag(stat_result),
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        }
+        if os.path.realpath(full_path) in self.variants:
+            headers["vary"] = "Accept-Encoding"
+
+        variant = self._pick_variant(full_path, request_headers) if status_code == 200 else None
+        if variant is not None:
+            encoding, variant_path, variant_stat = variant
+            headers["content-encoding"] = encoding
+            headers["etag"] = strong_etag(variant_stat)[:-1] + f'-{encoding}"'
+            path, stat_result = variant_path, variant_stat
+        else:
+            path = full_path
+            headers["accept-ranges"] = "bytes"
+
+        if self.is_not_modified(Headers(headers=headers), request_headers):
+            return NotModifiedResponse(Headers(headers=headers))
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if (status_code == 200 and variant is None and range_header is not None
+                and (if_range is None or if_range == headers["etag"])):
+            try:
+                byte_range = parse_range(range_header, stat_result.st_size)
+            except ValueError:
+                return Response(status_code=416, headers={"content-range": f"bytes */{stat_result.st_size}"})
+            if byte_range is not None:
+                return RangeFileResponse(path, *byte_range, stat_result, headers, media_type=media_type)
+
+        return FileResponse(path, status_code=status_code, headers=headers, media_type=media_type,
+                            stat_result=stat_result)
@@ -0,0 +1,264 @@
+"""Background thumbnail, poster and blur-placeholder generation for uploads"""
+import asyncio
+import base64
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from metrics import LatencyHistogram
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images fall back to ffmpeg (or nothing)
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (320, 320)
+PLACEHOLDER_SIZE = (16, 16)
+
+# /uploads/blobs/ab/<key>.<ext>, as written by UploadStore (the key is random, not the content hash)
+BLOB_URL = re.compile(r"^/uploads/blobs/[0-9a-f]{2}/([0-9a-f]{64})\.?[^/]*$")
+
+# A renderer turns (source file, thumbnail path, poster path or None) into the
+# preview metadata, writing the image files itself
+Renderer = Callable[[Path, Path, Optional[Path]], Awaitable[dict]]
+
+
+def _jpeg(image, max_size: Tuple[int, int], quality: int = 80) -> bytes:
+    image = image.copy()
+    image.thumbnail(max_size)
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _data_url(jpeg: bytes) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+
+
+def pillow_preview(source: Path, thumbnail: Path) -> dict:
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        _write_atomic(thumbnail, _jpeg(image, THUMBNAIL_SIZE))
+        placeholder = _data_url(_jpeg(image, PLACEHOLDER_SIZE, quality=40))
+    return {"width": width, "height": height, "placeholder": placeholder}
+
+
+async def ffmpeg(*args: str):
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-v", "error", "-y", *args,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[:300]}")
+
+
+async def ffmpeg_still(source: Path, out: Path, max_size: Tuple[int, int], frame: bool = False):
+    tmp = out.with_name(out.name + ".tmp.jpg")
+    scale = f"scale='min({max_size[0]},iw)':'min({max_size[1]},ih)':force_original_aspect_ratio=decrease"
+    await ffmpeg("-i", str(source), *(("-frames:v", "1") if frame else ()), "-vf", scale, str(tmp))
+    os.replace(tmp, out)
+
+
+def default_renderers(executor: ThreadPoolExecutor) -> Dict[str, Renderer]:
+    """Renderers for whatever is installed: Pillow for images, ffmpeg for video posters
+    (and for images and placeholders when Pillow is missing)"""
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    renderers: Dict[str, Renderer] = {}
+
+    async def still_preview(source: Path, thumbnail: Path) -> dict:
+        if Image is not None:
+            return await asyncio.get_running_loop().run_in_executor(executor, pillow_preview, source, thumbnail)
+        await ffmpeg_still(source, thumbnail, THUMBNAIL_SIZE, frame=True)
+        placeholder = thumbnail.with_name(thumbnail.name + ".tiny.jpg")
+        await ffmpeg_still(thumbnail, placeholder, PLACEHOLDER_SIZE)
+        data = placeholder.read_bytes()
+        placeholder.unlink()
+        return {"placeholder": _data_url(data)}
+
+    if Image is not None or has_ffmpeg:
+        async def image(source: Path, thumbnail: Path, poster: Optional[Path]) -> dict:
+            return await still_preview(source, thumbnail)
+        renderers["image"] = image
+
+    if has_ffmpeg:
+        async def video(source: Path, thumbnail: Path, poster: Optional[Path]) -> dict:
+            # First frame at full size for the player, then the usual preview from it
+            await ffmpeg("-i", str(source), "-frames:v", "1", str(poster.with_name(poster.name + ".tmp.jpg")))
+            os.replace(poster.with_name(poster.name + ".tmp.jpg"), poster)
+            return await still_preview(poster, thumbnail)
+        renderers["video"] = video
+
+    return renderers
+
+
+class ThumbnailPool:
+    """Generates previews for uploaded blobs on ``workers`` background tasks.
+
+    Outputs are named after the blob's key under ``directory``
+    (``<key>.jpg``, ``<key>.poster.jpg`` for video, ``<key>.json`` with the
+    metadata), so a job is idempotent: resubmitting content that is queued,
+    running or already done is a no-op, and a failed attempt is retried up to
+    ``max_attempts`` times with backoff. At most ``max_queue`` jobs wait;
+    beyond that ``submit`` drops the job (the client shows the original).
+    File types without a renderer (e.g. Pillow and ffmpeg both missing) are
+    skipped, and ``start`` warns about them.
+    """
+
+    def __init__(self, directory, url_prefix: str, renderers: Optional[Dict[str, Renderer]] = None,
+                 workers: int = 2, max_queue: int = 256, max_attempts: int = 3, retry_delay: float = 0.5,
+                 cache_size: int = 10_000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.url_prefix = url_prefix.rstrip("/")
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        self.renderers = renderers if renderers is not None else default_renderers(self._executor)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.cache_size = cache_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_queue = max_queue
+        self._tasks = []
+        self._inflight = set()
+        # blob key -> preview metadata of finished jobs
+        self._done: "OrderedDict[str, dict]" = OrderedDict()
+        self.render_time = LatencyHistogram()
+        self.counters = {"submitted": 0, "generated": 0, "cached": 0, "retried": 0, "failed": 0, "dropped": 0}
+
+    def start(self):
+        missing = [file_type for file_type in ("image", "video") if file_type not in self.renderers]
+        if missing:
+            logger.warning(f"No preview renderer for {', '.join(missing)} uploads; install Pillow and ffmpeg")
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=False)
+
+    def _paths(self, key: str) -> Tuple[Path, Path, Path]:
+        base = self.directory / key[:2] / key
+        return base.with_suffix(".jpg"), base.with_suffix(".poster.jpg"), base.with_suffix(".json")
+
+    def _urls(self, key: str, file_type: str) -> dict:
+        base = f"{self.url_prefix}/{key[:2]}/{key}"
+        urls = {"thumbnail_url": f"{base}.jpg"}
+        if file_type == "video":
+            urls["poster_url"] = f"{base}.poster.jpg"
+        return urls
+
+    def submit(self, key: str, source: Path, file_type: str) -> bool:
+        """Queue a preview job; False if the type has no renderer or the queue is full"""
+        if file_type not in self.renderers or self._queue is None:
+            return False
+        if key in self._done or key in self._inflight:
+            return True
+        try:
+            self._queue.put_nowait((key, Path(source), file_type))
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            return False
+        self._inflight.add(key)
+        self.counters["submitted"] += 1
+        return True
+
+    def preview_for(self, file_url: Optional[str], file_type: Optional[str]) -> Optional[dict]:
+        """Preview field for a message attaching ``file_url``.
+
+        URLs are deterministic, so a message can point at a thumbnail that is
+        still being generated; the placeholder and dimensions are included
+        once the job has finished. Content with no job queued, running or
+        finished (no renderer, dropped, failed) gets None rather than URLs
+        that would never resolve.
+        """
+        match = BLOB_URL.match(file_url or "")
+        if match is None or file_type not in self.renderers:
+            return None
+        key = match.group(1)
+        done = self._done.get(key)
+        if done is None and key not in self._inflight:
+            return None
+        preview = self._urls(key, file_type)
+        if done is not None:
+            self._done.move_to_end(key)
+            preview.update(done)
+        return preview
+
+    def _remember(self, key: str, meta: dict):
+        self._done[key] = meta
+        while len(self._done) > self.cache_size:
+            self._done.popitem(last=False)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _render(self, key: str, source: Path, file_type: str):
+        thumbnail, poster, meta_path = self._paths(key)
+        if await self._run(meta_path.exists):
+            # Generated before (e.g. by an earlier process): just load the metadata
+            self._remember(key, json.loads(await self._run(meta_path.read_text)))
+            self.counters["cached"] += 1
+            return
+        await self._run(lambda: thumbnail.parent.mkdir(parents=True, exist_ok=True))
+        started = time.perf_counter()
+        meta = await self.renderers[file_type](source, thumbnail, poster if file_type == "video" else None)
+        self.render_time.observe(time.perf_counter() - started)
+        # The metadata file goes last; its presence marks the job complete
+        await self._run(_write_atomic, meta_path, json.dumps(meta).encode())
+        self._remember(key, meta)
+        self.counters["generated"] += 1
+
+    async def _worker(self):
+        while True:
+            key, source, file_type = await self._queue.get()
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    try:
+                        await self._render(key, source, file_type)
+                        break
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        if attempt == self.max_attempts:
+                            self.counters["failed"] += 1
+                            logger.warning(f"Preview for {key} failed after {attempt} attempts: {e}")
+                        else:
+                            self.counters["retried"] += 1
+                            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            finally:
+                self._inflight.discard(key)
+                self._queue.task_done()
+
+    async def join(self):
+        """Wait until every queued job has finished"""
+        await self._queue.join()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "renderers": sorted(self.renderers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self._max_queue,
+            "render_time": self.render_time.snapshot(),
+        }
@@ -0,0 +1,461 @@
+"""Streaming, size-limited and resumable file uploads"""
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Base class for rejected uploads"""
+
+
+class UploadTooLarge(UploadError):
+    def __init__(self, limit: int):
+        super().__init__(f"File exceeds the {limit} byte limit")
+        self.limit = limit
+
+
+class UploadNotFound(UploadError):
+    """No resumable upload session with that id (never begun, committed or expired)"""
+
+
+class UploadOffsetMismatch(UploadError):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadIncomplete(UploadError):
+    """Commit before every declared byte arrived, or with a different checksum"""
+
+
+class MultipartFile:
+    """The bytes of one file field, pulled out of a multipart/form-data body as it streams in.
+
+    ``open`` parses up to the field's headers and returns its filename;
+    ``read`` then returns the next piece of file data each call (whatever the
+    last body chunk held) and b'' once the part ends. Other fields are
+    skipped without being kept.
+    """
+
+    MAX_HEADER_BYTES = 16 * 1024
+
+    def __init__(self, chunks: AsyncIterator[bytes], content_type: str, field: str = "file"):
+        media_type, options = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in options:
+            raise UploadError("Expected a multipart/form-data body")
+        self.chunks = chunks.__aiter__()
+        self.field = field.encode()
+        self.filename: Optional[str] = None
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._header_bytes = 0
+        self._in_file = False
+        self._ended = False
+        self._pending = []
+        self.parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+        self._count_header(end - start)
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+        self._count_header(end - start)
+
+    def _count_header(self, n: int):
+        self._header_bytes += n
+        if self._header_bytes > self.MAX_HEADER_BYTES:
+            raise UploadError("Multipart headers are too large")
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self.filename is None and options.get(b"name") == self.field and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._ended = True
+
+    async def _feed(self):
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            raise UploadError("Multipart body ended early")
+        self.parser.write(chunk)
+
+    async def open(self) -> str:
+        while self.filename is None:
+            try:
+                await self._feed()
+            except UploadError:
+                raise UploadError(f"No {self.field.decode()!r} file field in the upload")
+        return self.filename
+
+    async def read(self, n: int = -1) -> bytes:
+        while not self._pending and not self._ended:
+            await self._feed()
+        data = b"".join(self._pending)
+        self._pending.clear()
+        return data
+
+
+class UploadSession:
+    __slots__ = ("id", "filename", "file_type", "size", "received", "digest", "path", "touched", "lock")
+
+    def __init__(self, filename: str, file_type: str, size: int, path: Path):
+        self.id = str(uuid.uuid4())
+        self.filename = filename
+        self.file_type = file_type
+        self.size = size
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self.path = path
+        self.touched = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+class BlobIndex:
+    """sqlite index of stored blobs (by sha256, with a reference count) and the uploads pointing at them"""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                refs INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL REFERENCES blobs(sha256),
+                file_name TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+        """)
+
+    def blob(self, sha256: str) -> Optional[tuple]:
+        return self.db.execute("SELECT path, size FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+
+    def link(self, upload_id: str, sha256: str, path: str, size: int, file_name: str, file_type: str):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute(
+                "INSERT INTO blobs (sha256, path, size, refs) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT (sha256) DO UPDATE SET refs = refs + 1",
+                (sha256, path, size),
+            )
+            self.db.execute(
+                "INSERT INTO uploads (id, sha256, file_name, file_type, created_at) VALUES (?, ?, ?, ?, ?)",
+                (upload_id, sha256, file_name, file_type, datetime.now(timezone.utc).isoformat()),
+            )
+
+    def unlink(self, upload_id: str) -> Optional[tuple]:
+        """Drop an upload; returns (blob path, size, refs left) or None if unknown"""
+        with self.db:
+            self.db.execute("BEGIN")
+            row = self.db.execute("SELECT sha256 FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+            path, size, refs = self.db.execute(
+                "UPDATE blobs SET refs = refs - 1 WHERE sha256 = ? RETURNING path, size, refs", row
+            ).fetchone()
+            if refs == 0:
+                self.db.execute("DELETE FROM blobs WHERE sha256 = ?", row)
+            return path, size, refs
+
+    def totals(self) -> dict:
+        blobs, stored = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        uploads, logical = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(b.size), 0) FROM uploads u JOIN blobs b USING (sha256)"
+        ).fetchone()
+        return {"blobs": blobs, "uploads": uploads, "stored_bytes": stored, "logical_bytes": logical}
+
+    def close(self):
+        self.db.close()
+
+
+class UploadStore:
+    """Writes uploads to ``directory`` in ``chunk_size`` pieces off the event loop.
+
+    Every byte goes through a running sha256 and a per-type size limit
+    (``limits`` maps file type to bytes, ``"file"`` being the default), so an
+    oversized upload is cut off as soon as it crosses the limit rather than
+    after it has been buffered. Data lands in a sibling ``<directory>.partial``
+    and is renamed into place once complete.
+
+    Large files can also be sent as a resumable upload: ``begin`` declares the
+    size, ``append`` adds bytes at the current offset (a client that lost a
+    connection asks ``status`` where to resume), and ``commit`` checks the size
+    and optional checksum. Sessions idle for ``session_ttl`` seconds are
+    discarded.
+
+    Content is stored once per sha256 under ``blobs/`` and each upload gets
+    its own id in a ``BlobIndex`` that reference-counts the blob; ``release``
+    drops an upload and deletes the blob with its last reference. A repeat
+    upload only costs the streaming: once its bytes have been hashed, its
+    partial file is dropped instead of stored. Blobs are served publicly, so
+    they are named after a random key (with the first upload's extension)
+    rather than their hash: knowing a file's sha256 neither fetches it nor
+    tells whether it is stored. Every blob and index change runs on one
+    worker thread, so a release can't delete a blob that a concurrent upload
+    has just matched.
+    """
+
+    def __init__(self, directory, limits: Dict[str, int], chunk_size: int = 1024 * 1024,
+                 session_ttl: float = 3600.0):
+        self.directory = Path(directory)
+        self.blob_dir = self.directory / "blobs"
+        # Beside, not inside, the served directory so partial files are never public
+        self.partial_dir = self.directory.with_name(self.directory.name + ".partial")
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        self.index = BlobIndex(self.directory.with_name(self.directory.name + ".index.sqlite3"))
+        # Kept up to date by the blob thread so stats() needn't touch sqlite
+        self.totals = self.index.totals()
+        self._blob_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blobs")
+        self.limits = limits
+        self.chunk_size = chunk_size
+        self.session_ttl = session_ttl
+        self.sessions: Dict[str, UploadSession] = {}
+        self.write_time = LatencyHistogram()
+        self.counters = {
+            "stored": 0, "deduplicated": 0, "bytes": 0, "deduplicated_bytes": 0,
+            "released": 0, "rejected": 0, "resumable_started": 0, "expired": 0,
+        }
+
+    def limit_for(self, file_type: str) -> int:
+        return self.limits.get(file_type, self.limits["file"])
+
+    # Room for multipart boundaries, part headers and small form fields around the file
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _write(self, f, data: bytes):
+        started = time.perf_counter()
+        await self._run(f.write, data)
+        self.write_time.observe(time.perf_counter() - started)
+
+    async def _discard(self, path: Path):
+        await self._run(lambda: path.unlink(missing_ok=True))
+
+    async def _on_blob_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._blob_executor, fn, *args)
+
+    def _store_blob(self, partial: Path, digest: str, suffix: str, size: int,
+                    file_name: str, file_type: str) -> dict:
+        existing = self.index.blob(digest)
+        if existing is not None:
+            name, size = existing
+            partial.unlink(missing_ok=True)
+        else:
+            key = secrets.token_hex(32)
+            name = f"blobs/{key[:2]}/{key}{suffix.lower()}"
+            (self.directory / name).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(partial, self.directory / name)
+            self.totals["blobs"] += 1
+            self.totals["stored_bytes"] += size
+        upload_id = str(uuid.uuid4())
+        self.index.link(upload_id, digest, name, size, file_name, file_type)
+        self.totals["uploads"] += 1
+        self.totals["logical_bytes"] += size
+        return {"upload_id": upload_id, "name": name, "key": Path(name).name[:64], "size": size,
+                "sha256": digest, "deduplicated": existing is not None}
+
+    def _count(self, stored: dict) -> dict:
+        if stored["deduplicated"]:
+            self.counters["deduplicated"] += 1
+            self.counters["deduplicated_bytes"] += stored["size"]
+        else:
+            self.counters["stored"] += 1
+            self.counters["bytes"] += stored["size"]
+        return stored
+
+    async def _finish(self, path: Path, file_name: str, file_type: str, size: int, digest: str) -> dict:
+        stored = await self._on_blob_thread(
+            self._store_blob, path, digest, Path(file_name).suffix, size, file_name, file_type
+        )
+        return self._count(stored)
+
+    def _release(self, upload_id: str) -> bool:
+        unlinked = self.index.unlink(upload_id)
+        if unlinked is None:
+            return False
+        path, size, refs = unlinked
+        self.totals["uploads"] -= 1
+        self.totals["logical_bytes"] -= size
+        if refs == 0:
+            (self.directory / path).unlink(missing_ok=True)
+            self.totals["blobs"] -= 1
+            self.totals["stored_bytes"] -= size
+        return True
+
+    async def release(self, upload_id: str) -> bool:
+        """Drop one upload; its blob is deleted once nothing refers to it"""
+        released = await self._on_blob_thread(self._release, upload_id)
+        if released:
+            self.counters["released"] += 1
+        return released
+
+    async def save(self, read, filename: str, file_type: str) -> dict:
+        """Stream ``await read(n)`` to disk until it returns b''"""
+        limit = self.limit_for(file_type)
+        path = self.partial_dir / str(uuid.uuid4())
+        digest = hashlib.sha256()
+        size = 0
+        f = await self._run(open, path, "wb")
+        try:
+            while True:
+                chunk = await read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    self.counters["rejected"] += 1
+                    raise UploadTooLarge(limit)
+                digest.update(chunk)
+                await self._write(f, chunk)
+        except BaseException:
+            await self._run(f.close)
+            await self._discard(path)
+            raise
+        await self._run(f.close)
+        return await self._finish(path, filename, file_type, size, digest.hexdigest())
+
+    async def save_multipart(self, chunks: AsyncIterator[bytes], content_type: str,
+                             content_length: Optional[str],
+                             file_type_for: Callable[[str], str]) -> Tuple[dict, str, str]:
+        """``save`` the ``file`` field of a streamed multipart/form-data body.
+
+        A declared Content-Length over the largest limit is refused before
+        any of the body is read; otherwise the file part goes to disk as it
+        is parsed, against the limit for ``file_type_for(filename)``. Returns
+        (stored, filename, file_type).
+        """
+        largest = max(self.limits.values())
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > largest + self.MULTIPART_OVERHEAD:
+            self.counters["rejected"] += 1
+            raise UploadTooLarge(largest)
+        upload = MultipartFile(chunks, content_type)
+        filename = await upload.open()
+        file_type = file_type_for(filename)
+        stored = await self.save(upload.read, filename, file_type)
+        return stored, filename, file_type
+
+    def _expire(self):
+        now = time.monotonic()
+        for session in [s for s in self.sessions.values() if now - s.touched > self.session_ttl]:
+            if session.lock.locked():
+                continue
+            del self.sessions[session.id]
+            session.path.unlink(missing_ok=True)
+            self.counters["expired"] += 1
+
+    def begin(self, filename: str, file_type: str, size: int) -> UploadSession:
+        self._expire()
+        limit = self.limit_for(file_type)
+        if size > limit:
+            self.counters["rejected"] += 1
+            raise UploadTooLarge(limit)
+        session = UploadSession(filename, file_type, size, self.partial_dir / str(uuid.uuid4()))
+        session.path.touch()
+        self.sessions[session.id] = session
+        self.counters["resumable_started"] += 1
+        return session
+
+    def status(self, upload_id: str) -> UploadSession:
+        session = self.sessions.get(upload_id)
+        if session is None:
+            raise UploadNotFound(upload_id)
+        return session
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """Append ``chunks`` at ``offset`` and return the new offset.
+
+        Bytes past the declared size are refused. If the stream breaks
+        midway, what was written is kept and ``received`` says where to
+        resume.
+        """
+        session = self.status(upload_id)
+        async with session.lock:
+            if offset != session.received:
+                raise UploadOffsetMismatch(session.received)
+            f = await self._run(open, session.path, "ab")
+            try:
+                async for chunk in chunks:
+                    if session.received + len(chunk) > session.size:
+                        raise UploadTooLarge(session.size)
+                    await self._write(f, chunk)
+                    session.digest.update(chunk)
+                    session.received += len(chunk)
+            finally:
+                await self._run(f.close)
+                session.touched = time.monotonic()
+            return session.received
+
+    async def commit(self, upload_id: str, sha256: Optional[str] = None) -> dict:
+        session = self.status(upload_id)
+        async with session.lock:
+            if session.received != session.size:
+                raise UploadIncomplete(f"Received {session.received} of {session.size} bytes")
+            digest = session.digest.hexdigest()
+            if sha256 is not None and sha256.lower() != digest:
+                raise UploadIncomplete("Checksum mismatch")
+            del self.sessions[upload_id]
+            return await self._finish(session.path, session.filename, session.file_type, session.size, digest)
+
+    def close(self):
+        self._blob_executor.shutdown(wait=True)
+        self.index.close()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            **self.totals,
+            "open_sessions": len(self.sessions),
+            "chunk_size": self.chunk_size,
+            "limits": dict(self.limits),
+            "write_time": self.write_time.snapshot(),
+        }
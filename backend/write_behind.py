@@ -0,0 +1,355 @@
+"""Write-behind persistence for chat traffic"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehind:
+    """Buffers message inserts and field updates and writes them in batches.
+
+    A batch is flushed once ``max_batch`` operations are buffered or
+    ``flush_interval`` seconds after the first one, as one bulk insert plus one
+    bulk update. Updates to a message that is still buffered are folded into
+    its pending insert, and repeated updates to the same message are merged.
+    Once ``max_pending`` operations are buffered, writers flush inline instead
+    of growing the buffer. A batch that fails is retried row by row so one bad
+    document only loses itself. Writes that still fail are held back and
+    retried up to ``max_retries`` times, ``retry_delay`` seconds later and
+    doubling each time; updates to a held message are merged into it. With
+    ``flush_interval <= 0`` every write is flushed before the call returns.
+
+    ``collection`` is called at flush time, so swapping the database (tests,
+    init_db fallback) needs no re-wiring. Readers don't need to flush first:
+    ``pending_writes`` is everything not yet known to be in the database,
+    to be laid over what a query returns.
+
+    With a ``wal`` (MessageWAL) attached, every write is logged durably before
+    it is buffered and acknowledged once the database has it. Writes given up
+    on are moved to the log's dead-letter file, except at shutdown, when they
+    stay in the log to be replayed on the next start.
+    """
+
+    def __init__(self, collection: Callable[[], object], max_batch: int = 500,
+                 flush_interval: float = 0.05, max_pending: int = 10_000,
+                 max_retries: int = 3, retry_delay: float = 0.5):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._inserts: Dict[str, dict] = {}
+        self._updates: Dict[str, dict] = {}
+        self._lsns: Dict[str, List[int]] = {}
+        # message id -> the failed batch (inserts/updates/lsns) it is held in until its retry
+        self._held: Dict[str, dict] = {}
+        # (inserts, updates) of the batch being written, until the write returns
+        self._writing: Optional[tuple] = None
+        self._attempts: Dict[str, int] = {}
+        self._retries = set()
+        self._closing = False
+        self.wal = None
+        self._timer = None
+        self._flushes = set()
+        self._lock = None
+        self.counters = {"inserted": 0, "updated": 0, "merged": 0, "batches": 0, "failed": 0, "replayed": 0,
+                         "retried": 0, "abandoned": 0}
+        self.flush_time = LatencyHistogram()
+
+    @property
+    def pending(self) -> int:
+        return len(self._inserts) + len(self._updates)
+
+    def holds(self, message_id: str) -> bool:
+        """True if writes for this message are still buffered, held or being inserted"""
+        writing = self._writing is not None and message_id in self._writing[0]
+        return writing or message_id in self._inserts or message_id in self._updates or message_id in self._held
+
+    def pending_writes(self) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+        """(inserts, updates) the database may not have yet: being written, held or buffered.
+
+        Later writes are folded over earlier ones, so an insert carries every
+        update made since; ``updates`` only has messages with no pending insert.
+        """
+        layers = [self._writing] if self._writing is not None else []
+        layers += [(batch["inserts"], batch["updates"]) for batch in {id(b): b for b in self._held.values()}.values()]
+        layers.append((self._inserts, self._updates))
+        inserts: Dict[str, dict] = {}
+        updates: Dict[str, dict] = {}
+        for layer_inserts, layer_updates in layers:
+            for message_id, doc in layer_inserts.items():
+                inserts[message_id] = dict(doc)
+            for message_id, fields in layer_updates.items():
+                if message_id in inserts:
+                    inserts[message_id].update(fields)
+                else:
+                    updates.setdefault(message_id, {}).update(fields)
+        return inserts, updates
+
+    async def _log(self, message_id: str, record: dict):
+        if self.wal is not None:
+            lsn = await self.wal.append(record)
+            held = self._held.get(message_id)
+            lsns = held["lsns"] if held is not None else self._lsns
+            lsns.setdefault(message_id, []).append(lsn)
+
+    async def insert(self, doc: dict):
+        await self._log(doc["id"], {"op": "insert", "doc": doc})
+        self._inserts[doc["id"]] = doc
+        await self._buffered()
+
+    async def update(self, message_id: str, fields: dict):
+        await self._log(message_id, {"op": "update", "id": message_id, "fields": fields})
+        held = self._held.get(message_id)
+        if held is not None:
+            # Waiting for a retry: ride along with it so it can't overtake a failed insert
+            target = held["inserts"].get(message_id)
+            if target is None:
+                target = held["updates"].setdefault(message_id, {})
+            target.update(fields)
+            self.counters["merged"] += 1
+            return
+        if message_id in self._inserts:
+            self._inserts[message_id].update(fields)
+            self.counters["merged"] += 1
+        elif message_id in self._updates:
+            self._updates[message_id].update(fields)
+            self.counters["merged"] += 1
+        else:
+            self._updates[message_id] = dict(fields)
+        await self._buffered()
+
+    async def _buffered(self):
+        if self.flush_interval <= 0 or self.pending >= self.max_pending:
+            await self.flush()
+        elif self.pending >= self.max_batch:
+            self._spawn_flush()
+        else:
+            timer = self._timer
+            # The loop that armed the timer may be gone (TestClient runs one per socket)
+            if timer is None or timer.done() or timer.get_loop().is_closed():
+                self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    def _flush_lock(self) -> asyncio.Lock:
+        # Batches are written one at a time so an update never overtakes its insert
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+        return self._lock[1]
+
+    async def flush(self):
+        async with self._flush_lock():
+            inserts, self._inserts = self._inserts, {}
+            updates, self._updates = self._updates, {}
+            lsns, self._lsns = self._lsns, {}
+            if not inserts and not updates:
+                return
+            started = time.perf_counter()
+            try:
+                collection = self.collection()
+            except Exception as e:
+                self.counters["failed"] += len(inserts) + len(updates)
+                logger.error(f"No database for {len(inserts) + len(updates)} buffered writes: {e}")
+                self._hold(set(inserts) | set(updates), inserts, updates, lsns)
+                return
+            self._writing = (inserts, updates)
+            try:
+                failed = await self._write(collection, inserts, updates)
+            finally:
+                self._writing = None
+            if self.wal is not None:
+                self.wal.ack(lsn for message_id, ids in lsns.items() if message_id not in failed for lsn in ids)
+            for message_id in (set(inserts) | set(updates)) - failed:
+                self._attempts.pop(message_id, None)
+            self._hold(failed, inserts, updates, lsns)
+            self.counters["batches"] += 1
+            self.flush_time.observe(time.perf_counter() - started)
+
+    def _hold(self, failed: Set[str], inserts: Dict[str, dict], updates: Dict[str, dict],
+              lsns: Dict[str, List[int]]):
+        """Set failed writes aside for a delayed retry, or give up on them after max_retries"""
+        batch = {"inserts": {}, "updates": {}, "lsns": {}}
+        attempt = 0
+        for message_id in failed:
+            attempts = self._attempts.get(message_id, 0) + 1
+            if attempts > self.max_retries or self._closing:
+                self._attempts.pop(message_id, None)
+                self._abandon(message_id, inserts.get(message_id), updates.get(message_id),
+                              lsns.get(message_id, []))
+                continue
+            self._attempts[message_id] = attempts
+            attempt = max(attempt, attempts)
+            if message_id in inserts:
+                batch["inserts"][message_id] = inserts[message_id]
+            if message_id in updates:
+                batch["updates"][message_id] = updates[message_id]
+            batch["lsns"][message_id] = lsns.get(message_id, [])
+            self._held[message_id] = batch
+        if attempt:
+            task = asyncio.get_running_loop().create_task(
+                self._retry_later(batch, self.retry_delay * 2 ** (attempt - 1))
+            )
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+
+    def _abandon(self, message_id: str, doc: Optional[dict], fields: Optional[dict], lsns: List[int]):
+        self.counters["abandoned"] += 1
+        if self._closing:
+            # Left unacknowledged in the WAL, if there is one, for replay on the next start
+            logger.error(f"Could not persist writes for message {message_id} before shutdown")
+            return
+        logger.error(f"Giving up on writes for message {message_id} after {self.max_retries} retries")
+        if self.wal is not None:
+            self.wal.dead_letter({"id": message_id, "doc": doc, "fields": fields}, lsns)
+
+    def _release(self, batch: dict):
+        """Put a held batch back into the buffers, ahead of later writes to the same messages"""
+        for message_id, doc in batch["inserts"].items():
+            # An update that raced the failed insert was buffered on its own; fold it back in
+            self._inserts[message_id] = {**doc, **self._updates.pop(message_id, {})}
+        for message_id, fields in batch["updates"].items():
+            self._updates[message_id] = {**fields, **self._updates.get(message_id, {})}
+        for message_id, ids in batch["lsns"].items():
+            self._lsns[message_id] = ids + self._lsns.get(message_id, [])
+            if self._held.get(message_id) is batch:
+                del self._held[message_id]
+        self.counters["retried"] += len(batch["lsns"])
+
+    async def _retry_later(self, batch: dict, delay: float):
+        await asyncio.sleep(delay)
+        self._release(batch)
+        # Flushed from its own task, so cancelling a pending retry never interrupts a write
+        self._spawn_flush()
+
+    def _spawn_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, collection, inserts: Dict[str, dict], updates: Dict[str, dict],
+                     idempotent: bool = False) -> Set[str]:
+        """Write a batch; returns the ids of messages whose writes failed"""
+        failed = set()
+        if inserts:
+            failed |= await self._write_inserts(collection, list(inserts.values()), idempotent)
+        if updates:
+            failed |= await self._write_updates(collection, updates)
+        return failed
+
+    async def _write_inserts(self, collection, docs: List[dict], idempotent: bool = False) -> Set[str]:
+        try:
+            if isinstance(collection, AsyncIOMotorCollection):
+                if idempotent:
+                    # Mongo has no unique key on "id", so replays upsert instead of inserting
+                    await collection.bulk_write(
+                        [UpdateOne({"id": doc["id"]}, {"$setOnInsert": doc}, upsert=True) for doc in docs],
+                        ordered=False,
+                    )
+                else:
+                    await collection.insert_many(docs, ordered=False)
+            else:
+                await collection.insert_many(docs)
+            self.counters["inserted"] += len(docs)
+            return set()
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            failed = {docs[error["index"]]["id"] for error in errors}
+            self.counters["inserted"] += len(docs) - len(failed)
+            self.counters["failed"] += len(failed)
+            logger.error(f"Bulk insert lost {len(failed)} of {len(docs)} messages: {e}")
+            return failed
+        except Exception as e:
+            logger.warning(f"Bulk insert of {len(docs)} messages failed ({e}); retrying one by one")
+        failed = set()
+        for doc in docs:
+            try:
+                await collection.insert_one(doc)
+                self.counters["inserted"] += 1
+            except Exception as e:
+                failed.add(doc["id"])
+                self.counters["failed"] += 1
+                logger.error(f"Failed to persist message {doc.get('id')}: {e}")
+        return failed
+
+    async def _write_updates(self, collection, updates: Dict[str, dict]) -> Set[str]:
+        try:
+            if isinstance(collection, AsyncIOMotorCollection):
+                await collection.bulk_write(
+                    [UpdateOne({"id": message_id}, {"$set": fields}) for message_id, fields in updates.items()],
+                    ordered=False,
+                )
+            else:
+                await collection.bulk_set(updates)
+            self.counters["updated"] += len(updates)
+            return set()
+        except Exception as e:
+            logger.warning(f"Bulk update of {len(updates)} messages failed ({e}); retrying one by one")
+        failed = set()
+        for message_id, fields in updates.items():
+            try:
+                await collection.update_one({"id": message_id}, {"$set": fields})
+                self.counters["updated"] += 1
+            except Exception as e:
+                failed.add(message_id)
+                self.counters["failed"] += 1
+                logger.error(f"Failed to update message {message_id}: {e}")
+        return failed
+
+    async def replay(self, records: List[dict]) -> Set[str]:
+        """Re-apply logged writes (from MessageWAL.open) that may not have reached the database.
+
+        Inserts are idempotent (ON CONFLICT / upsert / primary-key check) and
+        updates are plain $set, so records that did land are harmless to repeat.
+        Returns the ids that still failed.
+        """
+        inserts: Dict[str, dict] = {}
+        updates: Dict[str, dict] = {}
+        for record in sorted(records, key=lambda r: r["lsn"]):
+            if record["op"] == "insert":
+                inserts[record["doc"]["id"]] = dict(record["doc"])
+            elif record["id"] in inserts:
+                inserts[record["id"]].update(record["fields"])
+            else:
+                updates.setdefault(record["id"], {}).update(record["fields"])
+        if not inserts and not updates:
+            return set()
+        self.counters["replayed"] += len(records)
+        return await self._write(self.collection(), inserts, updates, idempotent=True)
+
+    async def close(self):
+        """Stop the timer and write out everything still buffered"""
+        if self._timer is not None and not self._timer.get_loop().is_closed():
+            self._timer.cancel()
+        self._timer = None
+        # One last attempt for held writes instead of waiting out their backoff
+        self._closing = True
+        for task in list(self._retries):
+            task.cancel()
+        for batch in {id(batch): batch for batch in self._held.values()}.values():
+            self._release(batch)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "held": len(self._held),
+            "max_batch": self.max_batch,
+            "flush_interval_ms": self.flush_interval * 1000,
+            **self.counters,
+            "flush_time": self.flush_time.snapshot(),
+        }
@@ -0,0 +1,95 @@
+"""Table-driven dispatch of WebSocket frames by their ``type``"""
+import json
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, Any], Awaitable[None]]
+Reply = Callable[[dict], Awaitable[None]]
+
+
+class FrameDispatcher:
+    """Routes each frame to the handler registered for its ``type``.
+
+    ``@dispatcher.on(msg_type, Schema)`` registers ``handler(user_id, frame)``,
+    where ``frame`` is the payload validated as the pydantic model ``Schema``.
+    A frame that isn't JSON, fails its schema or makes its handler raise is
+    counted against its type, logged and answered with an ``error`` frame
+    through ``reply``; the connection stays up. Unknown types are counted and
+    ignored.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, Tuple[Handler, Type[BaseModel]]] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.malformed = 0
+        self.unknown = 0
+
+    def on(self, msg_type: str, schema: Type[BaseModel]):
+        def register(handler: Handler) -> Handler:
+            self.handlers[msg_type] = (handler, schema)
+            self.latency[msg_type] = LatencyHistogram()
+            self.counters[msg_type] = {"handled": 0, "invalid": 0, "errors": 0}
+            return handler
+        return register
+
+    async def dispatch(self, user_id: str, raw: str, reply: Reply) -> bool:
+        """Handle one frame; returns whether a handler ran to completion"""
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            self.malformed += 1
+            await reply({"type": "error", "for": None, "detail": "Frame is not a JSON object"})
+            return False
+
+        msg_type = data.get("type")
+        entry = self.handlers.get(msg_type)
+        if entry is None:
+            self.unknown += 1
+            return False
+        handler, schema = entry
+        counters = self.counters[msg_type]
+
+        try:
+            frame = schema.model_validate(data)
+        except ValidationError as e:
+            counters["invalid"] += 1
+            logger.warning(f"Invalid {msg_type} frame from {user_id}: {e.error_count()} error(s)")
+            await reply({
+                "type": "error", "for": msg_type,
+                "detail": [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()],
+            })
+            return False
+
+        started = time.perf_counter()
+        try:
+            await handler(user_id, frame)
+        except Exception:
+            counters["errors"] += 1
+            logger.exception(f"{msg_type} handler failed for {user_id}")
+            await reply({"type": "error", "for": msg_type, "detail": "Could not process frame"})
+            return False
+        finally:
+            self.latency[msg_type].observe(time.perf_counter() - started)
+        counters["handled"] += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "malformed": self.malformed,
+            "unknown": self.unknown,
+            "types": {
+                msg_type: {**counters, "latency": self.latency[msg_type].snapshot()}
+                for msg_type, counters in self.counters.items()
+                if any(counters.values())
+            },
+        }
@@ -0,0 +1,86 @@
+"""Per-message cost of routing through the backplane versus local delivery.
+
+Runs K nodes in one process over a shared FakeRedis, spreads USERS across them
+and sends MESSAGES direct messages from node 0 to random recipients, so about
+(K-1)/K of them take the directory lookup + inbox publish path. This measures
+the routing overhead a worker pays; the capacity gained from adding workers
+needs separate processes and a real Redis (BACKPLANE_URL=redis://...).
+
+Usage: python benchmarks/bench_backplane.py
+"""
+import sys
+import time
+import random
+import asyncio
+import logging
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import ConnectionManager, InMemoryDB
+from backplane import FakeRedis, RedisBackplane
+
+NODE_COUNTS = [1, 2, 4, 8]
+USERS = 1_000
+MESSAGES = 20_000
+
+
+class FakeSocket:
+    def __init__(self, counter):
+        self.counter = counter
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.counter[0] += 1
+
+    async def close(self, code=1000):
+        pass
+
+
+async def measure(node_count):
+    server.db = InMemoryDB()
+    redis = FakeRedis()
+    nodes = []
+    for n in range(node_count):
+        node = ConnectionManager(presence_window=0, backplane=RedisBackplane(redis, f"node-{n}"))
+        await node.backplane.start(node.receive_envelope, lambda node=node: list(node.users.values()))
+        nodes.append(node)
+
+    delivered = [0]
+    for i in range(USERS):
+        await nodes[i % node_count].connect(FakeSocket(delivered), f"user-{i}", f"user {i}")
+    await asyncio.sleep(0.05)
+    delivered[0] = 0
+
+    rng = random.Random(42)
+    recipients = [f"user-{rng.randrange(USERS)}" for _ in range(MESSAGES)]
+    started = time.perf_counter()
+    for recipient in recipients:
+        await nodes[0].send_personal_message({"type": "receive-message", "message": "hello"}, recipient)
+    while delivered[0] < MESSAGES:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    routed = nodes[0].backplane.counters["routed"]
+    for node in nodes:
+        for user_id in list(node.active_connections):
+            node.disconnect(user_id)
+        await node.backplane.close()
+    return elapsed, routed
+
+
+async def main():
+    for name in ("server", "backplane"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    print(f"{USERS} users, {MESSAGES} messages sent from node 0")
+    print(f"{'nodes':>6} {'routed':>8} {'msg/s':>10} {'us/msg':>8}")
+    for node_count in NODE_COUNTS:
+        elapsed, routed = await measure(node_count)
+        print(f"{node_count:>6} {routed:>8,} {MESSAGES / elapsed:>10,.0f} {elapsed / MESSAGES * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""ConnectionManager.broadcast latency at 1k, 5k and 10k connected sockets.
+
+Sockets are in-process fakes whose send_text yields to the loop like a real
+transport write. Each size is measured with every client healthy and with one
+client stuck, comparing the previous sequential, encode-per-socket loop with
+the concurrent encode-once fan-out.
+
+Usage: python benchmarks/bench_broadcast.py
+"""
+import sys
+import asyncio
+import json
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from server import ConnectionManager
+
+SIZES = [1_000, 5_000, 10_000]
+STUCK_DELAY = 2.0
+SEND_TIMEOUT = 0.25
+MESSAGE = {"type": "users-update", "users": [{"id": f"user-{i}", "username": f"user {i}"} for i in range(50)]}
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+
+    async def close(self, code=1000):
+        pass
+
+
+async def sequential_broadcast(manager, message):
+    # The previous implementation
+    for connection in list(manager.active_connections.values()):
+        try:
+            await connection.send_text(json.dumps(message))
+        except Exception:
+            pass
+
+
+async def measure(size, stuck, broadcast):
+    manager = ConnectionManager(send_timeout=SEND_TIMEOUT)
+    for i in range(size):
+        manager.active_connections[f"user-{i}"] = FakeSocket()
+    if stuck:
+        manager.active_connections["user-0"] = FakeSocket(delay=STUCK_DELAY)
+    start = time.perf_counter()
+    await broadcast(manager, MESSAGE)
+    return (time.perf_counter() - start) * 1000
+
+
+async def main():
+    print(f"{'sockets':>8} {'stuck':>6} {'sequential ms':>14} {'concurrent ms':>14}")
+    for size in SIZES:
+        for stuck in (False, True):
+            old = await measure(size, stuck, sequential_broadcast)
+            new = await measure(size, stuck, ConnectionManager.broadcast)
+            print(f"{size:>8} {str(stuck):>6} {old:>14.1f} {new:>14.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+"""Latency of opening a chat (newest page) and paging back, by conversation size.
+
+Uses the in-memory backend through the real get_messages endpoint function.
+
+Usage: python benchmarks/bench_conversation_paging.py
+"""
+import sys
+import asyncio
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import InMemoryDB
+
+SIZES = [100, 10_000, 1_000_000]
+ROUNDS = 200
+PAGE = 50
+
+
+async def populate(db, size):
+    for i in range(size):
+        a, b = ("alice", "bob") if i % 2 == 0 else ("bob", "alice")
+        await db.messages.insert_one({
+            "id": f"msg-{i:08d}",
+            "from_user_id": a,
+            "from_username": a,
+            "to_user_id": b,
+            "message": "hello",
+            "timestamp": f"2024-01-01T00:00:00.{i:08d}+00:00",
+            "read": True,
+        })
+
+
+async def main():
+    for size in SIZES:
+        server.db = InMemoryDB()
+        await populate(server.db, size)
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            page = await server.get_messages("alice", "bob", limit=PAGE)
+        open_ms = (time.perf_counter() - start) / ROUNDS * 1000
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            older = await server.get_messages(
+                "alice", "bob", before=page[0]["timestamp"], before_id=page[0]["id"], limit=PAGE
+            )
+        page_ms = (time.perf_counter() - start) / ROUNDS * 1000
+
+        print(f"messages={size:>9}  open chat {open_ms:7.3f} ms  page back {page_ms:7.3f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
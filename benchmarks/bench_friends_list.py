@@ -0,0 +1,100 @@
+"""Listing a user with FRIENDS friends: two directional queries vs symmetric edges.
+
+"before" is the old get_friends: one query where the user sent the request
+and one where they received it, merged in Python. "edges" is one range scan
+over the symmetric friendship edges (list_friends); "edges paged" walks the
+same list in pages of PAGE via ``after``. Friendships are seeded half in each
+direction.
+
+With DATABASE_URL set the queries run against that PostgreSQL database
+(rows are removed afterwards); otherwise against InMemoryDB.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_friends_list.py [friends]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import InMemoryDB, list_friends
+from postgres_db import PostgresDB
+
+FRIENDS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+PAGE = 200
+REQUESTS = 20
+
+
+async def seed(db, me):
+    now = datetime.now(timezone.utc).isoformat()
+    for i in range(FRIENDS):
+        other = f"bench-fr-{uuid.uuid4()}"
+        a, b = (me, other) if i % 2 else (other, me)
+        await db.friends.insert_one({
+            "user_id": a, "username": a, "friend_id": b, "friend_username": b,
+            "status": "accepted", "created_at": now,
+        })
+
+
+async def before(me):
+    friends = []
+    for doc in await server.db.friends.find({"user_id": me, "status": "accepted"}).to_list(None):
+        friends.append({"friend_id": doc["friend_id"], "friend_username": doc["friend_username"]})
+    for doc in await server.db.friends.find({"friend_id": me, "status": "accepted"}).to_list(None):
+        friends.append({"friend_id": doc["user_id"], "friend_username": doc["username"]})
+    return friends
+
+
+async def edges(me):
+    return await list_friends(me)
+
+
+async def edges_paged(me):
+    friends, after = [], None
+    while True:
+        page = await list_friends(me, after, PAGE)
+        friends.extend(page)
+        if len(page) < PAGE:
+            return friends
+        after = page[-1]["friend_id"]
+
+
+async def measure(label, fetch, me):
+    count = len(await fetch(me))
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        await fetch(me)
+    elapsed = (time.perf_counter() - started) / REQUESTS
+    print(f"  {label:<12} {elapsed * 1000:>8.2f} ms/listing  ({count} friends)")
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url:
+        server.db = PostgresDB(database_url)
+        await server.db.connect()
+        target = "PostgreSQL"
+    else:
+        server.db = InMemoryDB()
+        target = "InMemoryDB"
+    me = f"bench-fr-me-{uuid.uuid4()}"
+    await seed(server.db, me)
+    print(f"{FRIENDS} friends -> {target}")
+
+    await measure("before", before, me)
+    await measure("edges", edges, me)
+    await measure("edges paged", edges_paged, me)
+
+    if database_url:
+        async with server.db.pool.acquire() as conn:
+            await conn.execute("DELETE FROM friends WHERE user_id LIKE 'bench-fr-%'")
+        await server.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""Recent-chats list for a user with FRIENDS conversations: per-friend history vs the inbox.
+
+"per-friend" fetches a page of history for every friend and takes its last
+message (the N+1 the client would otherwise do). "inbox" is
+GET /api/conversations/{user_id} with the cache cleared before each request
+(summary read only); "inbox-cached" leaves the cache warm.
+
+With DATABASE_URL set the requests run against that PostgreSQL database
+(rows are removed afterwards); otherwise against InMemoryDB.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_inbox.py [friends] [messages_per_friend]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import InMemoryDB, InboxCache, get_messages, get_inbox, MESSAGE_PAGE_SIZE, INBOX_PAGE_SIZE
+from postgres_db import PostgresDB
+
+FRIENDS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+PER_FRIEND = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+REQUESTS = 20
+
+
+async def seed(db, me):
+    base = datetime.now(timezone.utc)
+    docs = []
+    for f in range(FRIENDS):
+        for i in range(PER_FRIEND):
+            sender, recipient = (f"friend-{f}", me) if i % 2 else (me, f"friend-{f}")
+            docs.append({
+                "id": f"bench-ib-{uuid.uuid4()}", "from_user_id": sender, "from_username": sender,
+                "to_user_id": recipient, "message": f"message {i}", "read": False,
+                "timestamp": (base + timedelta(milliseconds=i * FRIENDS + f)).isoformat(),
+            })
+    await db.messages.insert_many(docs)
+
+
+async def per_friend(me):
+    latest = []
+    for f in range(FRIENDS):
+        page = await get_messages(me, f"friend-{f}", None, None, None, None, limit=MESSAGE_PAGE_SIZE)
+        if page:
+            latest.append(page[-1])
+    latest.sort(key=lambda m: m["timestamp"], reverse=True)
+    return latest
+
+
+async def inbox(me):
+    server.inbox_cache = InboxCache()
+    return await get_inbox(me, limit=INBOX_PAGE_SIZE)
+
+
+async def inbox_cached(me):
+    return await get_inbox(me, limit=INBOX_PAGE_SIZE)
+
+
+async def measure(label, fetch, me):
+    await fetch(me)
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        await fetch(me)
+    elapsed = (time.perf_counter() - started) / REQUESTS
+    print(f"  {label:<13} {elapsed * 1000:>8.2f} ms/request")
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url:
+        server.db = PostgresDB(database_url)
+        await server.db.connect()
+        target = "PostgreSQL"
+    else:
+        server.db = InMemoryDB()
+        target = "InMemoryDB"
+    me = f"me-{uuid.uuid4()}"
+    await seed(server.db, me)
+    print(f"{FRIENDS} conversations x {PER_FRIEND} messages -> {target}")
+
+    await measure("per-friend", per_friend, me)
+    await measure("inbox", inbox, me)
+    await measure("inbox-cached", inbox_cached, me)
+
+    if database_url:
+        async with server.db.pool.acquire() as conn:
+            await conn.execute("DELETE FROM messages WHERE id LIKE 'bench-ib-%'")
+            await conn.execute("DELETE FROM conversations WHERE user_id = $1 OR peer_id = $1", me)
+            await conn.execute("DELETE FROM unread_counts WHERE recipient_id = $1 OR sender_id = $1", me)
+        await server.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
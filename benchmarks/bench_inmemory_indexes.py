@@ -0,0 +1,66 @@
+"""Point-lookup latency of the indexed InMemoryDB as the messages collection grows.
+
+Usage: python benchmarks/bench_inmemory_indexes.py
+"""
+import sys
+import asyncio
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from server import InMemoryDB
+
+SIZES = [1_000, 10_000, 100_000, 300_000]
+USERS = 200
+LOOKUPS = 2_000
+
+
+async def populate(db, size):
+    for i in range(size):
+        await db.messages.insert_one({
+            "id": f"msg-{i}",
+            "from_user_id": f"user-{i % USERS}",
+            "to_user_id": f"user-{(i * 7) % USERS}",
+            "message": "hello",
+            "timestamp": f"{i:012d}",
+            "read": i % 3 == 0,
+        })
+
+
+async def timed(label, size, op):
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        await op(i)
+    per_op = (time.perf_counter() - start) / LOOKUPS * 1e6
+    print(f"{label:<24} n={size:>7}  {per_op:8.2f} us/op")
+
+
+async def main():
+    for size in SIZES:
+        db = InMemoryDB()
+        await populate(db, size)
+
+        async def find_by_id(i):
+            await db.messages.find_one({"id": f"msg-{(i * 7919) % size}"})
+
+        async def mark_read(i):
+            await db.messages.update_one({"id": f"msg-{(i * 7919) % size}"}, {"$set": {"read": True}})
+
+        async def conversation(i):
+            a, b = f"user-{i % USERS}", f"user-{(i * 7) % USERS}"
+            await db.messages.find({
+                "$or": [
+                    {"from_user_id": a, "to_user_id": b},
+                    {"from_user_id": b, "to_user_id": a},
+                ]
+            }).to_list(50)
+
+        await timed("find_one(id)", size, find_by_id)
+        await timed("update_one(id, read)", size, mark_read)
+        await timed("conversation $or", size, conversation)
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
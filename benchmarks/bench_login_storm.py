@@ -0,0 +1,84 @@
+"""WebSocket-path latency while 100 logins hash passwords concurrently.
+
+A probe task wakes every 5 ms the way a WebSocket relay waits on frames; how
+late it wakes is the latency every socket on the loop sees. It is reported
+while 100 concurrent logins run (a) with bcrypt inline on the loop, as before,
+and (b) through the bounded PasswordHasher pool. bcrypt uses 10 rounds here to
+keep the run short; production cost only widens the gap.
+
+Usage: python benchmarks/bench_login_storm.py
+"""
+import sys
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from passlib.context import CryptContext
+from password_hashing import PasswordHasher
+from server import InMemoryDB, UserLogin
+
+LOGINS = 100
+TICK = 0.005
+
+
+async def probe(latencies, stop):
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK
+        await asyncio.sleep(TICK)
+        latencies.append(max(0.0, time.perf_counter() - expected))
+
+
+async def inline_login(user_in):
+    # The pre-pool behaviour: bcrypt verify directly on the event loop
+    user = await server.db.users.find_one({"username": user_in.username})
+    server.pwd_context.verify(user_in.password, user["hashed_password"])
+
+
+def report(label, latencies, elapsed):
+    ms = sorted(x * 1000 for x in latencies)
+    p99 = ms[int(len(ms) * 0.99) - 1] if ms else 0.0
+    print(f"{label:<18} logins={LOGINS} wall={elapsed:6.2f}s  frame latency "
+          f"p50={statistics.median(ms):7.2f} ms  p99={p99:7.2f} ms  max={ms[-1]:7.2f} ms")
+
+
+async def run(label, login):
+    latencies, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(latencies, stop))
+    await asyncio.sleep(0.1)
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(login(UserLogin(username="storm", password="secret")) for _ in range(LOGINS)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    rejected = sum(1 for r in results if isinstance(r, Exception))
+    report(label, latencies, elapsed)
+    if rejected:
+        print(f"{'':<18} rejected with 429: {rejected}")
+
+
+async def main():
+    server.pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=10)
+    server.password_hasher = PasswordHasher(server.pwd_context, max_workers=4, max_queue=LOGINS)
+    server.db = InMemoryDB()
+    await server.db.users.insert_one({
+        "id": "storm-id",
+        "username": "storm",
+        "hashed_password": server.pwd_context.hash("secret"),
+        "created_at": "2024-01-01T00:00:00+00:00",
+    })
+    # Idle baseline
+    await run("idle", lambda user_in: asyncio.sleep(0))
+    await run("inline bcrypt", inline_login)
+    await run("hashing pool", server.login)
+    print(server.password_hasher.stats()["queue_wait"])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
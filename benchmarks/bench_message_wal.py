@@ -0,0 +1,75 @@
+"""Append throughput and latency of the message WAL under concurrent senders.
+
+Each of CONCURRENCY senders appends message records back to back for
+DURATION seconds into a scratch directory. Group fsync means concurrent
+appends share one write + fsync, so throughput should grow with the number of
+senders while per-append latency stays near one fsync plus the group window.
+
+Usage: python benchmarks/bench_message_wal.py [directory]
+"""
+import sys
+import time
+import uuid
+import asyncio
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from message_wal import MessageWAL
+
+CONCURRENCY = [1, 10, 100, 500]
+WINDOWS_MS = [0, 2]
+DURATION = 2.0
+
+
+def make_message(i):
+    return {
+        "id": str(uuid.uuid4()),
+        "from_user_id": f"user-{i % 100}",
+        "from_username": f"user {i % 100}",
+        "to_user_id": f"user-{(i + 1) % 100}",
+        "message": "x" * 120,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def measure(directory, concurrency, window_ms):
+    wal = MessageWAL(directory, fsync_interval=window_ms / 1000)
+    wal.open()
+    latencies = []
+    deadline = time.perf_counter() + DURATION
+
+    async def sender(n):
+        i = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            lsn = await wal.append({"op": "insert", "doc": make_message(n + i)})
+            latencies.append(time.perf_counter() - started)
+            wal.ack([lsn])
+            i += 1
+
+    await asyncio.gather(*(sender(n) for n in range(concurrency)))
+    await wal.close()
+    return len(latencies) / DURATION, wal.counters["syncs"], latencies
+
+
+async def main():
+    base = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(tempfile.mkdtemp(prefix="bench-wal-"))
+    print(f"WAL in {base}, {DURATION:.0f}s per run")
+    print(f"{'window ms':>10} {'senders':>8} {'appends/s':>10} {'per fsync':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for window_ms in WINDOWS_MS:
+        for concurrency in CONCURRENCY:
+            rate, syncs, latencies = await measure(base / f"w{window_ms}-c{concurrency}", concurrency, window_ms)
+            print(f"{window_ms:>10} {concurrency:>8} {rate:>10,.0f} {len(latencies) / max(syncs, 1):>10.1f} "
+                  f"{percentile(latencies, 0.5) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
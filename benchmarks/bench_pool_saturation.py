@@ -0,0 +1,104 @@
+"""CLIENTS requests at once against a POOL_SIZE-connection pool: unbounded vs bounded acquire waits.
+
+Each request holds a connection for QUERY_MS. "unbounded" is the old pool
+(acquire waits forever), so the last requests queue behind every other one.
+"bounded" uses PG_ACQUIRE_TIMEOUT-style shedding: requests that can't get a
+connection within ACQUIRE_TIMEOUT_MS fail fast with DatabaseBusy (a 503 with
+Retry-After at the API). Reports served/shed counts and latency percentiles.
+
+With DATABASE_URL set the requests run ``SELECT pg_sleep`` on a PostgresDB
+pool of POOL_SIZE; otherwise an in-process pool models the connections.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_pool_saturation.py [clients]
+"""
+import os
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from postgres_db import PostgresDB, InstrumentedPool, QueryMonitor, DatabaseBusy
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+POOL_SIZE = 10
+QUERY_MS = 20
+ACQUIRE_TIMEOUT_MS = 250
+
+
+class ModelledPool:
+    """asyncpg-like pool of POOL_SIZE connections whose queries take QUERY_MS"""
+
+    def __init__(self):
+        self.free = asyncio.Queue()
+        for i in range(POOL_SIZE):
+            self.free.put_nowait(ModelledConnection())
+
+    async def acquire(self, timeout=None):
+        return await asyncio.wait_for(self.free.get(), timeout)
+
+    async def release(self, conn):
+        self.free.put_nowait(conn)
+
+    def get_size(self):
+        return POOL_SIZE
+
+    def get_idle_size(self):
+        return self.free.qsize()
+
+    get_min_size = get_max_size = get_size
+
+
+class ModelledConnection:
+    async def execute(self, sql, *args):
+        await asyncio.sleep(QUERY_MS / 1000)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+async def run(label, pool):
+    served, shed = [], []
+
+    async def request():
+        started = time.perf_counter()
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute("SELECT pg_sleep($1)", QUERY_MS / 1000)
+            served.append(time.perf_counter() - started)
+        except DatabaseBusy:
+            shed.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(CLIENTS)))
+    elapsed = time.perf_counter() - started
+    served.sort()
+    print(
+        f"  {label:<9} {elapsed * 1000:>7.0f} ms wall  served {len(served):>4} "
+        f"(p50 {percentile(served, 0.5):>6.0f} ms, p99 {percentile(served, 0.99):>6.0f} ms)  "
+        f"shed {len(shed):>4} (max {max(shed, default=0) * 1000:>4.0f} ms)"
+    )
+    stats = pool.stats()
+    print(f"            acquire wait avg {stats['acquire_wait']['avg_ms']} ms, max {stats['acquire_wait']['max_ms']} ms")
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    target = "PostgreSQL" if database_url else "modelled pool"
+    print(f"{CLIENTS} concurrent requests, {POOL_SIZE} connections, {QUERY_MS} ms each -> {target}")
+    for label, timeout in (("unbounded", None), ("bounded", ACQUIRE_TIMEOUT_MS / 1000)):
+        if database_url:
+            db = PostgresDB(database_url, min_size=POOL_SIZE, max_size=POOL_SIZE, acquire_timeout=timeout)
+            await db.connect()
+            await run(label, db.pool)
+            await db.close()
+        else:
+            pool = InstrumentedPool(timeout, QueryMonitor())
+            pool.pool = ModelledPool()
+            await run(label, pool)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
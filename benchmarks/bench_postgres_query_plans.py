@@ -0,0 +1,138 @@
+"""Before/after query plans for the query shapes the server issues against PostgreSQL.
+
+Loads synthetic data into a scratch schema, runs EXPLAIN (ANALYZE, BUFFERS) on
+each query shape with only the base tables, applies PostgresDB migrations, and
+repeats. The SQL comes from build_select with the query, sort and limit the
+endpoints pass, so the plans are those of the statements actually sent. Each
+plan is printed in full; after the migrations, a conversation page that
+still sorts or bitmap-scans rather than walking the index is reported.
+
+Usage: DATABASE_URL=postgresql://... python benchmarks/bench_postgres_query_plans.py [messages]
+"""
+import os
+import sys
+import json
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import asyncpg
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from postgres_db import PostgresDB, build_select
+
+SCHEMA = "bench_query_plans"
+USERS = 2_000
+
+
+# Conversation pages should be ordered index scans that stop at the page size
+PAGE_LABELS = {"conversation page", "conversation page back"}
+UNORDERED_NODES = {"Sort", "BitmapOr", "Bitmap Heap Scan", "Seq Scan"}
+
+
+def conversation(user1, user2):
+    return {"$or": [
+        {"from_user_id": user1, "to_user_id": user2},
+        {"from_user_id": user2, "to_user_id": user1},
+    ]}
+
+
+def query_shapes(base):
+    """(label, sql, params) for each query the API issues, as build_select writes it"""
+    newest = [("timestamp", -1), ("id", -1)]
+    back = conversation("user-1", "user-2")
+    # get_messages' (timestamp, id) cursor, see server._keyset_bound
+    cursor = (base + timedelta(seconds=30)).isoformat()
+    back["timestamp"] = {"$lte": cursor}
+    back["$and"] = [{"$or": [{"timestamp": {"$lt": cursor}}, {"id": {"$lt": "m"}}]}]
+    return [
+        ("conversation page", *build_select("messages", conversation("user-1", "user-2"), newest, 100)),
+        ("conversation page back", *build_select("messages", back, newest, 100)),
+        ("unread for user", *build_select("messages", {"to_user_id": "user-3", "read": False}, [("timestamp", 1)], 1000)),
+        ("accepted friends (sent)", *build_select("friends", {"user_id": "user-4", "status": "accepted"})),
+        ("accepted friends (received)", *build_select("friends", {"friend_id": "user-4", "status": "accepted"})),
+        ("pending requests", *build_select("friends", {"friend_id": "user-4", "status": "pending"})),
+    ]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+async def explain(pool, label, sql, params, check=False):
+    async with pool.acquire() as conn:
+        plan = json.loads(await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *params))[0]
+        text = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", *params)
+    print(f"  {label} ({plan['Execution Time']:.3f} ms)")
+    for row in text:
+        print(f"    {row[0]}")
+    unordered = sorted({node["Node Type"] for node in plan_nodes(plan["Plan"])} & UNORDERED_NODES)
+    if check and label in PAGE_LABELS and unordered:
+        print(f"    !! {label} is not an ordered index scan: {', '.join(unordered)}")
+        return False
+    return True
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        print("Set DATABASE_URL to a scratch PostgreSQL database")
+        return
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+
+    admin = await asyncpg.connect(database_url)
+    await admin.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await admin.execute(f"CREATE SCHEMA {SCHEMA}")
+    await admin.close()
+
+    db = PostgresDB(database_url)
+    db.pool = await asyncpg.create_pool(database_url, server_settings={"search_path": SCHEMA})
+    await db._create_tables()
+
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    async with db.pool.acquire() as conn:
+        await conn.copy_records_to_table("messages", columns=[
+            "id", "from_user_id", "from_username", "to_user_id", "message", "timestamp", "read",
+        ], records=(
+            (str(uuid.uuid4()), f"user-{i % USERS}", "bench", f"user-{(i * 7 + 1) % USERS}", "hello",
+             (base + timedelta(milliseconds=i)).isoformat(), i % 10 != 0)
+            for i in range(messages)
+        ))
+        await conn.copy_records_to_table("friends", columns=[
+            "user_id", "username", "friend_id", "friend_username", "status", "created_at",
+        ], records=(
+            (f"user-{i % USERS}", "bench", f"user-{(i * 13 + 5) % USERS}", "bench",
+             "accepted" if i % 4 else "pending", base.isoformat())
+            for i in range(USERS * 50)
+        ))
+        await conn.execute("ANALYZE")
+
+    print(f"Before migrations ({messages} messages, TEXT timestamps):")
+    for label, sql, params in query_shapes(base):
+        # Timestamps are still TEXT at this point
+        params = [p.isoformat() if isinstance(p, datetime) else p for p in params]
+        await explain(db.pool, label, sql, params)
+
+    async with db.pool.acquire() as conn:
+        # The scratch schema is only on the pool's search_path
+        await db._migrate(conn)
+    async with db.pool.acquire() as conn:
+        await conn.execute("ANALYZE")
+
+    print("After migrations (TIMESTAMPTZ + composite indexes):")
+    ordered = [await explain(db.pool, label, sql, params, check=True) for label, sql, params in query_shapes(base)]
+
+    await db.close()
+    admin = await asyncpg.connect(database_url)
+    await admin.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await admin.close()
+    if not all(ordered):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
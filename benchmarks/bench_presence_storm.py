@@ -0,0 +1,94 @@
+"""Frames and bytes delivered during a reconnect storm, with and without coalescing.
+
+Keeps N users online, each with FRIENDS accepted friends, then reconnects a fraction of them back to back (drop
+followed by connect, as after a deploy or a network blip) and counts the
+presence frames written to the sockets. A window of 0 sends every delta as it
+happens; a positive window batches net changes into one presence-batch frame.
+
+Usage: python benchmarks/bench_presence_storm.py
+"""
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import ConnectionManager, InMemoryDB
+
+ONLINE = 500
+RECONNECTING = 100
+FRIENDS = 50
+WINDOWS_MS = [0, 50, 250]
+
+
+class FakeSocket:
+    def __init__(self, counter):
+        self.counter = counter
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.counter[0] += 1
+        self.counter[1] += len(text.encode())
+
+    async def close(self, code=1000):
+        pass
+
+
+async def drain(manager):
+    while any(outbox.depth for outbox in manager.outboxes.values()):
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+
+
+async def measure(window_ms):
+    server.db = InMemoryDB()
+    for i in range(ONLINE):
+        for offset in range(1, FRIENDS // 2 + 1):
+            await server.db.friends.insert_one({
+                "user_id": f"user-{i}", "friend_id": f"user-{(i + offset) % ONLINE}", "status": "accepted"
+            })
+    window = window_ms / 1000
+    manager = ConnectionManager(presence_window=window)
+    counter = [0, 0]
+    sockets = {}
+    for i in range(ONLINE):
+        sockets[f"user-{i}"] = FakeSocket(counter)
+        await manager.connect(sockets[f"user-{i}"], f"user-{i}", f"user {i}")
+    await asyncio.sleep(window + 0.01)
+    await drain(manager)
+
+    counter[0] = counter[1] = 0
+    stats_before = dict(manager.presence_stats)
+    started = time.perf_counter()
+    for i in range(RECONNECTING):
+        user_id = f"user-{i}"
+        await manager.drop(user_id, sockets[user_id])
+        sockets[user_id] = FakeSocket(counter)
+        await manager.connect(sockets[user_id], user_id, f"user {i}")
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(window + 0.01)
+    await drain(manager)
+
+    # Snapshots sent to the reconnecting users are not presence deltas
+    frames, total_bytes = counter
+    emitted = manager.presence_stats["emitted"] - stats_before["emitted"]
+    for user_id in list(manager.active_connections):
+        manager.disconnect(user_id)
+    await asyncio.sleep(0)
+    return frames, total_bytes, emitted, elapsed
+
+
+async def main():
+    print(f"{ONLINE} online, {RECONNECTING} reconnect back to back")
+    print(f"{'window ms':>10} {'frames':>9} {'bytes':>12} {'emitted':>8} {'storm ms':>9}")
+    for window_ms in WINDOWS_MS:
+        frames, total_bytes, emitted, elapsed = await measure(window_ms)
+        print(f"{window_ms:>10} {frames:>9,} {total_bytes:>12,} {emitted:>8} {elapsed * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""Outbound bytes caused by one user connecting, before and after presence deltas.
+
+Connects N users through ConnectionManager with in-process fake sockets, then
+measures the bytes written for the (N+1)th connect, who has FRIENDS of them as
+accepted friends. "snapshot" replays the original behaviour of broadcasting the
+full users list to every socket; "delta" is the friend-scoped presence delta.
+
+Usage: python benchmarks/bench_presence_traffic.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import ConnectionManager, InMemoryDB
+
+SIZES = [100, 500, 1_000, 2_000]
+FRIENDS = 50
+
+
+class FakeSocket:
+    def __init__(self, counter):
+        self.counter = counter
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.counter[0] += len(text.encode())
+
+    async def close(self, code=1000):
+        pass
+
+
+async def drain(manager):
+    while any(outbox.depth for outbox in manager.outboxes.values()):
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+
+
+async def measure(size):
+    server.db = InMemoryDB()
+    for i in range(min(FRIENDS, size)):
+        await server.db.friends.insert_one({"user_id": "newcomer", "friend_id": f"user-{i}", "status": "accepted"})
+    manager = ConnectionManager(presence_window=0)
+    counter = [0]
+    for i in range(size):
+        await manager.connect(FakeSocket(counter), f"user-{i}", f"user {i}")
+    await drain(manager)
+
+    counter[0] = 0
+    await manager.connect(FakeSocket(counter), "newcomer", "newcomer")
+    await drain(manager)
+    delta_bytes = counter[0]
+
+    counter[0] = 0
+    await manager.broadcast({"type": "users-update", "users": list(manager.users.values())})
+    await drain(manager)
+    snapshot_bytes = counter[0]
+
+    for user_id in list(manager.active_connections):
+        manager.disconnect(user_id)
+    await asyncio.sleep(0)
+    return snapshot_bytes, delta_bytes
+
+
+async def main():
+    print(f"{'online':>7} {'snapshot bytes':>16} {'delta bytes':>12} {'ratio':>8}")
+    for size in SIZES:
+        snapshot_bytes, delta_bytes = await measure(size)
+        print(f"{size:>7} {snapshot_bytes:>16,} {delta_bytes:>12,} {snapshot_bytes / delta_bytes:>7.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""Per-query overhead of the PostgreSQL query builder and prepared-statement cache.
+
+Issues conversation-page queries whose key order and page size vary from call
+to call, as the API does.
+
+- "legacy": the old f-string SQL (LIMIT inlined, keys in caller order) run
+  with conn.fetch; every distinct text is a separate entry in asyncpg's own
+  statement cache.
+- "builder": canonical build_select SQL (LIMIT as a parameter) with
+  conn.fetch.
+- "prepared": build_select plus StatementCache, as the collections run it.
+
+Without DATABASE_URL only the SQL-building cost is measured.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_query_builder.py [queries]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+from pathlib import Path
+
+import asyncpg
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from postgres_db import build_where, build_order_by, build_select, CachingConnection, StatementCache
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+SORT = [("timestamp", -1), ("id", -1)]
+
+
+def legacy_select(query, sort, limit):
+    params = []
+    sql = f"SELECT * FROM messages WHERE {build_where(query, params)}"
+    sql += f" ORDER BY {build_order_by(sort)}"
+    sql += f" LIMIT {limit}"
+    return sql, params
+
+
+def workload():
+    rng = random.Random(7)
+    shapes = []
+    for i in range(QUERIES):
+        a, b = f"user-{rng.randrange(100)}", f"user-{rng.randrange(100)}"
+        clauses = [{"from_user_id": a, "to_user_id": b}, {"to_user_id": a, "from_user_id": b}]
+        query = {"$or": clauses}
+        if i % 2:
+            query = {"$or": [dict(reversed(list(c.items()))) for c in clauses]}
+        shapes.append((query, rng.choice((20, 50, 100, 37, 64))))
+    return shapes
+
+
+def measure_build(label, build, shapes):
+    started = time.perf_counter()
+    texts = set()
+    for query, limit in shapes:
+        sql, _ = build(query, SORT, limit)
+        texts.add(sql)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<9} {elapsed / len(shapes) * 1e6:>7.1f} us/build  {len(texts):>3} distinct statements")
+
+
+async def measure_db(label, run, shapes):
+    started = time.perf_counter()
+    for query, limit in shapes:
+        await run(query, limit)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<9} {elapsed / len(shapes) * 1e6:>7.1f} us/query")
+
+
+async def main():
+    shapes = workload()
+    print(f"{QUERIES} conversation-page queries")
+    measure_build("legacy", legacy_select, shapes)
+    measure_build("builder", lambda q, s, l: build_select("messages", q, s, l), shapes)
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        print("  (set DATABASE_URL to time the queries)")
+        return
+
+    conn = await asyncpg.connect(database_url, connection_class=CachingConnection)
+    statements = StatementCache()
+    try:
+        async def legacy(query, limit):
+            sql, params = legacy_select(query, SORT, limit)
+            await conn.fetch(sql, *params)
+
+        async def builder(query, limit):
+            sql, params = build_select("messages", query, SORT, limit)
+            await conn.fetch(sql, *params)
+
+        async def prepared(query, limit):
+            sql, params = build_select("messages", query, SORT, limit)
+            await statements.fetch(conn, sql, params)
+
+        for label, run in (("legacy", legacy), ("builder", builder), ("prepared", prepared)):
+            await measure_db(label, run, shapes)
+        print(f"  statement cache: {statements.stats()}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
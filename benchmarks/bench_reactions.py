@@ -0,0 +1,123 @@
+"""REACTORS users reacting to one hot message at once: read-modify-write vs atomic toggles.
+
+"before" is the old path: read the message, add the user to its reactions
+dict in Python, write the dict back (two round trips, last writer wins).
+"toggle" is toggle_reaction: one atomic statement per reaction against the
+reactions store. Reports wall time, reactions/s and how many of the
+REACTORS reactions survived.
+
+With DATABASE_URL set, "toggle" runs against that PostgreSQL database
+("before" can't: messages has no reactions column there); rows are removed
+afterwards. Otherwise InMemoryDB is wrapped to model a database
+ROUND_TRIP_MS away.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_reactions.py [reactors]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import InMemoryDB, toggle_reaction
+from postgres_db import PostgresDB
+
+REACTORS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+ROUND_TRIP_MS = 0.5
+EMOJI = "👍"
+
+
+class Remote:
+    """Proxy that adds a modelled network round trip to every call"""
+
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        method = getattr(self.target, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(ROUND_TRIP_MS / 1000)
+            return await method(*args, **kwargs)
+        return call
+
+
+class RemoteDB(InMemoryDB):
+    def __init__(self):
+        super().__init__()
+        self.remote_messages = Remote(self.collections["messages"])
+        self._reactions = Remote(self._reactions)
+
+    @property
+    def messages(self):
+        return self.remote_messages
+
+
+async def read_modify_write(message_id, user_id):
+    message = await server.db.messages.find_one({"id": message_id})
+    reactions = message.get("reactions", {})
+    reactions.setdefault(EMOJI, [])
+    if user_id not in reactions[EMOJI]:
+        reactions[EMOJI].append(user_id)
+    await server.db.messages.update_one({"id": message_id}, {"$set": {"reactions": reactions}})
+
+
+async def run(label, react, count):
+    message_id = f"bench-rx-{uuid.uuid4()}"
+    if isinstance(server.db, InMemoryDB):
+        # A copy per read, as a real database would return
+        await server.db.collections["messages"].insert_one({
+            "id": message_id, "from_user_id": "a", "to_user_id": "b", "message": "hot", "reactions": {},
+        })
+        original_find_one = server.db.collections["messages"].find_one
+
+        async def find_one(query):
+            doc = await original_find_one(query)
+            return {**doc, "reactions": {k: list(v) for k, v in doc.get("reactions", {}).items()}}
+        server.db.collections["messages"].find_one = find_one
+    started = time.perf_counter()
+    await asyncio.gather(*(react(message_id, f"user-{i}") for i in range(REACTORS)))
+    elapsed = time.perf_counter() - started
+    kept = await count(message_id)
+    print(f"  {label:<7} {elapsed * 1000:>9.1f} ms  {REACTORS / elapsed:>9.0f} reactions/s  kept {kept}/{REACTORS}")
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    toggle = lambda message_id, user_id: toggle_reaction(message_id, EMOJI, user_id)
+    if database_url:
+        server.db = PostgresDB(database_url)
+        await server.db.connect()
+        print(f"{REACTORS} concurrent reactions on one message -> PostgreSQL")
+
+        async def counted(message_id):
+            added, counts = await toggle_reaction(message_id, EMOJI, "bench-probe")
+            await toggle_reaction(message_id, EMOJI, "bench-probe")
+            return counts.get(EMOJI, 0) - 1
+        await run("toggle", toggle, counted)
+        async with server.db.pool.acquire() as conn:
+            await conn.execute("DELETE FROM message_reactions WHERE message_id LIKE 'bench-rx-%'")
+            await conn.execute("DELETE FROM message_reaction_counts WHERE message_id LIKE 'bench-rx-%'")
+        await server.db.close()
+        return
+
+    print(f"{REACTORS} concurrent reactions on one message -> modelled DB ({ROUND_TRIP_MS}ms round trip)")
+    server.db = RemoteDB()
+
+    async def stored(message_id):
+        doc = await server.db.collections["messages"].find_one({"id": message_id})
+        return len(doc["reactions"].get(EMOJI, []))
+    await run("before", read_modify_write, stored)
+
+    async def counted(message_id):
+        summaries = await server.db.reactions.summaries([message_id], "nobody")
+        return summaries.get(message_id, {}).get("counts", {}).get(EMOJI, 0)
+    await run("toggle", toggle, counted)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
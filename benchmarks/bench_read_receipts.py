@@ -0,0 +1,131 @@
+"""Opening a chat with UNREAD unread messages: per-message receipts vs read-up-to.
+
+"before" issues one update_one per message, as the client's one message-read
+frame per message used to. "coalesced" sends the same burst through
+ReadReceiptCoalescer (one $in UPDATE). "read-up-to" is the single range
+UPDATE behind POST /api/messages/read-up-to and the read-up-to frame.
+
+With DATABASE_URL set the statements run against that PostgreSQL database
+(rows are removed afterwards); otherwise InMemoryDB is wrapped to model a
+database ROUND_TRIP_MS away.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_read_receipts.py [unread]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import InMemoryDB, ReadReceiptCoalescer, mark_read_up_to
+from postgres_db import PostgresDB
+
+UNREAD = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+ROUND_TRIP_MS = 0.5
+
+
+class RemoteMessages:
+    """InMemoryDB messages behind a modelled network round trip"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.statements = 0
+
+    async def _round_trip(self):
+        self.statements += 1
+        await asyncio.sleep(ROUND_TRIP_MS / 1000)
+
+    async def insert_one(self, doc):
+        return await self.collection.insert_one(doc)
+
+    def find(self, query=None, projection=None):
+        return self.collection.find(query, projection)
+
+    async def find_one(self, query):
+        await self._round_trip()
+        return await self.collection.find_one(query)
+
+    async def update_one(self, query, update):
+        await self._round_trip()
+        return await self.collection.update_one(query, update)
+
+    async def update_many(self, query, update):
+        await self._round_trip()
+        return await self.collection.update_many(query, update)
+
+
+class RemoteDB:
+    def __init__(self):
+        self.messages = RemoteMessages(InMemoryDB().messages)
+
+
+async def seed(db, sender, reader):
+    base = datetime.now(timezone.utc)
+    ids = []
+    for i in range(UNREAD):
+        doc = {
+            "id": f"bench-rr-{uuid.uuid4()}", "from_user_id": sender, "from_username": "sender",
+            "to_user_id": reader, "message": f"message {i}", "read": False,
+            "timestamp": (base + timedelta(milliseconds=i)).isoformat(),
+        }
+        await db.messages.insert_one(doc)
+        ids.append(doc["id"])
+    return ids
+
+
+async def run(make_db, label, mark):
+    server.db = make_db()
+    sender, reader = f"s-{uuid.uuid4()}", f"r-{uuid.uuid4()}"
+    ids = await seed(server.db, sender, reader)
+    started = time.perf_counter()
+    await mark(sender, reader, ids)
+    elapsed = time.perf_counter() - started
+    unread = await server.db.messages.find({"to_user_id": reader, "read": False}).to_list(UNREAD)
+    statements = server.db.messages.statements if isinstance(server.db, RemoteDB) else "-"
+    print(f"  {label:<11} {elapsed * 1000:>9.1f} ms  statements: {statements:>4}  left unread: {len(unread)}")
+
+
+async def per_message(sender, reader, ids):
+    for message_id in ids:
+        await server.db.messages.update_one({"id": message_id}, {"$set": {"read": True}})
+
+
+async def coalesced(sender, reader, ids):
+    receipts = ReadReceiptCoalescer(server.apply_read_receipts, window=60)
+    for message_id in ids:
+        await receipts.add(reader, sender, message_id)
+    await receipts.flush()
+
+
+async def read_up_to(sender, reader, ids):
+    await mark_read_up_to(reader, sender, ids[-1])
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    pg = None
+    if database_url:
+        pg = PostgresDB(database_url)
+        await pg.connect()
+        make_db = lambda: pg
+        print(f"{UNREAD} unread messages -> PostgreSQL")
+    else:
+        make_db = RemoteDB
+        print(f"{UNREAD} unread messages -> modelled DB ({ROUND_TRIP_MS}ms round trip)")
+
+    for label, mark in (("before", per_message), ("coalesced", coalesced), ("read-up-to", read_up_to)):
+        await run(make_db, label, mark)
+
+    if pg is not None:
+        async with pg.pool.acquire() as conn:
+            await conn.execute("DELETE FROM messages WHERE id LIKE 'bench-rr-%'")
+        await pg.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
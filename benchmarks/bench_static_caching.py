@@ -0,0 +1,134 @@
+"""Bytes a client transfers for the frontend bundle and a video, before and after cache headers.
+
+A synthetic build (index.html, a JS bundle, a CSS bundle, with gzip siblings
+as the postbuild step writes) and a VIDEO_MB video are served by the old
+plain StaticFiles/FileResponse setup and by CachedStaticFiles. A modelled
+browser keeps a cache that honours max-age/immutable and revalidates
+everything else with If-None-Match:
+
+- first visit: every asset, full size or precompressed
+- repeat visit: what the cached browser still has to fetch
+- seek: playing the video from 10 SEEKS random positions for SEEK_KB each
+
+Usage: python benchmarks/bench_static_caching.py [video_mb]
+"""
+import os
+import sys
+import gzip
+import random
+import tempfile
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from static_files import CachedStaticFiles, IMMUTABLE, REVALIDATE
+
+VIDEO_MB = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+SEEKS = 10
+SEEK_KB = 512
+ASSETS = ["/", "/static/js/main.3f9a1c.js", "/static/css/main.77b2e0.css"]
+
+
+def make_build(root: Path):
+    (root / "static" / "js").mkdir(parents=True)
+    (root / "static" / "css").mkdir(parents=True)
+    rng = random.Random(1)
+    words = ["const", "function", "return", "props", "useState", "className", "=>", "{", "}", "div"]
+    files = {
+        "index.html": "<!doctype html><html><head><script src='/static/js/main.3f9a1c.js'></script></head>"
+                      "<body><div id=root></div></body></html>" * 4,
+        "static/js/main.3f9a1c.js": " ".join(rng.choice(words) for _ in range(150_000)),
+        "static/css/main.77b2e0.css": ".btn{padding:4px 8px;color:#333}\n" * 2000,
+    }
+    for name, text in files.items():
+        (root / name).write_text(text)
+        (root / f"{name}.gz").write_bytes(gzip.compress(text.encode(), 9))
+
+
+def old_app(build: Path, uploads: Path):
+    app = FastAPI()
+    app.mount("/uploads", StaticFiles(directory=str(uploads)))
+    app.mount("/static", StaticFiles(directory=str(build / "static")))
+
+    @app.get("/{full_path:path}")
+    async def index(full_path: str):
+        return FileResponse(str(build / "index.html"))
+    return app
+
+
+def new_app(build: Path, uploads: Path):
+    app = FastAPI()
+    app.mount("/uploads", CachedStaticFiles(directory=str(uploads), cache_control=lambda p: IMMUTABLE))
+    app.mount("/static", CachedStaticFiles(directory=str(build / "static"),
+                                           cache_control=lambda p: IMMUTABLE, precompressed=True))
+    root = CachedStaticFiles(directory=str(build), cache_control=lambda p: REVALIDATE, precompressed=True)
+
+    @app.get("/{full_path:path}")
+    async def index(full_path: str, request: Request):
+        return await root.get_response("index.html", request.scope)
+    return app
+
+
+class Browser:
+    """Counts body bytes as sent (compressed if encoded) and keeps a simple HTTP cache"""
+
+    def __init__(self, app):
+        self.client = TestClient(app)
+        self.cache = {}
+        self.bytes = 0
+        self.requests = 0
+
+    def get(self, url, headers=None):
+        cached = self.cache.get(url)
+        if cached is not None and "immutable" in cached.get("cache-control", ""):
+            return
+        headers = {"Accept-Encoding": "gzip, br", **(headers or {})}
+        if cached is not None and "etag" in cached and "range" not in {k.lower() for k in headers}:
+            headers["If-None-Match"] = cached["etag"]
+        with self.client.stream("GET", url, headers=headers) as response:
+            self.bytes += sum(len(chunk) for chunk in response.iter_raw())
+        self.requests += 1
+        if response.status_code == 200:
+            self.cache[url] = dict(response.headers)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        build, uploads = tmp / "build", tmp / "uploads"
+        make_build(build)
+        uploads.mkdir()
+        video = uploads / "clip.mp4"
+        video.write_bytes(os.urandom(VIDEO_MB * 1024 * 1024))
+        size = video.stat().st_size
+        print(f"bundle {sum(p.stat().st_size for p in build.rglob('*') if p.suffix != '.gz') / 1024:.0f} KB, "
+              f"video {VIDEO_MB} MB")
+
+        for label, make in (("before", old_app), ("after", new_app)):
+            browser = Browser(make(build, uploads))
+            for url in ASSETS:
+                browser.get(url)
+            first = browser.bytes
+            browser.bytes = browser.requests = 0
+            for url in ASSETS:
+                browser.get(url)
+            repeat, repeat_requests = browser.bytes, browser.requests
+
+            browser.bytes = 0
+            browser.cache.clear()
+            rng = random.Random(5)
+            for _ in range(SEEKS):
+                start = rng.randrange(size - SEEK_KB * 1024)
+                browser.get("/uploads/clip.mp4", {"Range": f"bytes={start}-{start + SEEK_KB * 1024 - 1}"})
+            seek = browser.bytes
+            print(f"  {label:<7} first visit {first / 1024:>7.0f} KB  repeat visit {repeat / 1024:>6.1f} KB "
+                  f"in {repeat_requests} requests  {SEEKS} seeks {seek / 2**20:>6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Status feed reads and expiry sweeps for USERS authors posting STATUSES each.
+
+"feed" times GET /api/statuses for a user with FRIENDS friends: only their
+friends' statuses are looked at, through the per-author index. "scan" is
+the same answer from filtering every live status, which is what a feed
+without the friend restriction costs as the user base grows.
+
+"sweep" times dropping the expired statuses: the bucketed expire() pops
+whole hourly buckets, "row sweep" checks every status's expiry in turn.
+
+Usage: python benchmarks/bench_status_feed.py [users]
+"""
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from server import InMemoryDB
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+STATUSES = 3
+FRIENDS = 200
+READS = 200
+
+
+async def populate(db, now):
+    for u in range(1, FRIENDS + 1):
+        await db.friends.insert_one({
+            "user_id": "u0", "username": "u0", "friend_id": f"u{u}", "friend_username": f"u{u}",
+            "status": "accepted",
+        })
+    for u in range(USERS):
+        for s in range(STATUSES):
+            # Spread creation over the past day, so about half have expired
+            created = now - timedelta(minutes=(u * STATUSES + s) % (48 * 60))
+            await db.statuses.create({
+                "id": f"s{u}-{s}", "user_id": f"u{u}", "username": f"u{u}", "content": "hi",
+                "media_url": None, "media_type": None, "created_at": created.isoformat(),
+                "expires_at": (created + timedelta(hours=24)).isoformat(), "view_count": 0,
+            })
+
+
+def row_sweep(statuses, now):
+    expired = [status_id for status_id, at in statuses.expiry.items() if at <= now]
+    for status_id in expired:
+        doc = statuses.docs.pop(status_id)
+        del statuses.expiry[status_id], statuses.viewers[status_id], statuses.recent[status_id]
+        del statuses.by_user[doc["user_id"]][status_id]
+    return len(expired)
+
+
+def scan_feed(statuses, friend_ids, now):
+    docs = [doc for doc in statuses.docs.values()
+            if doc["user_id"] in friend_ids and statuses.expiry[doc["id"]] > now]
+    return sorted(docs, key=lambda doc: doc["created_at"], reverse=True)[:500]
+
+
+async def main():
+    now = datetime.now(timezone.utc)
+    db = InMemoryDB()
+    await populate(db, now)
+    statuses = db.statuses
+    print(f"{USERS} users x {STATUSES} statuses, reader has {FRIENDS} friends")
+
+    started = time.perf_counter()
+    for _ in range(READS):
+        feed = await statuses.feed("u0", 50, 500)
+    feed_ms = (time.perf_counter() - started) / READS * 1000
+    friend_ids = {"u0"} | {f"u{u}" for u in range(1, FRIENDS + 1)}
+    started = time.perf_counter()
+    for _ in range(READS):
+        scanned = scan_feed(statuses, friend_ids, now.timestamp())
+    scan_ms = (time.perf_counter() - started) / READS * 1000
+    assert len(scanned) == len(feed)
+    print(f"  feed {feed_ms:>8.3f} ms   scan {scan_ms:>8.3f} ms   ({len(feed)} statuses)")
+
+    bucketed, rows = InMemoryDB(), InMemoryDB()
+    await populate(bucketed, now)
+    await populate(rows, now)
+    started = time.perf_counter()
+    await bucketed.statuses.expire()
+    bucket_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    expired = row_sweep(rows.statuses, datetime.now(timezone.utc).timestamp())
+    row_ms = (time.perf_counter() - started) * 1000
+    print(f"  sweep {bucket_ms:>7.2f} ms   row sweep {row_ms:>7.2f} ms   ({expired} expired)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Preview throughput of ThumbnailPool for a burst of JOBS uploads, by worker count.
+
+With Pillow installed, JOBS distinct 2400x1600 JPEGs are thumbnailed for real.
+Otherwise the renderer is modelled as RENDER_MS of GIL-releasing work on the
+pool's threads (roughly what decoding and resizing a phone photo costs).
+Each run reports jobs/s and how many jobs the bounded queue (QUEUE) dropped.
+
+Usage: python benchmarks/bench_thumbnails.py [jobs]
+"""
+import sys
+import time
+import asyncio
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import thumbnails
+from thumbnails import ThumbnailPool
+
+JOBS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+QUEUE = 256
+RENDER_MS = 40
+
+
+def make_sources(directory):
+    sources = []
+    for i in range(JOBS):
+        path = directory / f"photo-{i}.jpg"
+        if thumbnails.Image is not None:
+            thumbnails.Image.new("RGB", (2400, 1600), (i % 256, 80, 160)).save(path, "JPEG")
+        sources.append(path)
+    return sources
+
+
+async def run(workers, sources, out):
+    pool = ThumbnailPool(out / f"w{workers}", "/uploads/thumbs", workers=workers, max_queue=QUEUE)
+    if thumbnails.Image is None:
+        def render(source, thumbnail):
+            time.sleep(RENDER_MS / 1000)
+            thumbnail.write_bytes(b"thumb")
+            return {"placeholder": ""}
+
+        async def modelled(source, thumbnail, poster):
+            return await asyncio.get_running_loop().run_in_executor(pool._executor, render, source, thumbnail)
+        pool.renderers = {"image": modelled}
+    pool.start()
+    started = time.perf_counter()
+    for i, source in enumerate(sources):
+        pool.submit(f"{i:064x}", source, "image")
+    await pool.join()
+    elapsed = time.perf_counter() - started
+    stats = pool.stats()
+    await pool.close()
+    print(f"  {workers} workers  {stats['generated'] / elapsed:>7.1f} jobs/s  "
+          f"generated {stats['generated']}  dropped {stats['dropped']}  "
+          f"render avg {stats['render_time']['avg_ms']} ms")
+
+
+async def main():
+    mode = "Pillow" if thumbnails.Image is not None else f"modelled {RENDER_MS} ms renders"
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        sources = make_sources(tmp)
+        print(f"{JOBS} uploads, queue {QUEUE} -> {mode}")
+        for workers in (1, 2, 4, 8):
+            await run(workers, sources, tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
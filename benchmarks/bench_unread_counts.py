@@ -0,0 +1,79 @@
+"""Badge state for a reconnecting client: bulk unread download vs unread counters.
+
+"bulk" is GET /api/messages/unread/{user_id} (up to 1000 full message rows
+that the client then counts); "counters" is GET
+/api/messages/unread-counts/{user_id}. Reports latency per request and the
+size of the JSON response.
+
+With DATABASE_URL set the requests run against that PostgreSQL database
+(rows are removed afterwards); otherwise against InMemoryDB.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_unread_counts.py [senders] [unread_per_sender]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import server
+from server import InMemoryDB, get_unread_messages, get_unread_counts
+from postgres_db import PostgresDB
+
+SENDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+UNREAD_PER_SENDER = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+REQUESTS = 50
+
+
+async def seed(db, reader):
+    base = datetime.now(timezone.utc)
+    docs = [
+        {
+            "id": f"bench-uc-{uuid.uuid4()}", "from_user_id": f"sender-{s}", "from_username": f"sender {s}",
+            "to_user_id": reader, "message": f"message {i} " + "x" * 80, "read": False,
+            "timestamp": (base + timedelta(milliseconds=s * UNREAD_PER_SENDER + i)).isoformat(),
+        }
+        for s in range(SENDERS) for i in range(UNREAD_PER_SENDER)
+    ]
+    await db.messages.insert_many(docs)
+
+
+async def measure(label, fetch, reader):
+    body = await fetch(reader)
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        await fetch(reader)
+    elapsed = (time.perf_counter() - started) / REQUESTS
+    size = len(json.dumps(body))
+    print(f"  {label:<9} {elapsed * 1000:>8.2f} ms/request  {size:>9} bytes")
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url:
+        server.db = PostgresDB(database_url)
+        await server.db.connect()
+        target = "PostgreSQL"
+    else:
+        server.db = InMemoryDB()
+        target = "InMemoryDB"
+    reader = f"reader-{uuid.uuid4()}"
+    await seed(server.db, reader)
+    print(f"{SENDERS} senders x {UNREAD_PER_SENDER} unread messages -> {target}")
+
+    await measure("bulk", get_unread_messages, reader)
+    await measure("counters", get_unread_counts, reader)
+
+    if database_url:
+        async with server.db.pool.acquire() as conn:
+            await conn.execute("DELETE FROM messages WHERE id LIKE 'bench-uc-%'")
+        await server.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
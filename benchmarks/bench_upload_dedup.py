@@ -0,0 +1,88 @@
+"""Disk use and latency for UPLOADS uploads drawn from DISTINCT files (a forwarded-meme corpus).
+
+"before" stores every upload under a fresh name, as upload_file used to.
+"content" is UploadStore: streamed, then dropped if the blob already exists.
+(There is no checksum-only shortcut: a repeat is only matched once its bytes
+have been hashed.) File sizes cycle through SIZES_KB and uploads pick files
+with a skewed distribution, so a few files are sent many times.
+
+Usage: python benchmarks/bench_upload_dedup.py [uploads] [distinct]
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from upload_store import UploadStore
+
+UPLOADS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+DISTINCT = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+SIZES_KB = (64, 512, 2048)
+
+
+def corpus():
+    files = [os.urandom(SIZES_KB[i % len(SIZES_KB)] * 1024) for i in range(DISTINCT)]
+    rng = random.Random(3)
+    weights = [1 / (rank + 1) for rank in range(DISTINCT)]
+    return files, rng.choices(range(DISTINCT), weights, k=UPLOADS)
+
+
+def reader(data):
+    view = memoryview(data)
+    offset = 0
+
+    async def read(n):
+        nonlocal offset
+        chunk = bytes(view[offset:offset + n])
+        offset += len(chunk)
+        return chunk
+    return read
+
+
+def disk_usage(directory):
+    return sum(p.stat().st_size for p in Path(directory).rglob("*") if p.is_file())
+
+
+async def main():
+    files, picks = corpus()
+    logical = sum(len(files[i]) for i in picks)
+    print(f"{UPLOADS} uploads of {DISTINCT} distinct files ({logical / 2**20:.0f} MB sent)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        async def before(i):
+            loop = asyncio.get_running_loop()
+            path = tmp / "before" / f"{uuid.uuid4()}.bin"
+            await loop.run_in_executor(None, path.write_bytes, files[i])
+
+        content_store = UploadStore(tmp / "content" / "uploads", limits={"file": 2**30})
+
+        async def content(i):
+            await content_store.save(reader(files[i]), "meme.bin", "file")
+
+        (tmp / "before").mkdir()
+        for label, upload, directory in (
+            ("before", before, tmp / "before"),
+            ("content", content, content_store.directory),
+        ):
+            latencies = []
+            for i in picks:
+                started = time.perf_counter()
+                await upload(i)
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            print(f"  {label:<12} disk {disk_usage(directory) / 2**20:>7.1f} MB  "
+                  f"p50 {latencies[len(latencies) // 2] * 1000:>6.2f} ms  "
+                  f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:>6.2f} ms")
+        content_store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""Event-loop stalls while saving a SIZE_MB upload: blocking copy vs streamed chunks.
+
+"before" is the old upload_file: shutil.copyfileobj from the spooled upload
+to disk inside the handler. "streamed" is UploadStore.save, which hashes and
+writes chunk by chunk off the loop. A ticker task sleeping 1 ms measures how
+long the loop was blocked (what every WebSocket on the process would see).
+
+Usage: python benchmarks/bench_uploads.py [size_mb]
+"""
+import os
+import sys
+import time
+import uuid
+import shutil
+import asyncio
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from upload_store import UploadStore
+
+SIZE_MB = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+TICK_MS = 1
+
+
+async def ticker(stop, lags):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_MS / 1000)
+        lags.append((time.perf_counter() - started) * 1000 - TICK_MS)
+
+
+async def measure(label, save, source):
+    stop, lags = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(0.01)
+    with open(source, "rb") as f:
+        started = time.perf_counter()
+        await save(f)
+        elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    print(f"  {label:<9} {elapsed * 1000:>7.0f} ms  {SIZE_MB / elapsed:>6.0f} MB/s  "
+          f"longest loop stall {max(lags, default=0):>6.1f} ms")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / "source.bin"
+        with open(source, "wb") as f:
+            for _ in range(SIZE_MB):
+                f.write(os.urandom(1024 * 1024))
+        uploads = tmp / "uploads"
+        uploads.mkdir()
+        store = UploadStore(uploads, limits={"file": (SIZE_MB + 1) * 1024 * 1024})
+        print(f"{SIZE_MB} MB upload")
+
+        async def before(f):
+            with open(uploads / f"{uuid.uuid4()}.bin", "wb") as buffer:
+                shutil.copyfileobj(f, buffer)
+
+        async def streamed(f):
+            loop = asyncio.get_running_loop()
+            await store.save(lambda n: loop.run_in_executor(None, f.read, n), "source.bin", "file")
+
+        await measure("before", before, source)
+        await measure("streamed", streamed, source)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""Sustained message persistence rate: fire-and-forget inserts vs write-behind batches.
+
+"before" replays the old handler: one create_task(insert_one) per message.
+"after" goes through WriteBehind. Both persist MESSAGES messages sent as fast
+as possible and report messages/second until everything is durable.
+
+With DATABASE_URL set, writes go to that PostgreSQL database (rows are removed
+afterwards). Otherwise InMemoryDB is wrapped to model a database ROUND_TRIP_MS
+away behind a pool of POOL_SIZE connections, which is what the batching saves.
+
+Usage: [DATABASE_URL=postgresql://...] python benchmarks/bench_write_behind.py [messages]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from server import InMemoryDB
+from postgres_db import PostgresDB
+from write_behind import WriteBehind
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+ROUND_TRIP_MS = 0.5
+POOL_SIZE = 10
+
+
+class RemoteCollection:
+    """InMemoryDB messages behind a modelled network round trip and connection pool"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.pool = asyncio.Semaphore(POOL_SIZE)
+
+    async def _round_trip(self, rows=1):
+        async with self.pool:
+            # A batch is one multi-row INSERT: one round trip plus server time per row
+            await asyncio.sleep(ROUND_TRIP_MS / 1000 + rows * 2e-6)
+
+    async def insert_one(self, doc):
+        await self._round_trip()
+        return await self.collection.insert_one(doc)
+
+    async def insert_many(self, docs):
+        await self._round_trip(len(docs))
+        return await self.collection.insert_many(docs)
+
+
+def make_message(i):
+    return {
+        "id": f"bench-wb-{uuid.uuid4()}",
+        "from_user_id": f"user-{i % 100}",
+        "from_username": f"user {i % 100}",
+        "to_user_id": f"user-{(i + 1) % 100}",
+        "message": f"message {i}",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def before(messages):
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(messages.insert_one(make_message(i))) for i in range(MESSAGES)]
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started
+
+
+async def after(messages):
+    writer = WriteBehind(lambda: messages)
+    started = time.perf_counter()
+    for i in range(MESSAGES):
+        await writer.insert(make_message(i))
+    await writer.close()
+    elapsed = time.perf_counter() - started
+    return elapsed, writer.counters["batches"]
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    pg = None
+    if database_url:
+        pg = PostgresDB(database_url)
+        await pg.connect()
+        make_messages = lambda: pg.messages
+        target = "PostgreSQL"
+    else:
+        make_messages = lambda: RemoteCollection(InMemoryDB().messages)
+        target = f"modelled DB ({ROUND_TRIP_MS}ms round trip, pool of {POOL_SIZE})"
+
+    print(f"{MESSAGES} messages -> {target}")
+    elapsed = await before(make_messages())
+    print(f"  before: {MESSAGES / elapsed:>10,.0f} msg/s  ({MESSAGES} inserts)")
+    elapsed, batches = await after(make_messages())
+    print(f"  after:  {MESSAGES / elapsed:>10,.0f} msg/s  ({batches} batches)")
+
+    if pg is not None:
+        async with pg.pool.acquire() as conn:
+            await conn.execute("DELETE FROM messages WHERE id LIKE 'bench-wb-%'")
+        await pg.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
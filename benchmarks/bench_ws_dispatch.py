@@ -0,0 +1,81 @@
+"""Cost of routing FRAMES WebSocket frames: the old if/elif ladder vs FrameDispatcher.
+
+Both decode the JSON and pull out the fields a handler needs; handlers are
+no-ops, so the numbers are pure routing and validation overhead. The mix is
+weighted like a call in progress (mostly ice-candidate and typing frames),
+and ice-candidate sits near the bottom of the ladder, as it did in server.py.
+
+Usage: python benchmarks/bench_ws_dispatch.py [frames]
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from server import ws_dispatcher
+from ws_dispatch import FrameDispatcher
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+LADDER = ["presence-sync", "send-message", "typing", "stop-typing", "message-read", "read-up-to",
+          "delete-message", "edit-message", "react-message", "call-user", "accept-call", "reject-call",
+          "offer", "answer", "ice-candidate", "end-call"]
+PEER = {"from_user_id": "a", "to_user_id": "b", "from_username": "alice"}
+SAMPLES = {
+    "ice-candidate": {**PEER, "candidate": {"candidate": "candidate:1 1 udp 2122260223 10.0.0.2 54400 typ host",
+                                            "sdpMid": "0", "sdpMLineIndex": 0}},
+    "typing": PEER,
+    "send-message": {**PEER, "message": "hello there"},
+    "message-read": {**PEER, "message_id": "m1"},
+}
+WEIGHTS = {"ice-candidate": 6, "typing": 2, "send-message": 1, "message-read": 1}
+
+
+async def ladder(raw):
+    data = json.loads(raw)
+    msg_type = data.get("type")
+    for candidate in LADDER:
+        if msg_type == candidate:
+            if msg_type == "ice-candidate":
+                return data["candidate"], data["from_user_id"], data["to_user_id"]
+            return data["from_user_id"], data["to_user_id"]
+
+
+async def main():
+    rng = random.Random(3)
+    types = rng.choices(list(WEIGHTS), weights=list(WEIGHTS.values()), k=FRAMES)
+    frames = [json.dumps({"type": t, **SAMPLES[t]}) for t in types]
+
+    dispatcher = FrameDispatcher()
+
+    async def noop(user_id, frame):
+        pass
+
+    # Same schemas as the server, without the handlers' side effects
+    for msg_type, (_, schema) in ws_dispatcher.handlers.items():
+        dispatcher.on(msg_type, schema)(noop)
+
+    async def reply(frame):
+        raise AssertionError(frame)
+
+    started = time.perf_counter()
+    for raw in frames:
+        await ladder(raw)
+    ladder_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for raw in frames:
+        await dispatcher.dispatch("a", raw, reply)
+    table_s = time.perf_counter() - started
+
+    print(f"{FRAMES} frames")
+    print(f"  if/elif ladder   {ladder_s / FRAMES * 1e6:>6.2f} us/frame (no validation)")
+    print(f"  dispatcher       {table_s / FRAMES * 1e6:>6.2f} us/frame (validated, timed, counted)")
+    for msg_type, stats in dispatcher.stats()["types"].items():
+        print(f"    {msg_type:<14} {stats['handled']:>7} handled")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,31 @@
+// Writes .br and .gz siblings for text assets in build/, served by the backend
+// to clients that accept them (see backend/static_files.py).
+const fs = require("fs");
+const path = require("path");
+const zlib = require("zlib");
+
+const BUILD_DIR = path.join(__dirname, "..", "build");
+const EXTENSIONS = new Set([".js", ".css", ".html", ".json", ".svg", ".txt", ".map"]);
+const MIN_BYTES = 1024;
+
+function walk(dir) {
+  return fs.readdirSync(dir, { withFileTypes: true }).flatMap((entry) => {
+    const full = path.join(dir, entry.name);
+    return entry.isDirectory() ? walk(full) : [full];
+  });
+}
+
+let saved = 0;
+for (const file of walk(BUILD_DIR)) {
+  if (!EXTENSIONS.has(path.extname(file))) continue;
+  const source = fs.readFileSync(file);
+  if (source.length < MIN_BYTES) continue;
+  const br = zlib.brotliCompressSync(source, {
+    params: { [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY },
+  });
+  const gz = zlib.gzipSync(source, { level: zlib.constants.Z_BEST_COMPRESSION });
+  fs.writeFileSync(`${file}.br`, br);
+  fs.writeFileSync(`${file}.gz`, gz);
+  saved += source.length - br.length;
+}
+console.log(`Precompressed build assets (${(saved / 1024).toFixed(0)} KB saved with brotli)`);
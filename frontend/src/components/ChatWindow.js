@@ -1,4 +1,4 @@
-import { useState, useRef, useEffect, useMemo } from "react";
+import { useState, useRef, useEffect, useLayoutEffect, useMemo } from "react";
 import { motion, AnimatePresence } from "framer-motion";
 import { Send, Video, Phone, MoreVertical, Smile, Trash2, CheckCheck, Check, Paperclip, Image as ImageIcon, X, ArrowLeft, Edit2, Camera, Reply, Mic, Square } from "lucide-react";
 import { Button } from "@/components/ui/button";
@@ -6,6 +6,7 @@ import { Input } from "@/components/ui/input";
 import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
 import { format } from "date-fns";
 import axios from "axios";
+import { uploadFile } from "@/lib/uploads";
 
 const getBackendUrl = () => {
   if (process.env.REACT_APP_BACKEND_URL) {
@@ -19,6 +20,10 @@ const BACKEND_URL = getBackendUrl();
 
 const REACTION_EMOJIS = ['❤️', '👍', '😂', '😮', '😢', '🙏'];
 
+// Messages per history request; scrolling near the top fetches the page before the oldest one shown
+const HISTORY_PAGE_SIZE = 100;
+const LOAD_OLDER_THRESHOLD_PX = 80;
+
 export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage, typing, onStartCall, onDeleteMessage, onMarkAsRead, onBack }) => {
   const [inputMessage, setInputMessage] = useState("");
   const [isTyping, setIsTyping] = useState(false);
@@ -26,6 +31,8 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
   const [filePreview, setFilePreview] = useState(null);
   const [uploading, setUploading] = useState(false);
   const [historyMessages, setHistoryMessages] = useState([]);
+  const [hasOlderHistory, setHasOlderHistory] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [showEmojiPicker, setShowEmojiPicker] = useState(null); // messageId
   const [editingMessage, setEditingMessage] = useState(null); // {id, text}
   const [replyingTo, setReplyingTo] = useState(null); // {id, text, username}
@@ -36,6 +43,9 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
   const [showInputEmojiPicker, setShowInputEmojiPicker] = useState(false);
   const [showMenuDropdown, setShowMenuDropdown] = useState(false);
   const messagesEndRef = useRef(null);
+  const messagesContainerRef = useRef(null);
+  const prependedFromHeightRef = useRef(null);
+  const historyPeerRef = useRef(null);
   const typingTimeoutRef = useRef(null);
   const fileInputRef = useRef(null);
   const photoInputRef = useRef(null);
@@ -46,22 +56,58 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
   // Load message history when selected user changes
   useEffect(() => {
     const loadHistory = async () => {
+      const peerId = selectedUser.id;
       try {
         const response = await axios.get(
-          `${BACKEND_URL}/api/messages/${currentUser.id}/${selectedUser.id}`
+          `${BACKEND_URL}/api/messages/${currentUser.id}/${peerId}`,
+          { params: { limit: HISTORY_PAGE_SIZE } }
         );
+        if (peerId !== historyPeerRef.current) return;
         console.log("Loaded message history:", response.data);
         setHistoryMessages(response.data);
+        setHasOlderHistory(response.data.length === HISTORY_PAGE_SIZE);
       } catch (error) {
         console.error("Error loading message history:", error);
       }
     };
     
+    historyPeerRef.current = selectedUser?.id;
+    setHistoryMessages([]);
+    setHasOlderHistory(false);
     if (selectedUser) {
       loadHistory();
     }
   }, [currentUser.id, selectedUser?.id]);
 
+  // Fetch the page before the oldest loaded message, keyed on its (timestamp, id)
+  const loadOlderHistory = async () => {
+    const oldest = historyMessages[0];
+    if (!oldest || loadingOlder || !hasOlderHistory) return;
+    const peerId = selectedUser.id;
+    setLoadingOlder(true);
+    try {
+      const response = await axios.get(
+        `${BACKEND_URL}/api/messages/${currentUser.id}/${peerId}`,
+        { params: { before: oldest.timestamp, before_id: oldest.id, limit: HISTORY_PAGE_SIZE } }
+      );
+      // The user may have switched chats while the page was in flight
+      if (peerId !== historyPeerRef.current) return;
+      prependedFromHeightRef.current = messagesContainerRef.current?.scrollHeight ?? null;
+      setHistoryMessages(prev => [...response.data, ...prev]);
+      setHasOlderHistory(response.data.length === HISTORY_PAGE_SIZE);
+    } catch (error) {
+      console.error("Error loading older messages:", error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
+  const handleMessagesScroll = (e) => {
+    if (e.currentTarget.scrollTop < LOAD_OLDER_THRESHOLD_PX) {
+      loadOlderHistory();
+    }
+  };
+
   // Memoize combined and filtered messages (history + realtime)
   const filteredMessages = useMemo(() => {
     const realtimeMessages = messages.filter(
@@ -92,8 +138,15 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
 
   // Only auto-scroll on new messages, not when loading history
   const prevMessageCountRef = useRef(0);
-  useEffect(() => {
-    if (filteredMessages.length > prevMessageCountRef.current && prevMessageCountRef.current > 0) {
+  useLayoutEffect(() => {
+    const container = messagesContainerRef.current;
+    if (prependedFromHeightRef.current !== null) {
+      // Older page went in above: keep the messages being read where they were
+      if (container) {
+        container.scrollTop += container.scrollHeight - prependedFromHeightRef.current;
+      }
+      prependedFromHeightRef.current = null;
+    } else if (filteredMessages.length > prevMessageCountRef.current && prevMessageCountRef.current > 0) {
       // New message arrived, scroll to bottom
       scrollToBottom();
     }
@@ -104,14 +157,17 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
   useEffect(() => {
     if (selectedUser) {
       setTimeout(() => scrollToBottom(), 100);
-      
-      // Mark unread messages from selected user as read
+    }
+  }, [selectedUser?.id]);
+
+  useEffect(() => {
+    if (selectedUser) {
+      // Mark everything up to the newest unread message from selected user as read
       if (onMarkAsRead) {
-        filteredMessages.forEach(msg => {
-          if (!msg.read && msg.from_user_id === selectedUser.id) {
-            onMarkAsRead(msg.id, msg.from_user_id);
-          }
-        });
+        const unread = filteredMessages.filter(msg => !msg.read && msg.from_user_id === selectedUser.id);
+        if (unread.length > 0) {
+          onMarkAsRead(unread[unread.length - 1].id, selectedUser.id);
+        }
       }
     }
   }, [selectedUser, filteredMessages, onMarkAsRead]);
@@ -123,12 +179,7 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
       // Upload file first
       setUploading(true);
       try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        
-        const response = await axios.post(`${BACKEND_URL}/api/upload`, formData, {
-          headers: { 'Content-Type': 'multipart/form-data' }
-        });
+        const uploaded = await uploadFile(BACKEND_URL, selectedFile);
         
         // Send message with file
         onSendMessage({
@@ -136,10 +187,10 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
           from_user_id: currentUser.id,
           from_username: currentUser.username,
           to_user_id: selectedUser.id,
-          message: inputMessage.trim() || `Sent ${response.data.file_type}`,
-          file_url: response.data.file_url,
-          file_type: response.data.file_type,
-          file_name: response.data.file_name,
+          message: inputMessage.trim() || `Sent ${uploaded.file_type}`,
+          file_url: uploaded.file_url,
+          file_type: uploaded.file_type,
+          file_name: uploaded.file_name,
           reply_to_id: replyingTo?.id,
           reply_to_text: replyingTo?.text,
           reply_to_username: replyingTo?.username
@@ -239,6 +290,7 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
       type: "react-message",
       message_id: messageId,
       user_id: currentUser.id,
+      from_user_id: currentUser.id,
       to_user_id: selectedUser.id,
       emoji: emoji
     });
@@ -533,11 +585,16 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
       </div>
 
       {/* Messages */}
-      <div className="flex-1 overflow-y-auto p-4 scrollbar-hide" data-testid="messages-container" style={{
+      <div ref={messagesContainerRef} onScroll={handleMessagesScroll} className="flex-1 overflow-y-auto p-4 scrollbar-hide" data-testid="messages-container" style={{
         scrollbarWidth: 'none',
         msOverflowStyle: 'none'
       }}>
         <div className="space-y-4">
+        {loadingOlder && (
+          <div className="text-center text-xs text-gray-500 dark:text-gray-400" data-testid="loading-older-messages">
+            Loading earlier messages...
+          </div>
+        )}
         <AnimatePresence>
           {filteredMessages.map((msg, index) => {
             const isOwn = msg.from_user_id === currentUser.id;
@@ -625,9 +682,18 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
                           {msg.file_url && msg.file_type === 'image' && (
                             <div className="mb-2 overflow-hidden rounded-lg">
                               <img 
-                                src={`${BACKEND_URL}${msg.file_url}`} 
+                                src={`${BACKEND_URL}${msg.preview?.thumbnail_url || msg.file_url}`} 
                                 alt={msg.file_name || 'Image'} 
+                                loading="lazy"
+                                width={msg.preview?.width}
+                                height={msg.preview?.height}
+                                style={msg.preview?.placeholder ? { backgroundImage: `url(${msg.preview.placeholder})`, backgroundSize: 'cover' } : undefined}
                                 className="max-w-full max-h-64 object-contain cursor-pointer hover:opacity-90 transition-opacity"
+                                onError={(e) => {
+                                  // Thumbnail not generated (yet); fall back to the original
+                                  const original = `${BACKEND_URL}${msg.file_url}`;
+                                  if (e.currentTarget.src !== original) e.currentTarget.src = original;
+                                }}
                                 onClick={() => window.open(`${BACKEND_URL}${msg.file_url}`, '_blank')}
                               />
                             </div>
@@ -636,6 +702,8 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
                             <div className="mb-2 overflow-hidden rounded-lg">
                               <video 
                                 src={`${BACKEND_URL}${msg.file_url}`} 
+                                poster={msg.preview?.poster_url ? `${BACKEND_URL}${msg.preview.poster_url}` : undefined}
+                                preload={msg.preview?.poster_url ? "none" : "metadata"}
                                 controls 
                                 className="max-w-full max-h-64 object-contain"
                               />
@@ -719,18 +787,18 @@ export const ChatWindow = ({ currentUser, selectedUser, messages, onSendMessage,
                         {/* Reactions */}
                         {msg.reactions && Object.keys(msg.reactions).length > 0 && (
                           <div className="flex flex-wrap gap-1 mt-1">
-                            {Object.entries(msg.reactions).map(([emoji, userIds]) => (
+                            {Object.entries(msg.reactions).map(([emoji, count]) => (
                               <button
                                 key={emoji}
                                 onClick={() => handleReaction(msg.id, emoji)}
                                 className={`px-2 py-0.5 rounded-full text-xs flex items-center gap-1 transition-colors ${
-                                  userIds.includes(currentUser.id)
+                                  msg.my_reactions?.includes(emoji)
                                     ? 'bg-blue-100 dark:bg-blue-900 border border-blue-500'
                                     : 'bg-gray-100 dark:bg-gray-800 border border-gray-300 dark:border-gray-600'
                                 }`}
                               >
                                 <span>{emoji}</span>
-                                <span className="text-gray-600 dark:text-gray-400">{userIds.length}</span>
+                                <span className="text-gray-600 dark:text-gray-400">{count}</span>
                               </button>
                             ))}
                           </div>
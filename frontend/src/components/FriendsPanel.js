@@ -19,6 +19,7 @@ const BACKEND_URL = getBackendUrl();
 
 export const FriendsPanel = ({ user, onSelectFriend }) => {
   const [friends, setFriends] = useState([]);
+  const [conversations, setConversations] = useState({});
   const [friendRequests, setFriendRequests] = useState([]);
   const [newFriendUsername, setNewFriendUsername] = useState("");
   const [tab, setTab] = useState("friends"); // "friends" or "requests"
@@ -27,10 +28,12 @@ export const FriendsPanel = ({ user, onSelectFriend }) => {
     if (user?.id) {
       loadFriends();
       loadFriendRequests();
+      loadConversations();
       // Poll for new requests and friends status every 5 seconds
       const interval = setInterval(() => {
         loadFriendRequests();
         loadFriends(); // Refresh to update online status
+        loadConversations();
       }, 5000);
       return () => clearInterval(interval);
     }
@@ -45,6 +48,27 @@ export const FriendsPanel = ({ user, onSelectFriend }) => {
     }
   };
 
+  // Last message and unread count per peer, from the inbox summary
+  const loadConversations = async () => {
+    try {
+      const response = await axios.get(`${BACKEND_URL}/api/conversations/${user.id}`);
+      const byPeer = {};
+      response.data.forEach((conversation) => {
+        byPeer[conversation.peer_id] = conversation;
+      });
+      setConversations(byPeer);
+    } catch (error) {
+      console.error("Error loading conversations:", error);
+    }
+  };
+
+  // Most recent conversations first; friends never messaged keep their order
+  const sortedFriends = [...friends].sort((a, b) => {
+    const at = conversations[a.friend_id]?.last_message.timestamp || "";
+    const bt = conversations[b.friend_id]?.last_message.timestamp || "";
+    return bt.localeCompare(at);
+  });
+
   const loadFriendRequests = async () => {
     try {
       const response = await axios.get(
@@ -160,7 +184,7 @@ export const FriendsPanel = ({ user, onSelectFriend }) => {
         {tab === "friends" ? (
           // Friends List
           friends.length > 0 ? (
-            friends.map((friend) => (
+            sortedFriends.map((friend) => (
               <motion.button
                 key={friend.friend_id}
                 initial={{ opacity: 0, y: 10 }}
@@ -207,10 +231,23 @@ export const FriendsPanel = ({ user, onSelectFriend }) => {
                         )}
                       </span>
                     </div>
-                    <p className="text-xs text-gray-500 dark:text-gray-400 truncate mt-0.5">
-                      <span className="inline-block mr-1">✓✓</span>
-                      Click to start chatting
-                    </p>
+                    <div className="flex items-center justify-between mt-0.5">
+                      <p className="text-xs text-gray-500 dark:text-gray-400 truncate">
+                        <span className="inline-block mr-1">✓✓</span>
+                        {conversations[friend.friend_id]
+                          ? conversations[friend.friend_id].last_message.deleted
+                            ? "Message deleted"
+                            : conversations[friend.friend_id].last_message.message ||
+                              conversations[friend.friend_id].last_message.file_type ||
+                              ""
+                          : "Click to start chatting"}
+                      </p>
+                      {conversations[friend.friend_id]?.unread > 0 && (
+                        <span className="bg-[#00a884] text-white text-xs rounded-full min-w-[20px] h-5 flex items-center justify-center font-bold px-1 ml-2 flex-shrink-0">
+                          {conversations[friend.friend_id].unread > 99 ? "99+" : conversations[friend.friend_id].unread}
+                        </span>
+                      )}
+                    </div>
                   </div>
                   
                   <MessageSquare className="w-4 h-4 text-[#008069] flex-shrink-0" />
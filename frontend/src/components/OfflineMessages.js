@@ -11,21 +11,39 @@ export const OfflineMessages = ({ user, onMessageSelect }) => {
   const [unreadCount, setUnreadCount] = useState(0);
   const [isOpen, setIsOpen] = useState(false);
 
+  // The badge polls the cheap per-sender counters; message bodies are only
+  // fetched while the panel is open
   useEffect(() => {
     if (user?.id) {
-      loadOfflineMessages();
-      const interval = setInterval(loadOfflineMessages, 3000);
+      loadUnreadCount();
+      const interval = setInterval(loadUnreadCount, 3000);
       return () => clearInterval(interval);
     }
   }, [user?.id]);
 
+  useEffect(() => {
+    if (isOpen && user?.id) {
+      loadOfflineMessages();
+    }
+  }, [isOpen, user?.id]);
+
+  const loadUnreadCount = async () => {
+    try {
+      const response = await axios.get(
+        `${BACKEND_URL}/api/messages/unread-counts/${user.id}`
+      );
+      setUnreadCount(response.data.total);
+    } catch (error) {
+      console.error("Error loading unread counts:", error);
+    }
+  };
+
   const loadOfflineMessages = async () => {
     try {
       const response = await axios.get(
         `${BACKEND_URL}/api/messages/unread/${user.id}`
       );
       setOfflineMessages(response.data);
-      setUnreadCount(response.data.length);
     } catch (error) {
       console.error("Error loading offline messages:", error);
     }
@@ -51,7 +69,7 @@ export const OfflineMessages = ({ user, onMessageSelect }) => {
       await axios.post(
         `${BACKEND_URL}/api/messages/${message.id}/read`
       );
-      loadOfflineMessages();
+      loadUnreadCount();
       onMessageSelect?.(message);
     } catch (error) {
       console.error("Error marking message as read:", error);
@@ -107,8 +107,10 @@ export const StatusViewer = ({ user }) => {
 
     // Mark as viewed
     try {
-      await axios.post(`${BACKEND_URL}/api/statuses/${statusGroup.statuses[index].id}/view`, {
-        user_id: user.id
+      const status = statusGroup.statuses[index];
+      await axios.post(`${BACKEND_URL}/api/statuses/${status.id}/view`, {
+        user_id: user.id,
+        expires_at: status.expires_at
       });
     } catch (error) {
       console.error("Error marking status as viewed:", error);
@@ -343,7 +345,7 @@ export const StatusViewer = ({ user }) => {
           {/* View count */}
           <div className="absolute bottom-4 left-4 text-white flex items-center gap-2 opacity-80">
             <Eye className="w-4 h-4" />
-            <span className="text-sm">{currentStatus.views.length} views</span>
+            <span className="text-sm">{currentStatus.view_count ?? currentStatus.views.length} views</span>
           </div>
         </div>
       )}
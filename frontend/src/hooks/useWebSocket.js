@@ -29,6 +29,7 @@ export const useWebSocket = (user) => {
   const reconnectTimeoutRef = useRef(null);
   const messageHandlersRef = useRef({});
   const reconnectAttemptsRef = useRef(0);
+  const presenceVersionRef = useRef(null);
 
   const connect = useCallback(() => {
     if (!user) return;
@@ -49,7 +50,27 @@ export const useWebSocket = (user) => {
           switch (data.type) {
             case "users-update":
               setUsers(data.users);
+              presenceVersionRef.current = data.version ?? null;
               break;
+
+            case "user-joined":
+            case "user-updated":
+            case "user-left":
+            case "presence-batch": {
+              // Deltas must arrive in order; on a gap, ask for a fresh snapshot
+              if (presenceVersionRef.current !== null && data.version !== presenceVersionRef.current + 1) {
+                ws.send(JSON.stringify({ type: "presence-sync" }));
+                break;
+              }
+              presenceVersionRef.current = data.version;
+              const events = data.type === "presence-batch" ? data.events : [data];
+              setUsers(prev => events.reduce((list, e) => (
+                e.type === "user-left"
+                  ? list.filter(u => u.id !== e.user_id)
+                  : [...list.filter(u => u.id !== e.user.id), e.user]
+              ), prev));
+              break;
+            }
               
             case "receive-message":
               setMessages(prev => [...prev, data.message]);
@@ -74,6 +95,22 @@ export const useWebSocket = (user) => {
                 )
               );
               break;
+
+            case "messages-read": {
+              // A coalesced burst of per-message receipts
+              const ids = new Set(data.message_ids);
+              setMessages(prev => prev.map(m => (!m.read && ids.has(m.id) ? { ...m, read: true } : m)));
+              break;
+            }
+
+            case "messages-read-up-to":
+              // Everything we sent the reader up to and including data.up_to
+              setMessages(prev => prev.map(m => (
+                !m.read && m.to_user_id === data.read_by && m.timestamp <= data.up_to.timestamp
+                  ? { ...m, read: true }
+                  : m
+              )));
+              break;
               
             case "delete-message":
               setMessages(prev => 
@@ -92,10 +129,18 @@ export const useWebSocket = (user) => {
               break;
 
             case "message-reaction":
+              // Counts per emoji; our own toggles also update my_reactions
               setMessages(prev => 
-                prev.map(m => 
-                  m.id === data.message_id ? { ...m, reactions: data.reactions } : m
-                )
+                prev.map(m => {
+                  if (m.id !== data.message_id) return m;
+                  let mine = m.my_reactions || [];
+                  if (data.user_id === user.id) {
+                    mine = data.added
+                      ? [...mine.filter(e => e !== data.emoji), data.emoji]
+                      : mine.filter(e => e !== data.emoji);
+                  }
+                  return { ...m, reactions: data.reactions, my_reactions: mine };
+                })
               );
               break;
               
@@ -130,6 +175,11 @@ export const useWebSocket = (user) => {
               }
               break;
               
+            case "error":
+              // A frame we sent was rejected; the connection stays open
+              console.warn(`[WEBSOCKET] Server rejected ${data.for || "frame"}:`, data.detail);
+              break;
+
             default:
               // Pass to WebRTC handler
               const handler = messageHandlersRef.current[data.type] || (window.webrtcHandlers && window.webrtcHandlers[data.type]);
@@ -234,9 +284,10 @@ export const useWebSocket = (user) => {
     });
   }, [sendMessage, user]);
 
+  // Marks the conversation read up to and including messageId
   const markAsRead = useCallback((messageId, fromUserId) => {
     sendMessage({
-      type: "message-read",
+      type: "read-up-to",
       message_id: messageId,
       from_user_id: user.id,
       to_user_id: fromUserId
@@ -0,0 +1,53 @@
+import axios from "axios";
+
+// Files above this go through the resumable endpoints in chunks
+const RESUMABLE_THRESHOLD = 8 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+// crypto.subtle hashes in one piece, so only files up to this size are checksummed on commit
+const MAX_HASHED_SIZE = 256 * 1024 * 1024;
+
+async function sha256Hex(file) {
+  if (file.size > MAX_HASHED_SIZE || !window.crypto?.subtle) return undefined;
+  const digest = await window.crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
+export async function uploadFile(backendUrl, file) {
+  if (file.size <= RESUMABLE_THRESHOLD) {
+    const formData = new FormData();
+    formData.append("file", file);
+    const response = await axios.post(`${backendUrl}/api/upload`, formData);
+    return response.data;
+  }
+
+  const { data: session } = await axios.post(`${backendUrl}/api/uploads`, {
+    file_name: file.name,
+    size: file.size,
+  });
+  const url = `${backendUrl}/api/uploads/${session.upload_id}`;
+  let offset = 0;
+  let failures = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + session.chunk_size);
+    try {
+      const { data } = await axios.put(url, chunk, {
+        params: { offset },
+        headers: { "Content-Type": "application/octet-stream" },
+      });
+      offset = data.offset;
+      failures = 0;
+    } catch (error) {
+      if (++failures > MAX_CHUNK_RETRIES || error.response?.status === 404 || error.response?.status === 413) {
+        throw error;
+      }
+      // Resume from whatever the server actually kept
+      await new Promise((resolve) => setTimeout(resolve, 500 * failures));
+      const { data } = await axios.get(url);
+      offset = data.offset;
+    }
+  }
+  // Lets the server catch a file that changed or got corrupted on the way
+  const sha256 = await sha256Hex(file);
+  const { data } = await axios.post(`${url}/commit`, { sha256 });
+  return data;
+}
@@ -1,4 +1,6 @@
 import sys
+import asyncio
+import hashlib
 import os
 from pathlib import Path
 import pytest
@@ -17,8 +19,9 @@ client = TestClient(app)
 def reset_db():
     """Reset the in-memory database and connection manager before each test."""
     server.db = InMemoryDB()
-    server.manager.active_connections = {}
-    server.manager.users = {}
+    # TestClient runs each socket on its own short-lived loop, so flush presence immediately
+    server.manager = server.ConnectionManager(presence_window=0)
+    server.inbox_cache = server.InboxCache()
 
 def test_root():
     response = client.get("/api/")
@@ -132,9 +135,9 @@ def test_messaging_flow():
     
     # Verify reaction
     response = client.get(f"/api/messages/{u1['id']}/{u2['id']}")
-    reactions = response.json()[0]["reactions"]
-    assert "👍" in reactions
-    assert u2["id"] in reactions["👍"]
+    assert response.json()[0]["reactions"] == {"👍": 1}
+    response = client.get(f"/api/messages/{u2['id']}/{u1['id']}")
+    assert response.json()[0]["my_reactions"] == ["👍"]
 
     # Delete message
     response = client.delete(f"/api/messages/{msg_id}")
@@ -217,3 +220,305 @@ def test_friend_request_to_self():
     assert response.status_code == 400
     assert "Cannot send friend request to yourself" in response.json()["detail"]
 
+
+def test_messages_keyset_pagination():
+    u1 = client.post("/api/register", json={"username": "page_u1", "password": "pw"}).json()
+    u2 = client.post("/api/register", json={"username": "page_u2", "password": "pw"}).json()
+
+    sent = []
+    for i in range(5):
+        msg_data = {
+            "from_user_id": u1["id"] if i % 2 == 0 else u2["id"],
+            "from_username": "page",
+            "to_user_id": u2["id"] if i % 2 == 0 else u1["id"],
+            "message": f"msg {i}"
+        }
+        sent.append(client.post("/api/messages", json=msg_data).json())
+
+    url = f"/api/messages/{u1['id']}/{u2['id']}"
+
+    # Newest page first, returned oldest first
+    latest = client.get(url, params={"limit": 2}).json()
+    assert [m["message"] for m in latest] == ["msg 3", "msg 4"]
+
+    # Page back from the oldest message of that page
+    older = client.get(url, params={
+        "limit": 2,
+        "before": latest[0]["timestamp"],
+        "before_id": latest[0]["id"],
+    }).json()
+    assert [m["message"] for m in older] == ["msg 1", "msg 2"]
+
+    # Catch up from a known message
+    newer = client.get(url, params={
+        "after": sent[2]["timestamp"],
+        "after_id": sent[2]["id"],
+    }).json()
+    assert [m["message"] for m in newer] == ["msg 3", "msg 4"]
+
+    response = client.get(url, params={"limit": 0})
+    assert response.status_code == 422
+
+    # A mangled cursor is an error, not an empty conversation
+    response = client.get(url, params={"before": "not-a-time", "before_id": latest[0]["id"]})
+    assert response.status_code == 422
+
+def test_read_up_to_marks_conversation_range():
+    sender, reader = "ru-sender", "ru-reader"
+    sent = []
+    for i in range(5):
+        sent.append(client.post("/api/messages", json={
+            "from_user_id": sender, "from_username": "s", "to_user_id": reader, "message": f"msg {i}"
+        }).json())
+    # A reply in the other direction is not the reader's to acknowledge
+    client.post("/api/messages", json={
+        "from_user_id": reader, "from_username": "r", "to_user_id": sender, "message": "reply"
+    })
+
+    response = client.post("/api/messages/read-up-to", json={
+        "reader_id": reader, "sender_id": sender, "message_id": sent[2]["id"]
+    })
+    assert response.json() == {"status": "success", "updated": 3}
+
+    unread = asyncio.run(server.db.messages.find({"read": False}).to_list(100))
+    assert sorted(m["message"] for m in unread) == ["msg 3", "msg 4", "reply"]
+
+    response = client.post("/api/messages/read-up-to", json={
+        "reader_id": sender, "sender_id": reader, "message_id": sent[4]["id"]
+    })
+    assert response.status_code == 404
+
+def test_unread_counts_track_sends_and_reads():
+    reader = "uc-reader"
+    sent = {}
+    for sender, n in (("uc-a", 3), ("uc-b", 2)):
+        sent[sender] = [client.post("/api/messages", json={
+            "from_user_id": sender, "from_username": sender, "to_user_id": reader, "message": f"msg {i}"
+        }).json() for i in range(n)]
+    assert client.get(f"/api/messages/unread-counts/{reader}").json() == {
+        "total": 5, "by_sender": {"uc-a": 3, "uc-b": 2}
+    }
+
+    client.post("/api/messages/read-up-to", json={
+        "reader_id": reader, "sender_id": "uc-a", "message_id": sent["uc-a"][1]["id"]
+    })
+    client.post(f"/api/messages/{sent['uc-b'][0]['id']}/read")
+    assert client.get(f"/api/messages/unread-counts/{reader}").json() == {
+        "total": 2, "by_sender": {"uc-a": 1, "uc-b": 1}
+    }
+
+def test_inbox_lists_conversations_by_recency():
+    me = "ib-me"
+    def send(sender, recipient, text):
+        return client.post("/api/messages", json={
+            "from_user_id": sender, "from_username": sender, "to_user_id": recipient, "message": text
+        }).json()
+    send("ib-a", me, "hi from a")
+    send(me, "ib-b", "hi b")
+    last = send("ib-a", me, "again from a")
+
+    inbox = client.get(f"/api/conversations/{me}").json()
+    assert [c["peer_id"] for c in inbox] == ["ib-a", "ib-b"]
+    assert inbox[0]["last_message"]["id"] == last["id"]
+    assert [c["unread"] for c in inbox] == [2, 0]
+
+    # Served from the cache until a message touches the user
+    assert client.get(f"/api/conversations/{me}", params={"limit": 1}).json() == inbox[:1]
+    assert server.inbox_cache.counters["hits"] == 1
+    send("ib-b", me, "reply from b")
+    inbox = client.get(f"/api/conversations/{me}").json()
+    assert [c["peer_id"] for c in inbox] == ["ib-b", "ib-a"]
+    assert inbox[0]["last_message"]["message"] == "reply from b"
+
+    client.post("/api/messages/read-up-to", json={"reader_id": me, "sender_id": "ib-a", "message_id": last["id"]})
+    inbox = client.get(f"/api/conversations/{me}").json()
+    assert [c["unread"] for c in inbox] == [1, 0]
+
+def test_friends_are_paged_across_both_directions():
+    me = "fp-me"
+    for i in range(5):
+        # Alternate who sent the request; both directions list the same way
+        a, b = (me, f"fp-{i}") if i % 2 else (f"fp-{i}", me)
+        asyncio.run(server.db.friends.insert_one({
+            "user_id": a, "username": a, "friend_id": b, "friend_username": b, "status": "accepted"
+        }))
+    asyncio.run(server.db.friends.insert_one({
+        "user_id": "fp-9", "username": "fp-9", "friend_id": me, "friend_username": me, "status": "pending"
+    }))
+
+    first = client.get(f"/api/friends/{me}", params={"limit": 3}).json()
+    assert [f["friend_id"] for f in first] == ["fp-0", "fp-1", "fp-2"]
+    rest = client.get(f"/api/friends/{me}", params={"limit": 3, "after": first[-1]["friend_id"]}).json()
+    assert [f["friend_id"] for f in rest] == ["fp-3", "fp-4"]
+    assert len(client.get(f"/api/friends/{me}").json()) == 5
+    assert client.get(f"/api/friends/{me}", params={"limit": 0}).status_code == 422
+
+def test_register_rejected_when_hashing_pool_full(monkeypatch):
+    hasher = server.PasswordHasher(server.pwd_context, max_workers=1, max_queue=0)
+    hasher._pending = 1  # pool already busy
+    monkeypatch.setattr(server, "password_hasher", hasher)
+
+    response = client.post("/api/register", json={"username": "storm", "password": "pw"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+
+    metrics = client.get("/api/metrics").json()
+    assert metrics["password_hashing"]["rejected"] == 1
+
+def test_saturated_database_pool_returns_503(monkeypatch):
+    async def busy(*args, **kwargs):
+        raise server.DatabaseBusy("no connection free")
+    monkeypatch.setattr(server.db.messages, "unread_counts", busy)
+
+    response = client.get("/api/messages/unread-counts/someone")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+@pytest.fixture
+def upload_store(tmp_path, monkeypatch):
+    store = server.UploadStore(tmp_path / "uploads", limits=dict(server.upload_store.limits))
+    monkeypatch.setattr(server, "upload_store", store)
+    yield store
+    store.close()
+
+def test_resumable_upload_appends_at_offsets_and_verifies_checksum(upload_store):
+    body = b"0123456789" * 10
+    session = client.post("/api/uploads", json={"file_name": "clip.mp4", "size": len(body)}).json()
+    url = f"/api/uploads/{session['upload_id']}"
+
+    assert client.put(url, params={"offset": 0}, content=body[:40]).json()["offset"] == 40
+    stale = client.put(url, params={"offset": 0}, content=body[:40])
+    assert stale.status_code == 409
+    assert stale.headers["upload-offset"] == "40"
+    assert client.get(url).json() == {"upload_id": session["upload_id"], "offset": 40, "size": 100}
+    assert client.post(f"{url}/commit", json={}).status_code == 400  # incomplete
+    assert client.put(url, params={"offset": 40}, content=body[40:] + b"!").status_code == 413
+
+    client.put(url, params={"offset": client.get(url).json()["offset"]}, content=body[40:])
+    assert client.post(f"{url}/commit", json={"sha256": "0" * 64}).status_code == 400
+    data = client.post(f"{url}/commit", json={"sha256": hashlib.sha256(body).hexdigest()}).json()
+    assert data["file_type"] == "video" and data["size"] == 100
+    assert (upload_store.directory / data["file_url"].removeprefix("/uploads/")).read_bytes() == body
+    assert client.get(url).status_code == 404
+
+def test_upload_over_type_limit_is_rejected(upload_store, monkeypatch):
+    monkeypatch.setitem(upload_store.limits, "image", 10)
+    response = client.post("/api/upload", files={'file': ('big.png', b"x" * 11, 'image/png')})
+    assert response.status_code == 413
+    assert client.post("/api/uploads", json={"file_name": "big.png", "size": 11}).status_code == 413
+    assert not list(upload_store.partial_dir.iterdir())
+
+def test_multipart_uploads_are_cut_off_while_streaming(upload_store, monkeypatch):
+    monkeypatch.setitem(upload_store.limits, "image", 10)
+    head = (b'--b\r\nContent-Disposition: form-data; name="file"; filename="big.png"\r\n'
+            b'Content-Type: image/png\r\n\r\n')
+    sent = []
+
+    async def body():
+        yield head
+        for _ in range(100):
+            sent.append(1)
+            yield b"x" * 8
+
+    with pytest.raises(server.UploadTooLarge):
+        asyncio.run(upload_store.save_multipart(body(), "multipart/form-data; boundary=b", None, server.get_file_type))
+    # Stopped at the chunk that crossed the limit, nothing spooled or kept
+    assert len(sent) == 2
+    assert not list(upload_store.partial_dir.iterdir())
+
+    # A declared length past every limit is refused before the body is read
+    response = client.post("/api/upload", content=b"", headers={
+        "content-type": "multipart/form-data; boundary=b",
+        "content-length": str(max(upload_store.limits.values()) + 1024 * 1024),
+    })
+    assert response.status_code == 413
+    assert client.post("/api/upload", content=b"not a form").status_code == 400
+
+def test_repeated_uploads_share_one_blob_until_released(upload_store):
+    meme = b"the same meme, forwarded"
+    first = client.post("/api/upload", files={'file': ('meme.png', meme, 'image/png')}).json()
+    second = client.post("/api/upload", files={'file': ('copy.png', meme, 'image/png')}).json()
+    assert first["file_url"] == second["file_url"]
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    assert first["upload_id"] != second["upload_id"]
+
+    # The public name isn't the content hash, and a checksum alone claims nothing
+    assert first["sha256"] not in first["file_url"]
+    session = client.post("/api/uploads", json={"file_name": "again.png", "size": len(meme), "sha256": first["sha256"]}).json()
+    assert "file_url" not in session and session["offset"] == 0
+    # Sending the bytes still deduplicates on the storage side
+    url = f"/api/uploads/{session['upload_id']}"
+    client.put(url, params={"offset": 0}, content=meme)
+    third = client.post(f"{url}/commit", json={"sha256": first["sha256"]}).json()
+    assert third["file_url"] == first["file_url"] and third["deduplicated"]
+
+    blob = upload_store.directory / first["file_url"].removeprefix("/uploads/")
+    assert upload_store.stats()["blobs"] == 1 and upload_store.stats()["uploads"] == 3
+    for upload in (first, second):
+        assert client.delete(f"/api/uploads/{upload['upload_id']}").status_code == 200
+    assert blob.exists()
+    client.delete(f"/api/uploads/{third['upload_id']}")
+    assert not blob.exists()
+    assert client.delete(f"/api/uploads/{third['upload_id']}").status_code == 404
+
+def test_status_feed_is_limited_to_friends_and_counts_views_once():
+    asyncio.run(server.db.friends.insert_one({
+        "user_id": "st-a", "username": "a", "friend_id": "st-b", "friend_username": "b", "status": "accepted"
+    }))
+    first = client.post("/api/statuses", json={"user_id": "st-b", "username": "b", "content": "first"}).json()
+    second = client.post("/api/statuses", json={"user_id": "st-b", "username": "b", "content": "second"}).json()
+    client.post("/api/statuses", json={"user_id": "st-c", "username": "c", "content": "stranger"})
+    assert client.post("/api/statuses", json={"user_id": "st-b", "username": "b"}).status_code == 400
+
+    feed = client.get("/api/statuses/st-a").json()
+    # Played oldest first, and nothing from non-friends
+    assert [s["id"] for s in feed] == [first["id"], second["id"]]
+    assert feed[0]["views"] == [] and feed[0]["view_count"] == 0
+
+    for _ in range(3):
+        client.post(f"/api/statuses/{first['id']}/view", json={"user_id": "st-a"})
+    assert client.post(f"/api/statuses/{first['id']}/view", json={"user_id": "st-b"}).json()["counted"] is False
+    assert client.get("/api/statuses/st-a").json()[0]["views"] == ["st-a"]
+    own = client.get("/api/statuses/st-b").json()[0]
+    assert (own["views"], own["view_count"]) == (["st-a"], 1)
+    assert client.post("/api/statuses/missing/view", json={"user_id": "st-a"}).status_code == 404
+
+def test_expired_statuses_leave_the_feed(monkeypatch):
+    monkeypatch.setattr(server, "STATUS_TTL_HOURS", -1)
+    expired = client.post("/api/statuses", json={"user_id": "ex-a", "username": "a", "content": "gone"}).json()
+    assert client.get("/api/statuses/ex-a").json() == []
+    assert client.post(f"/api/statuses/{expired['id']}/view", json={"user_id": "ex-b"}).status_code == 404
+
+def test_rest_edits_reach_messages_still_in_the_write_buffer(monkeypatch):
+    monkeypatch.setattr(server, "message_writer", server.WriteBehind(lambda: server.db.messages, flush_interval=60))
+    message = server.Message(from_user_id="wb-a", to_user_id="wb-b", message="draft").model_dump()
+    asyncio.run(server.message_writer.insert(message))
+    assert asyncio.run(server.db.messages.find_one({"id": message["id"]})) is None
+
+    client.put(f"/api/messages/{message['id']}", json={"message": "final"})
+    client.post(f"/api/messages/{message['id']}/read")
+    # History lays the buffer over what is stored, so the newest message is on the page
+    page = client.get("/api/messages/wb-a/wb-b").json()
+    assert [(m["message"], m["read"]) for m in page] == [("final", True)]
+    assert server.message_writer.holds(message["id"])
+
+def test_reads_serve_buffered_messages_without_flushing(monkeypatch):
+    monkeypatch.setattr(server, "message_writer", server.WriteBehind(lambda: server.db.messages, flush_interval=60))
+    stored = client.post("/api/messages", json={"from_user_id": "rb-b", "from_username": "b", "to_user_id": "rb-a", "message": "stored"}).json()
+    buffered = []
+    for text in ("one", "two"):
+        doc = server.Message(from_user_id="rb-b", from_username="b", to_user_id="rb-a", message=text).model_dump()
+        asyncio.run(server.message_writer.insert(doc))
+        buffered.append(doc)
+    # An edit of a stored message that is still in the buffer
+    asyncio.run(server.message_writer.update(stored["id"], {"message": "stored, edited"}))
+
+    page = client.get("/api/messages/rb-a/rb-b", params={"limit": 2}).json()
+    assert [m["message"] for m in page] == ["one", "two"]
+    older = client.get("/api/messages/rb-a/rb-b", params={"before": page[0]["timestamp"], "before_id": page[0]["id"]}).json()
+    assert [m["message"] for m in older] == ["stored, edited"]
+
+    [entry] = client.get("/api/conversations/rb-a").json()
+    assert (entry["peer_id"], entry["last_message"]["id"], entry["unread"]) == ("rb-b", buffered[-1]["id"], 3)
+    assert client.get("/api/messages/unread-counts/rb-a").json() == {"total": 3, "by_sender": {"rb-b": 3}}
+    assert server.message_writer.pending == 3
@@ -0,0 +1,212 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add backend to path
+backend_path = Path(__file__).parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from server import InMemoryDB
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_message(i, from_user_id, to_user_id, read=False):
+    return {
+        "id": f"msg-{i}",
+        "from_user_id": from_user_id,
+        "to_user_id": to_user_id,
+        "message": f"message {i}",
+        "timestamp": f"2024-01-01T00:00:{i:02d}+00:00",
+        "read": read,
+    }
+
+
+def test_point_lookups_use_indexes():
+    db = InMemoryDB()
+    for i in range(10):
+        run(db.messages.insert_one(make_message(i, "a", "b")))
+
+    messages = db.messages
+    runs, _ = messages._plan({"id": "msg-3"})
+    assert runs is not None
+    runs, _ = messages._plan({"message": "message 3"})
+    assert runs is None
+    assert run(messages.find_one({"id": "msg-3"}))["message"] == "message 3"
+    assert run(messages.find_one({"message": "message 3"}))["id"] == "msg-3"
+
+
+def test_update_keeps_indexes_in_sync():
+    db = InMemoryDB()
+    run(db.messages.insert_one(make_message(1, "a", "b")))
+    run(db.messages.insert_one(make_message(2, "a", "b")))
+
+    run(db.messages.update_one({"id": "msg-1"}, {"$set": {"read": True}}))
+
+    unread = run(db.messages.find({"to_user_id": "b", "read": False}).to_list(100))
+    assert [m["id"] for m in unread] == ["msg-2"]
+    read = run(db.messages.find({"to_user_id": "b", "read": True}).to_list(100))
+    assert [m["id"] for m in read] == ["msg-1"]
+
+
+def test_or_query_unions_index_lookups():
+    db = InMemoryDB()
+    run(db.messages.insert_one(make_message(1, "a", "b")))
+    run(db.messages.insert_one(make_message(2, "b", "a")))
+    run(db.messages.insert_one(make_message(3, "a", "c")))
+
+    query = {
+        "$or": [
+            {"from_user_id": "a", "to_user_id": "b"},
+            {"from_user_id": "b", "to_user_id": "a"},
+        ]
+    }
+    runs, ordered = db.messages._plan(query, [("timestamp", -1)])
+    assert len(runs) == 2 and ordered
+    conversation = run(db.messages.find(query).sort("timestamp", -1).to_list(100))
+    assert [m["id"] for m in conversation] == ["msg-2", "msg-1"]
+
+
+def test_delete_removes_from_indexes():
+    db = InMemoryDB()
+    run(db.users.insert_one({"id": "u1", "username": "alice"}))
+
+    result = run(db.users.delete_one({"username": "alice"}))
+
+    assert result.deleted_count == 1
+    assert run(db.users.find_one({"id": "u1"})) is None
+    assert run(db.users.find({}).to_list(None)) == []
+
+
+def test_range_query_on_ordered_index():
+    db = InMemoryDB()
+    for i in range(10):
+        run(db.messages.insert_one(make_message(i, "a", "b")))
+
+    query = {"from_user_id": "a", "to_user_id": "b", "timestamp": {"$lt": "2024-01-01T00:00:05+00:00"}}
+    page = run(db.messages.find(query).sort("timestamp", -1).limit(2).to_list(None))
+    assert [m["id"] for m in page] == ["msg-4", "msg-3"]
+
+
+def test_unread_counters_follow_writes():
+    db = InMemoryDB()
+    messages = db.messages
+    run(messages.insert_many([make_message(i, "a", "b") for i in range(3)]))
+    run(messages.insert_one(make_message(3, "c", "b")))
+    run(messages.insert_one(make_message(4, "c", "b", read=True)))
+    assert run(messages.unread_counts("b")) == {"a": 3, "c": 1}
+
+    run(messages.update_one({"id": "msg-0"}, {"$set": {"read": True}}))
+    run(messages.update_many({"from_user_id": "c", "to_user_id": "b"}, {"$set": {"read": True}}))
+    # Already-read rows and unrelated fields don't move the counters
+    run(messages.update_one({"id": "msg-0"}, {"$set": {"read": True}}))
+    run(messages.update_one({"id": "msg-1"}, {"$set": {"message": "edited"}}))
+    assert run(messages.unread_counts("b")) == {"a": 2}
+
+    run(messages.delete_one({"id": "msg-1"}))
+    assert run(messages.unread_counts("b")) == {"a": 1}
+    assert run(messages.unread_counts("a")) == {}
+
+
+def test_conversation_summaries_follow_writes():
+    db = InMemoryDB()
+    messages = db.messages
+    run(messages.insert_one(make_message(1, "a", "b")))
+    run(messages.insert_one(make_message(2, "c", "a")))
+    run(messages.insert_one(make_message(3, "b", "a")))
+    # Arriving late (e.g. a replayed batch) doesn't displace a newer message
+    run(messages.insert_one(make_message(0, "a", "b")))
+
+    inbox = run(messages.inbox("a", 10))
+    assert [(c["peer_id"], c["last_message"]["id"], c["unread"]) for c in inbox] == [
+        ("b", "msg-3", 1), ("c", "msg-2", 1)
+    ]
+    assert [c["peer_id"] for c in run(messages.inbox("b", 10))] == ["a"]
+
+    run(messages.update_one({"id": "msg-3"}, {"$set": {"message": "edited"}}))
+    assert run(messages.inbox("a", 1))[0]["last_message"]["message"] == "edited"
+
+    run(messages.delete_one({"id": "msg-3"}))
+    assert run(messages.inbox("a", 10))[1]["last_message"]["id"] == "msg-1"
+
+
+def test_friend_edges_are_symmetric():
+    db = InMemoryDB()
+    friends = db.friends
+    run(friends.insert_one({"user_id": "a", "username": "A", "friend_id": "b", "friend_username": "B", "status": "pending"}))
+    assert run(friends.accepted("b")) == []
+
+    run(friends.update_one({"user_id": "a", "friend_id": "b"}, {"$set": {"status": "accepted"}}))
+    run(friends.insert_one({"user_id": "c", "username": "C", "friend_id": "a", "friend_username": "A", "status": "accepted"}))
+    assert run(friends.accepted("a")) == [
+        {"friend_id": "b", "friend_username": "B"}, {"friend_id": "c", "friend_username": "C"}
+    ]
+    assert run(friends.accepted("b")) == [{"friend_id": "a", "friend_username": "A"}]
+
+    # A duplicate row in the other direction keeps the pair linked when one goes away
+    run(friends.insert_one({"user_id": "b", "username": "B", "friend_id": "a", "friend_username": "A", "status": "accepted"}))
+    run(friends.delete_one({"user_id": "a", "friend_id": "b"}))
+    assert run(friends.accepted("a", after="a", limit=1)) == [{"friend_id": "b", "friend_username": "B"}]
+    run(friends.update_one({"user_id": "b", "friend_id": "a"}, {"$set": {"status": "blocked"}}))
+    assert run(friends.accepted("a")) == [{"friend_id": "c", "friend_username": "C"}]
+    assert run(friends.accepted("b")) == []
+
+
+def test_reaction_toggles_keep_counts():
+    reactions = InMemoryDB().reactions
+    for user in ("a", "b", "c"):
+        assert run(reactions.toggle("m1", "👍", user)) == (True, {"👍": "abc".index(user) + 1})
+    run(reactions.toggle("m1", "❤️", "a"))
+    assert run(reactions.toggle("m1", "👍", "b")) == (False, {"👍": 2, "❤️": 1})
+
+    summaries = run(reactions.summaries(["m1", "m2"], "a"))
+    assert summaries == {"m1": {"counts": {"👍": 2, "❤️": 1}, "mine": ["👍", "❤️"]}}
+    run(reactions.toggle("m1", "❤️", "a"))
+    assert run(reactions.summaries(["m1"], "b")) == {"m1": {"counts": {"👍": 2}, "mine": []}}
+
+
+def make_status(status_id, user_id, created_at, expires_at):
+    return {"id": status_id, "user_id": user_id, "username": user_id.upper(), "content": status_id,
+            "media_url": None, "media_type": None, "created_at": created_at, "expires_at": expires_at,
+            "view_count": 0}
+
+
+def test_status_buckets_expire_whole():
+    from datetime import datetime, timedelta, timezone
+    db = InMemoryDB()
+    statuses = db.statuses
+    run(db.friends.insert_one({"user_id": "a", "username": "A", "friend_id": "b", "friend_username": "B", "status": "accepted"}))
+    now = datetime.now(timezone.utc)
+    run(statuses.create(make_status("old", "b", (now - timedelta(days=1)).isoformat(), (now - timedelta(hours=2)).isoformat())))
+    run(statuses.create(make_status("live", "b", now.isoformat(), (now + timedelta(hours=24)).isoformat())))
+    run(statuses.create(make_status("stranger", "c", now.isoformat(), (now + timedelta(hours=24)).isoformat())))
+
+    assert [s["id"] for s in run(statuses.feed("a", 10, 100))] == ["live"]
+    # The passed hour's bucket went with the read, views and all
+    assert "old" not in statuses.docs and len(statuses.buckets) == 1
+    assert run(statuses.view("old", "a")) is None
+
+    assert run(statuses.view("live", "a")) is True
+    assert run(statuses.view("live", "a")) is False
+    assert run(statuses.view("live", "b")) is False  # the author
+    mine = run(statuses.feed("b", 10, 100))[0]
+    assert (mine["view_count"], mine["viewers"]) == (1, ["a"])
+    theirs = run(statuses.feed("a", 10, 100))[0]
+    assert theirs["viewed"] and theirs["viewers"] is None
+
+
+def test_status_keeps_only_recent_viewers():
+    from datetime import datetime, timedelta, timezone
+    from server import InMemoryStatusesCollection
+    db = InMemoryDB()
+    statuses = InMemoryStatusesCollection(db.friends, recent_viewers=2)
+    now = datetime.now(timezone.utc)
+    run(statuses.create(make_status("s1", "a", now.isoformat(), (now + timedelta(hours=24)).isoformat())))
+    for viewer in ("v1", "v2", "v3", "v1"):
+        run(statuses.view("s1", viewer))
+
+    mine = run(statuses.feed("a", 10, 100))[0]
+    assert mine["view_count"] == 3 and mine["viewers"] == ["v3", "v2"]
+    assert len(statuses.recent["s1"]) == 2
@@ -0,0 +1,207 @@
+import os
+import sys
+import asyncio
+import json
+from pathlib import Path
+
+# Add backend to path
+backend_path = Path(__file__).parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from server import InMemoryDB
+from message_wal import MessageWAL
+from write_behind import WriteBehind
+
+
+def make_message(i):
+    return {
+        "id": f"msg-{i}",
+        "from_user_id": "a",
+        "to_user_id": "b",
+        "message": f"message {i}",
+        "timestamp": f"2024-01-01T00:00:{i:02d}+00:00",
+        "read": False,
+    }
+
+
+class DownCollection:
+    """A database that is unreachable"""
+
+    async def insert_many(self, docs):
+        raise ConnectionError("database down")
+
+    async def insert_one(self, doc):
+        raise ConnectionError("database down")
+
+
+def test_concurrent_appends_share_an_fsync(tmp_path):
+    async def scenario():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        lsns = await asyncio.gather(*(wal.append({"op": "insert", "doc": make_message(i)}) for i in range(50)))
+        syncs = wal.counters["syncs"]
+        wal.ack(lsn for lsn in lsns if lsn != 10)
+        await wal.close()
+        return wal, lsns, syncs
+
+    wal, lsns, syncs = asyncio.run(scenario())
+
+    assert sorted(lsns) == list(range(1, 51))
+    assert syncs == 1
+    # Only lsn 10 and everything after it is still owed to the database
+    assert wal.acked == 9
+    pending = MessageWAL(tmp_path).open()
+    assert [record["lsn"] for record in pending] == list(range(10, 51))
+
+
+def test_unpersisted_writes_are_replayed_once(tmp_path):
+    async def crash_with_database_down():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        # The process dies while the writes wait for their retry
+        writer = WriteBehind(lambda: DownCollection(), flush_interval=0, retry_delay=60)
+        writer.wal = wal
+        await writer.insert(make_message(1))
+        await writer.update("msg-1", {"read": True})
+        await wal.close()
+        return writer
+
+    async def restart(db):
+        wal = MessageWAL(tmp_path)
+        pending = wal.open()
+        writer = WriteBehind(lambda: db.messages, flush_interval=0)
+        failed = await writer.replay(pending)
+        wal.ack(record["lsn"] for record in pending)
+        await wal.close()
+        return pending, failed
+
+    writer = asyncio.run(crash_with_database_down())
+    assert writer.counters["failed"] == 1 and writer.holds("msg-1")
+
+    db = InMemoryDB()
+    pending, failed = asyncio.run(restart(db))
+    assert [record["op"] for record in pending] == ["insert", "update"] and not failed
+    assert asyncio.run(db.messages.find_one({"id": "msg-1"}))["read"] is True
+
+    # Acknowledged on replay: a second restart has nothing left to do
+    pending, _ = asyncio.run(restart(db))
+    assert pending == []
+    assert len(asyncio.run(db.messages.find({"id": "msg-1"}).to_list(10))) == 1
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    async def scenario():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        await wal.append({"op": "insert", "doc": make_message(1)})
+        await wal.close()
+
+    asyncio.run(scenario())
+    segment = next(tmp_path.glob("wal-*.log"))
+    with open(segment, "ab") as f:
+        f.write(b'{"lsn": 2, "op": "ins')
+
+    pending = MessageWAL(tmp_path).open()
+    assert [record["lsn"] for record in pending] == [1]
+
+
+def test_lsns_are_not_reused_after_segments_are_deleted(tmp_path):
+    async def restart(append=None):
+        wal = MessageWAL(tmp_path)
+        pending = wal.open()
+        wal.ack(record["lsn"] for record in pending)
+        if append is not None:
+            await wal.append({"op": "insert", "doc": append})
+        await wal.close()
+        return pending
+
+    async def first_run():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        for i in range(3):
+            await wal.append({"op": "insert", "doc": make_message(i)})
+        await wal.close()
+
+    asyncio.run(first_run())
+    # Replayed and acked: the record segment goes, leaving a segment with just the ack
+    assert len(asyncio.run(restart())) == 3
+    assert asyncio.run(restart(append=make_message(9))) == []
+    pending = asyncio.run(restart())
+    assert [record["doc"]["id"] for record in pending] == ["msg-9"]
+    assert pending[0]["lsn"] == 4
+
+
+def test_rejected_writes_are_dead_lettered(tmp_path):
+    async def scenario():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        writer = WriteBehind(lambda: DownCollection(), flush_interval=0, max_retries=1, retry_delay=0.01)
+        writer.wal = wal
+        await writer.insert(make_message(1))
+        await asyncio.sleep(0.05)
+        await writer.insert(make_message(2))
+        stats = wal.stats()
+        await wal.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    # msg-1 no longer holds back the low-water mark; msg-2 is still owed
+    assert stats["dead_lettered"] == 1 and stats["acked"] == 1 and stats["outstanding"] == 1
+    dead = [json.loads(line) for line in (tmp_path / "dead-letter.log").read_text().splitlines()]
+    assert [(d["id"], d["lsns"]) for d in dead] == [("msg-1", [1])]
+    assert [record["lsn"] for record in MessageWAL(tmp_path).open()] == [2]
+
+
+def fail_next_fsync(monkeypatch):
+    real_fsync = os.fsync
+    failures = [OSError(5, "Input/output error")]
+
+    def flaky_fsync(fd):
+        if failures:
+            raise failures.pop()
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", flaky_fsync)
+
+
+def test_failed_fsync_aborts_its_appends_without_pinning_the_log(tmp_path, monkeypatch):
+    async def scenario():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        first = await wal.append({"op": "insert", "doc": make_message(1)})
+        fail_next_fsync(monkeypatch)
+        try:
+            await wal.append({"op": "insert", "doc": make_message(2)})
+        except OSError:
+            pass
+        else:
+            raise AssertionError("append should fail with its fsync")
+        third = await wal.append({"op": "insert", "doc": make_message(3)})
+        wal.ack([first, third])
+        stats = wal.stats()
+        await wal.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    # The failed lsn doesn't hold the checkpoint back, and a restart doesn't resurrect it
+    assert stats["outstanding"] == 0 and stats["acked"] == 3
+    assert stats["sync_failures"] == 1 and stats["aborted"] == 1
+    assert MessageWAL(tmp_path).open() == []
+
+
+def test_aborted_appends_are_not_replayed_before_an_ack_covers_them(tmp_path, monkeypatch):
+    async def scenario():
+        wal = MessageWAL(tmp_path)
+        wal.open()
+        await wal.append({"op": "insert", "doc": make_message(1)})
+        fail_next_fsync(monkeypatch)
+        try:
+            await wal.append({"op": "insert", "doc": make_message(2)})
+        except OSError:
+            pass
+        await wal.append({"op": "insert", "doc": make_message(3)})
+        await wal.close()
+
+    asyncio.run(scenario())
+    # Nothing acked: msg-1 and msg-3 are owed to the database, msg-2 was never accepted
+    assert [record["doc"]["id"] for record in MessageWAL(tmp_path).open()] == ["msg-1", "msg-3"]
@@ -0,0 +1,340 @@
+import os
+import sys
+import asyncio
+import contextlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+backend_path = Path(__file__).parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+import postgres_db
+from postgres_db import (
+    build_where, build_select, build_update, row_to_doc, to_db_value, StatementCache,
+    InstrumentedPool, QueryMonitor, DatabaseBusy, status_partition_ddl,
+    PostgresDB, PostgresReactionsCollection, PostgresMessagesCollection,
+)
+
+
+def test_build_where_translates_conversation_query():
+    params = []
+    sql = build_where({
+        "$or": [
+            {"from_user_id": "a", "to_user_id": "b"},
+            {"from_user_id": "b", "to_user_id": "a"},
+        ],
+        "timestamp": {"$lt": "2024-01-01T00:00:00+00:00"},
+    }, params)
+
+    assert sql == (
+        "((from_user_id = $1 AND to_user_id = $2) OR (from_user_id = $3 AND to_user_id = $4))"
+        " AND timestamp < $5"
+    )
+    assert params[:4] == ["a", "b", "b", "a"]
+    assert params[4] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_build_where_inlines_booleans_for_partial_indexes():
+    params = []
+    assert build_where({"to_user_id": "u", "read": False}, params) == "to_user_id = $1 AND read = FALSE"
+    assert params == ["u"]
+
+
+def test_row_to_doc_returns_iso_timestamps():
+    stamp = datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc)
+    doc = row_to_doc({"id": "m1", "timestamp": stamp, "edited_at": None})
+    assert doc == {"id": "m1", "timestamp": "2024-01-01T12:30:00+00:00", "edited_at": None}
+
+
+def test_build_where_passes_in_lists_as_one_array():
+    params = []
+    assert build_where({"id": {"$in": ["m1", "m2"]}, "to_user_id": "u"}, params) == "id = ANY($1) AND to_user_id = $2"
+    assert params == [["m1", "m2"], "u"]
+
+
+def test_build_select_is_canonical_and_parameterizes_limit():
+    first = build_select("messages", {"to_user_id": "u", "from_user_id": "f"}, [("timestamp", -1)], 50)
+    second = build_select("messages", {"from_user_id": "g", "to_user_id": "v"}, [("timestamp", -1)], 20)
+    assert first[0] == second[0] == (
+        "SELECT * FROM messages WHERE from_user_id = $1 AND to_user_id = $2 ORDER BY timestamp DESC LIMIT $3"
+    )
+    assert first[1] == ["f", "u", 50]
+
+
+def test_build_select_limits_each_or_branch_before_merging():
+    sql, params = build_select("messages", {
+        "$or": [{"from_user_id": "a", "to_user_id": "b"}, {"from_user_id": "b", "to_user_id": "a"}],
+        "timestamp": {"$lt": "2024-01-01T00:00:00+00:00"},
+    }, [("timestamp", -1), ("id", -1)], 100)
+    page = "ORDER BY timestamp DESC, id DESC LIMIT $7"
+    assert sql == (
+        f"SELECT * FROM ((SELECT * FROM messages WHERE from_user_id = $1 AND timestamp < $2 AND to_user_id = $3 {page})"
+        f" UNION ALL (SELECT * FROM messages WHERE from_user_id = $4 AND timestamp < $5 AND to_user_id = $6 {page}))"
+        f" AS branches {page}"
+    )
+    assert params[0::3] == ["a", "b", 100]
+
+
+def test_builder_rejects_unknown_columns():
+    with pytest.raises(ValueError):
+        build_select("messages", {"id; DROP TABLE messages": "x"})
+    with pytest.raises(ValueError):
+        build_update("friends", {"user_id": "a"}, {"status = 'accepted', username": "x"})
+
+
+class FakeStatement:
+    def __init__(self, sql):
+        self.sql = sql
+
+
+class FakeConnection:
+    def __init__(self):
+        self.prepared_statements = OrderedDict()
+        self.prepares = 0
+
+    async def prepare(self, sql):
+        self.prepares += 1
+        return FakeStatement(sql)
+
+
+def test_statement_cache_reuses_prepared_statements_per_connection():
+    cache = StatementCache(max_size=2)
+    conn = FakeConnection()
+
+    async def scenario():
+        first = await cache.prepare(conn, "SELECT 1")
+        assert await cache.prepare(conn, "SELECT 1") is first
+        await cache.prepare(conn, "SELECT 2")
+        await cache.prepare(conn, "SELECT 3")  # evicts SELECT 1
+        await cache.prepare(conn, "SELECT 1")
+        await cache.prepare(FakeConnection(), "SELECT 1")
+
+    asyncio.run(scenario())
+    assert conn.prepares == 4
+    assert cache.stats() == {"max_size": 2, "hits": 1, "misses": 5, "evictions": 2, "invalidated": 0}
+
+
+class FakePool:
+    """asyncpg-like pool with ``size`` connections"""
+
+    def __init__(self, size):
+        self.free = asyncio.Queue()
+        for i in range(size):
+            self.free.put_nowait(f"conn-{i}")
+
+    async def acquire(self, timeout=None):
+        return await asyncio.wait_for(self.free.get(), timeout)
+
+    async def release(self, conn):
+        self.free.put_nowait(conn)
+
+
+def test_instrumented_pool_sheds_waiters_after_acquire_timeout():
+    pool = InstrumentedPool(acquire_timeout=0.05, monitor=QueryMonitor())
+    pool.pool = FakePool(1)
+
+    async def scenario():
+        async with pool.acquire() as conn:
+            assert conn == "conn-0"
+            assert pool.in_use == 1
+            with pytest.raises(DatabaseBusy):
+                async with pool.acquire():
+                    pass
+        assert pool.in_use == 0 and pool.waiting == 0
+        async with pool.acquire() as conn:
+            assert conn == "conn-0"
+
+    asyncio.run(scenario())
+    assert pool.counters == {"acquired": 2, "timeouts": 1}
+    assert pool.acquire_wait.snapshot()["count"] == 3
+
+
+def test_query_monitor_counts_slow_queries():
+    monitor = QueryMonitor(slow_query_ms=100)
+    monitor.observe("SELECT 1", 0.001)
+    monitor.observe("SELECT pg_sleep(1)", 1.0)
+    monitor.observe("SELECT broken", 0.002, ValueError("boom"))
+    stats = monitor.stats()
+    assert stats["slow"] == 1 and stats["errors"] == 1
+    assert stats["query_time"]["count"] == 3
+
+
+def test_preview_round_trips_through_jsonb_text():
+    preview = {"thumbnail_url": "/uploads/thumbs/ab/x.jpg", "width": 640}
+    stored = to_db_value("preview", preview)
+    assert isinstance(stored, str)
+    assert row_to_doc({"id": "m1", "preview": stored})["preview"] == preview
+    assert to_db_value("preview", None) is None
+
+
+def test_status_partitions_are_bounded_by_utc_days():
+    from datetime import date
+    assert status_partition_ddl("statuses", date(2024, 2, 29)) == (
+        "CREATE TABLE IF NOT EXISTS statuses_p20240229 PARTITION OF statuses "
+        "FOR VALUES FROM ('2024-02-29 00:00:00+00') TO ('2024-03-01 00:00:00+00')"
+    )
+
+
+class ReactionStore:
+    """Reaction rows shared by FakeReactionConnections, with advisory locks held per transaction"""
+
+    def __init__(self):
+        self.rows = set()
+        self.locks = {}
+
+
+class FakeReactionConnection:
+    """Runs the toggle with a read/write gap, as two real sessions racing would"""
+
+    def __init__(self, store):
+        self.store = store
+        self.held = []
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        try:
+            yield
+        finally:
+            for lock in self.held:
+                lock.release()
+            self.held = []
+
+    async def execute(self, sql, *args):
+        assert "pg_advisory_xact_lock" in sql
+        lock = self.store.locks.setdefault(args, asyncio.Lock())
+        await lock.acquire()
+        self.held.append(lock)
+
+    async def fetchval(self, sql, message_id, emoji, user_id, slot):
+        key = (message_id, emoji, user_id)
+        present = key in self.store.rows
+        await asyncio.sleep(0.01)
+        if present:
+            self.store.rows.discard(key)
+            return -1
+        self.store.rows.add(key)
+        return 1
+
+    async def fetch(self, sql, message_id):
+        emojis = [emoji for m, emoji, _ in self.store.rows if m == message_id]
+        return [{"emoji": emoji, "count": emojis.count(emoji)} for emoji in set(emojis)]
+
+
+class FakeReactionPool:
+    def __init__(self):
+        self.store = ReactionStore()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield FakeReactionConnection(self.store)
+
+
+def test_concurrent_toggles_by_one_user_are_serialized():
+    reactions = PostgresReactionsCollection(FakeReactionPool())
+
+    async def scenario():
+        # A double-click: the second toggle must see the first one's add
+        return await asyncio.gather(*(reactions.toggle("m1", "👍", "u1") for _ in range(2)))
+
+    first, second = asyncio.run(scenario())
+    assert (first[0], second[0]) == (True, False)
+    assert second[1] == {}
+
+
+@pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="needs DATABASE_URL")
+def test_concurrent_toggles_against_postgres():
+    async def scenario():
+        db = PostgresDB(os.environ["DATABASE_URL"], max_size=4)
+        await db.connect()
+        message_id = f"toggle-race-{os.getpid()}"
+        try:
+            results = await asyncio.gather(*(db.reactions.toggle(message_id, "👍", "u1") for _ in range(4)))
+            return [added for added, _ in results], results[-1][1]
+        finally:
+            async with db.pool.acquire() as conn:
+                await conn.execute("DELETE FROM message_reactions WHERE message_id = $1", message_id)
+                await conn.execute("DELETE FROM message_reaction_counts WHERE message_id = $1", message_id)
+            await db.close()
+
+    added, counts = asyncio.run(scenario())
+    # Four toggles alternate add/remove and end with no reaction
+    assert sorted(added) == [False, False, True, True]
+    assert counts.get("👍", 0) == 0
+
+
+class FakeMigrationConnection:
+    def __init__(self):
+        self.executed = []
+        self.closed = False
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def execute(self, sql, *args):
+        self.executed.append(sql)
+
+    async def fetchval(self, sql, *args):
+        return None
+
+    async def close(self):
+        self.closed = True
+
+
+def test_migrations_run_without_the_pool_command_timeout(monkeypatch):
+    opened = {}
+    conn = FakeMigrationConnection()
+
+    async def connect(dsn, **kwargs):
+        opened.update(kwargs, dsn=dsn)
+        return conn
+
+    monkeypatch.setattr(postgres_db.asyncpg, "connect", connect)
+    db = PostgresDB("postgresql://example/chat", command_timeout=10)
+    asyncio.run(db._migrate())
+
+    assert opened["dsn"] == "postgresql://example/chat"
+    assert opened["command_timeout"] is None
+    assert opened["server_settings"] == {"statement_timeout": "0"}
+    assert any("CREATE INDEX" in sql for sql in conn.executed)
+    assert conn.closed
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.calls = []
+
+    async def execute(self, sql, *args):
+        self.calls.append(("execute", sql, args))
+
+    async def executemany(self, sql, records):
+        self.calls.append(("executemany", sql, records))
+
+
+class RecordingPool:
+    def __init__(self):
+        self.conn = RecordingConnection()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def test_insert_many_is_one_statement_over_column_arrays():
+    pool = RecordingPool()
+    docs = [
+        {"id": f"m{i}", "from_user_id": "a", "from_username": "a", "to_user_id": "b",
+         "message": f"hi {i}", "timestamp": "2024-01-01T00:00:00+00:00"}
+        for i in range(3)
+    ]
+    asyncio.run(PostgresMessagesCollection(pool, StatementCache()).insert_many(docs))
+
+    # One INSERT, so statement-level triggers see the whole batch at once
+    [(kind, sql, args)] = pool.conn.calls
+    assert kind == "execute" and "unnest(" in sql
+    assert len(args) == 13 and args[0] == ["m0", "m1", "m2"]
+    assert args[6] == [False, False, False]
@@ -0,0 +1,87 @@
+import sys
+import gzip
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add backend to path
+backend_path = Path(__file__).parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from static_files import CachedStaticFiles, IMMUTABLE, REVALIDATE, parse_range
+
+
+def make_client(directory, **kwargs):
+    app = FastAPI()
+    app.mount("/files", CachedStaticFiles(directory=str(directory), **kwargs))
+    return TestClient(app)
+
+
+def test_parse_range_forms():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=990-5000", 1000) == (990, 999)
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+
+
+def test_etag_revalidation_and_cache_policy(tmp_path):
+    (tmp_path / "clip.mp4").write_bytes(b"x" * 100)
+    client = make_client(tmp_path, cache_control=lambda path: IMMUTABLE)
+
+    first = client.get("/files/clip.mp4")
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == IMMUTABLE
+    assert first.headers["accept-ranges"] == "bytes"
+    again = client.get("/files/clip.mp4", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+
+
+def test_range_requests_return_only_the_requested_bytes(tmp_path):
+    data = bytes(range(256)) * 1000
+    (tmp_path / "clip.mp4").write_bytes(data)
+    client = make_client(tmp_path, cache_control=lambda path: IMMUTABLE)
+    etag = client.head("/files/clip.mp4").headers["etag"]
+
+    part = client.get("/files/clip.mp4", headers={"Range": "bytes=100000-170000"})
+    assert part.status_code == 206
+    assert part.content == data[100000:170001]
+    assert part.headers["content-range"] == f"bytes 100000-170000/{len(data)}"
+    assert part.headers["content-length"] == "70001"
+    assert client.get("/files/clip.mp4", headers={"Range": "bytes=-10"}).content == data[-10:]
+
+    unsatisfiable = client.get("/files/clip.mp4", headers={"Range": f"bytes={len(data)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(data)}"
+
+    # A stale If-Range means the client's copy changed: send the whole file
+    stale = client.get("/files/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert stale.status_code == 200 and len(stale.content) == len(data)
+    fresh = client.get("/files/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert fresh.status_code == 206 and fresh.content == data[:10]
+
+
+def test_precompressed_variants_are_served_when_accepted(tmp_path):
+    source = b"console.log('hello');" * 200
+    (tmp_path / "main.abc123.js").write_bytes(source)
+    (tmp_path / "main.abc123.js.gz").write_bytes(gzip.compress(source))
+    client = make_client(tmp_path, cache_control=lambda path: REVALIDATE, precompressed=True)
+
+    compressed = client.get("/files/main.abc123.js", headers={"Accept-Encoding": "gzip, br"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.headers["content-type"].startswith(("application/javascript", "text/javascript"))
+    assert compressed.headers["cache-control"] == REVALIDATE
+    assert compressed.content == source  # decoded by the client
+    assert int(compressed.headers["content-length"]) < len(source)
+
+    plain = client.get("/files/main.abc123.js", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] != compressed.headers["etag"]
+    assert client.get("/files/main.abc123.js", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": compressed.headers["etag"],
+    }).status_code == 304
@@ -0,0 +1,124 @@
+import sys
+import asyncio
+import json
+from pathlib import Path
+
+# Add backend to path
+backend_path = Path(__file__).parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from thumbnails import ThumbnailPool
+
+SHA = "ab" * 32
+
+
+class FakeRenderer:
+    """Writes a marker thumbnail; fails the first ``failures`` calls"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self, source, thumbnail, poster):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.calls <= self.failures:
+            raise RuntimeError("decoder hiccup")
+        thumbnail.write_bytes(b"thumb")
+        if poster is not None:
+            poster.write_bytes(b"poster")
+        return {"width": 640, "height": 480, "placeholder": "data:image/jpeg;base64,AA=="}
+
+
+def make_pool(tmp_path, renderer, **kwargs):
+    return ThumbnailPool(tmp_path / "thumbs", "/uploads/thumbs/", renderers={"image": renderer, "video": renderer},
+                         retry_delay=0, **kwargs)
+
+
+def test_previews_are_generated_once_per_blob(tmp_path):
+    renderer = FakeRenderer()
+    pool = make_pool(tmp_path, renderer)
+
+    async def scenario():
+        pool.start()
+        assert pool.submit(SHA, tmp_path / "src.png", "image")
+        assert pool.submit(SHA, tmp_path / "src.png", "image")  # already queued
+        await pool.join()
+        assert pool.submit(SHA, tmp_path / "src.png", "image")  # already done
+        await pool.join()
+        assert not pool.submit("cd" * 32, tmp_path / "doc.pdf", "file")
+        await pool.close()
+
+    asyncio.run(scenario())
+    assert renderer.calls == 1
+    preview = pool.preview_for(f"/uploads/blobs/ab/{SHA}.png", "image")
+    assert preview["thumbnail_url"] == f"/uploads/thumbs/ab/{SHA}.jpg"
+    assert preview["width"] == 640 and preview["placeholder"].startswith("data:image/jpeg")
+    assert json.loads((tmp_path / "thumbs" / "ab" / f"{SHA}.json").read_text())["height"] == 480
+    assert pool.preview_for("/uploads/old-upload.png", "image") is None
+
+
+def test_finished_previews_survive_a_restart(tmp_path):
+    first = FakeRenderer()
+
+    async def run(pool):
+        pool.start()
+        pool.submit(SHA, tmp_path / "src.mp4", "video")
+        await pool.join()
+        await pool.close()
+
+    asyncio.run(run(make_pool(tmp_path, first)))
+    second = FakeRenderer()
+    restarted = make_pool(tmp_path, second)
+    asyncio.run(run(restarted))
+    assert (first.calls, second.calls) == (1, 0)
+    assert restarted.stats()["cached"] == 1
+    assert restarted.preview_for(f"/uploads/blobs/ab/{SHA}.mp4", "video")["poster_url"].endswith(".poster.jpg")
+
+
+def test_failed_renders_are_retried_then_given_up(tmp_path):
+    flaky = make_pool(tmp_path / "flaky", FakeRenderer(failures=2), max_attempts=3)
+    broken = make_pool(tmp_path / "broken", FakeRenderer(failures=5), max_attempts=3)
+
+    async def scenario(pool):
+        pool.start()
+        pool.submit(SHA, tmp_path / "src.png", "image")
+        await pool.join()
+        await pool.close()
+
+    asyncio.run(scenario(flaky))
+    asyncio.run(scenario(broken))
+    assert flaky.stats()["generated"] == 1 and flaky.stats()["retried"] == 2
+    assert broken.stats()["failed"] == 1
+    # No thumbnail was written, so none is advertised
+    assert broken.preview_for(f"/uploads/blobs/ab/{SHA}.png", "image") is None
+
+
+def test_full_queue_drops_jobs(tmp_path):
+    pool = make_pool(tmp_path, FakeRenderer(), workers=1, max_queue=2)
+
+    async def scenario():
+        pool.start()
+        accepted = [pool.submit(f"{i:02d}" * 32, tmp_path / "src.png", "image") for i in range(4)]
+        await pool.join()
+        await pool.close()
+        return accepted
+
+    assert asyncio.run(scenario()) == [True, True, False, False]
+    assert pool.stats()["dropped"] == 2
+    assert pool.preview_for(f"/uploads/blobs/02/{'02' * 32}.png", "image") is None
+
+
+def test_missing_renderers_are_reported_and_not_advertised(tmp_path, caplog):
+    pool = ThumbnailPool(tmp_path / "thumbs", "/uploads/thumbs", renderers={})
+
+    async def scenario():
+        pool.start()
+        accepted = pool.submit(SHA, tmp_path / "src.png", "image")
+        await pool.close()
+        return accepted
+
+    with caplog.at_level("WARNING", logger="thumbnails"):
+        assert asyncio.run(scenario()) is False
+    assert "No preview renderer for image, video uploads" in caplog.text
+    assert pool.preview_for(f"/uploads/blobs/ab/{SHA}.png", "image") is None
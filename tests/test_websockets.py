@@ -1,4 +1,6 @@
 import sys
+import asyncio
+import json
 from pathlib import Path
 import pytest
 from fastapi.testclient import TestClient
@@ -15,8 +17,17 @@ client = TestClient(app)
 @pytest.fixture(autouse=True)
 def reset_db():
     server.db = InMemoryDB()
-    server.manager.active_connections = {}
-    server.manager.users = {}
+    # TestClient runs each socket on its own short-lived loop, so flush presence immediately
+    server.manager = server.ConnectionManager(presence_window=0)
+    server.message_writer = server.WriteBehind(lambda: server.db.messages, flush_interval=0)
+    server.read_receipts = server.ReadReceiptCoalescer(server.apply_read_receipts, window=0)
+
+def befriend(user_id, friend_id, status="accepted"):
+    asyncio.run(server.db.friends.insert_one({
+        "user_id": user_id, "username": user_id,
+        "friend_id": friend_id, "friend_username": friend_id,
+        "status": status,
+    }))
 
 def test_websocket_chat_flow():
     # We need two users
@@ -24,6 +35,7 @@ def test_websocket_chat_flow():
     u1_name = "user1"
     u2_id = "user2-id"
     u2_name = "user2"
+    befriend(u1_id, u2_id)
 
     with client.websocket_connect(f"/api/ws/{u1_id}/{u1_name}") as ws1:
         # Check if u1 gets user update (self)
@@ -37,10 +49,11 @@ def test_websocket_chat_flow():
             assert data2["type"] == "users-update"
             assert len(data2["users"]) == 2
 
-            # u1 should also receive user update about u2
+            # u1 only receives the presence delta about u2
             data1 = ws1.receive_json()
-            assert data1["type"] == "users-update"
-            assert len(data1["users"]) == 2
+            assert data1["type"] == "user-joined"
+            assert data1["user"]["id"] == u2_id
+            assert data1["version"] == data["version"] + 1
 
             # 1. User 1 sends message to User 2
             msg_payload = {
@@ -141,7 +154,8 @@ def test_websocket_chat_flow():
             ws1.send_json(react_payload)
             react_received = ws2.receive_json()
             assert react_received["type"] == "message-reaction"
-            assert u1_id in react_received["reactions"]["❤️"]
+            assert react_received["reactions"] == {"❤️": 1}
+            assert react_received["added"] is True and react_received["user_id"] == u1_id
             ws1.receive_json()
 
             # 8. WebRTC Handshake (Accept, Offer, Answer, ICE)
@@ -189,3 +203,385 @@ def test_websocket_chat_flow():
             assert ice_received["type"] == "ice-candidate"
 
 
+
+
+def test_presence_deltas_and_snapshot_on_demand():
+    befriend("p1-id", "p2-id")
+    with client.websocket_connect("/api/ws/p1-id/p1") as ws1:
+        snapshot = ws1.receive_json()
+        assert snapshot["type"] == "users-update"
+
+        with client.websocket_connect("/api/ws/p2-id/p2") as ws2:
+            ws2.receive_json()
+            joined = ws1.receive_json()
+            assert joined["type"] == "user-joined"
+            assert joined["version"] == snapshot["version"] + 1
+
+        left = ws1.receive_json()
+        assert left == {"type": "user-left", "version": joined["version"] + 1, "user_id": "p2-id"}
+
+        # A client that detects a version gap asks for a fresh snapshot
+        ws1.send_json({"type": "presence-sync"})
+        resync = ws1.receive_json()
+        assert resync["type"] == "users-update"
+        assert [u["id"] for u in resync["users"]] == ["p1-id"]
+        assert resync["version"] == left["version"]
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+def connect_fake(manager, user_id, ws):
+    manager.active_connections[user_id] = ws
+    manager.open_outbox(user_id, ws)
+
+
+def test_broadcast_evicts_stuck_client():
+    async def scenario():
+        manager = server.ConnectionManager(send_timeout=0.05)
+        fast = [FakeSocket() for _ in range(3)]
+        stuck = FakeSocket(delay=10)
+        for i, ws in enumerate(fast):
+            connect_fake(manager, f"fast-{i}", ws)
+        connect_fake(manager, "stuck", stuck)
+
+        await manager.broadcast({"type": "ping"})
+        await asyncio.sleep(0.2)
+        return manager, fast, stuck
+
+    manager, fast, stuck = asyncio.run(scenario())
+
+    assert all(ws.sent == ['{"type": "ping"}'] for ws in fast)
+    assert "stuck" not in manager.active_connections
+    assert stuck.closed
+    assert manager.evicted == 1
+
+
+def test_outbox_overflow_policies():
+    async def scenario():
+        manager = server.ConnectionManager(soft_limit=3, high_water=5)
+        slow = FakeSocket(delay=10)
+        connect_fake(manager, "slow", slow)
+        await manager.send_personal_message({"type": "first"}, "slow")
+        await asyncio.sleep(0)  # writer picks up the first frame and blocks on it
+
+        await manager.send_personal_message({"type": "typing"}, "slow")
+        await manager.send_personal_message({"type": "users-update", "users": [1]}, "slow")
+        await manager.send_personal_message({"type": "users-update", "users": [1, 2]}, "slow")
+        outbox = manager.outboxes["slow"]
+        assert outbox.depth == 2 and outbox.coalesced == 1
+        assert outbox.queue[-1][1] == '{"type": "users-update", "users": [1, 2]}'
+
+        await manager.send_personal_message({"type": "receive-message"}, "slow")
+        # Soft limit reached: typing is refused, then shed to make room
+        await manager.send_personal_message({"type": "typing"}, "slow")
+        await manager.send_personal_message({"type": "receive-message"}, "slow")
+        assert outbox.dropped == 2
+        assert [entry[0] for entry in outbox.queue] == ["users-update", "receive-message", "receive-message"]
+
+        # High-water mark reached: the client is disconnected
+        for _ in range(3):
+            await manager.send_personal_message({"type": "receive-message"}, "slow")
+        await asyncio.sleep(0)
+        return manager, slow
+
+    manager, slow = asyncio.run(scenario())
+    assert "slow" not in manager.active_connections
+    assert slow.closed
+
+
+def test_presence_storm_is_coalesced():
+    async def scenario():
+        server.db = server.InMemoryDB()
+        for i in range(20):
+            await server.db.friends.insert_one({"user_id": "watcher", "friend_id": f"storm-{i}", "status": "accepted"})
+        manager = server.ConnectionManager(presence_window=0.05)
+        watcher = FakeSocket()
+        await manager.connect(watcher, "watcher", "watcher")
+        await asyncio.sleep(0.1)
+        watcher.sent.clear()
+
+        sockets = [FakeSocket() for _ in range(20)]
+        for i, ws in enumerate(sockets):
+            await manager.connect(ws, f"storm-{i}", f"storm {i}")
+        # One user flaps within the window: join + leave cancel out
+        await manager.drop("storm-0", sockets[0])
+        await asyncio.sleep(0.1)
+        return manager, watcher
+
+    manager, watcher = asyncio.run(scenario())
+
+    assert len(watcher.sent) == 1
+    batch = json.loads(watcher.sent[0])
+    assert batch["type"] == "presence-batch"
+    assert batch["version"] == 1
+    assert [e["user"]["id"] for e in batch["events"]] == [f"storm-{i}" for i in range(1, 20)]
+    assert manager.presence_stats["events"] == 22
+    assert manager.presence_stats["emitted"] == 20
+
+
+def test_presence_is_scoped_to_friends():
+    befriend("f1-id", "f2-id")
+    befriend("f1-id", "s-id", status="pending")
+
+    with client.websocket_connect("/api/ws/f1-id/f1") as ws1:
+        ws1.receive_json()
+        with client.websocket_connect("/api/ws/s-id/stranger") as ws_s:
+            # Strangers see only themselves and are not announced
+            snapshot = ws_s.receive_json()
+            assert [u["id"] for u in snapshot["users"]] == ["s-id"]
+            with client.websocket_connect("/api/ws/f2-id/f2") as ws2:
+                assert [u["id"] for u in ws2.receive_json()["users"]] == ["f2-id", "f1-id"]
+                assert ws1.receive_json()["user"]["id"] == "f2-id"
+
+                # Accepting a request introduces two online users to each other
+                response = client.post("/api/friends/accept/f1-id/s-id")
+                assert response.status_code == 200
+                assert ws_s.receive_json()["user"]["id"] == "f1-id"
+                assert ws1.receive_json()["user"]["id"] == "s-id"
+
+            # The stranger is not told that f2 left; f1 is
+            assert ws1.receive_json() == {"type": "user-left", "version": 3, "user_id": "f2-id"}
+            ws_s.send_json({"type": "presence-sync"})
+            assert [u["id"] for u in ws_s.receive_json()["users"]] == ["s-id", "f1-id"]
+
+    assert server.manager.presence_stats["deliveries"] == 5
+
+
+def test_backplane_routes_between_nodes():
+    from backplane import FakeRedis, RedisBackplane
+
+    async def scenario():
+        server.db = server.InMemoryDB()
+        await server.db.friends.insert_one({"user_id": "alice", "friend_id": "bob", "status": "accepted"})
+        redis = FakeRedis()
+        nodes = {}
+        for name in ("a", "b"):
+            node = server.ConnectionManager(presence_window=0, backplane=RedisBackplane(redis, name))
+            await node.backplane.start(node.receive_envelope, lambda node=node: list(node.users.values()))
+            nodes[name] = node
+
+        alice, bob = FakeSocket(), FakeSocket()
+        await nodes["a"].connect(alice, "alice", "alice")
+        await nodes["b"].connect(bob, "bob", "bob")
+        await asyncio.sleep(0.01)
+        # A message sent on node a reaches bob's socket on node b
+        await nodes["a"].send_personal_message({"type": "receive-message", "text": "hi"}, "bob")
+        await asyncio.sleep(0.01)
+        await nodes["b"].drop("bob", bob)
+        await asyncio.sleep(0.01)
+
+        directory = await redis.mget(["presence:alice", "presence:bob"])
+        for node in nodes.values():
+            await node.backplane.close()
+        return alice, bob, directory
+
+    alice, bob, directory = asyncio.run(scenario())
+
+    bob_frames = [json.loads(frame) for frame in bob.sent]
+    assert [u["id"] for u in bob_frames[0]["users"]] == ["bob", "alice"]
+    assert bob_frames[1] == {"type": "receive-message", "text": "hi"}
+    alice_frames = [json.loads(frame) for frame in alice.sent]
+    assert [f["type"] for f in alice_frames] == ["users-update", "user-joined", "user-left"]
+    assert alice_frames[1]["user"]["id"] == "bob"
+    assert directory[0] is not None and directory[1] is None
+
+
+def test_read_receipts_are_coalesced_per_conversation():
+    async def scenario():
+        server.db = server.InMemoryDB()
+        for i in range(5):
+            await server.db.messages.insert_one({"id": f"m{i}", "from_user_id": "s", "to_user_id": "r", "read": False})
+        server.manager = server.ConnectionManager(presence_window=0)
+        sender = FakeSocket()
+        await server.manager.connect(sender, "s", "sender")
+        await asyncio.sleep(0.01)
+        sender.sent.clear()
+        receipts = server.ReadReceiptCoalescer(server.apply_read_receipts, window=0.05)
+        for i in range(5):
+            await receipts.add("r", "s", f"m{i}")
+        await asyncio.sleep(0.1)
+        unread = await server.db.messages.find({"read": False}).to_list(10)
+        return sender, receipts, unread
+
+    sender, receipts, unread = asyncio.run(scenario())
+
+    assert unread == []
+    assert [json.loads(frame) for frame in sender.sent] == [
+        {"type": "messages-read", "message_ids": ["m0", "m1", "m2", "m3", "m4"], "read_by": "r"}
+    ]
+    assert receipts.counters["flushes"] == 1
+
+def test_read_up_to_sends_its_own_receipt_type():
+    async def scenario():
+        server.db = server.InMemoryDB()
+        for i in range(3):
+            await server.db.messages.insert_one({
+                "id": f"u{i}", "from_user_id": "s", "to_user_id": "r", "read": False,
+                "timestamp": f"2024-01-01T00:00:0{i}+00:00",
+            })
+        server.manager = server.ConnectionManager(presence_window=0)
+        sender = FakeSocket()
+        await server.manager.connect(sender, "s", "sender")
+        await asyncio.sleep(0.01)
+        sender.sent.clear()
+        await server.mark_read_up_to("r", "s", "u1")
+        await asyncio.sleep(0.01)
+        return sender
+
+    sender = asyncio.run(scenario())
+
+    # "messages-read" keeps carrying message_ids only; the watermark is a separate frame
+    assert [json.loads(frame) for frame in sender.sent] == [{
+        "type": "messages-read-up-to", "read_by": "r",
+        "up_to": {"id": "u1", "timestamp": "2024-01-01T00:00:01+00:00"}, "count": 2,
+    }]
+
+def test_bad_frames_get_an_error_and_keep_the_connection():
+    befriend("bf1-id", "bf2-id")
+    before = server.ws_dispatcher.stats()["types"].get("ice-candidate", {}).get("invalid", 0)
+    with client.websocket_connect("/api/ws/bf1-id/bf1") as ws1:
+        ws1.receive_json()
+        with client.websocket_connect("/api/ws/bf2-id/bf2") as ws2:
+            ws2.receive_json()
+            ws1.receive_json()
+
+            # No candidate: previously a KeyError that disconnected the sender
+            ws1.send_json({"type": "ice-candidate", "from_user_id": "bf1-id", "to_user_id": "bf2-id"})
+            error = ws1.receive_json()
+            assert error["type"] == "error" and error["for"] == "ice-candidate"
+            assert error["detail"][0]["loc"] == ["candidate"]
+            ws1.send_text("not json")
+            assert ws1.receive_json() == {"type": "error", "for": None, "detail": "Frame is not a JSON object"}
+
+            # The same socket still works
+            ws1.send_json({"type": "ice-candidate", "from_user_id": "bf1-id", "to_user_id": "bf2-id",
+                           "candidate": {"candidate": "a=1", "sdpMid": "0"}})
+            assert ws2.receive_json()["candidate"] == {"candidate": "a=1", "sdpMid": "0"}
+
+    assert server.ws_dispatcher.stats()["types"]["ice-candidate"]["invalid"] == before + 1
+
+
+def test_dispatcher_isolates_handler_failures():
+    from ws_dispatch import FrameDispatcher
+    from pydantic import BaseModel
+
+    class Ping(BaseModel):
+        n: int
+
+    dispatcher = FrameDispatcher()
+    seen = []
+
+    @dispatcher.on("ping", Ping)
+    async def ping(user_id, frame):
+        if frame.n < 0:
+            raise RuntimeError("boom")
+        seen.append((user_id, frame.n))
+
+    replies = []
+
+    async def reply(frame):
+        replies.append(frame)
+
+    async def scenario():
+        return [
+            await dispatcher.dispatch("u", json.dumps(frame), reply)
+            for frame in ({"type": "ping", "n": 1}, {"type": "ping", "n": -1},
+                          {"type": "ping", "n": "x"}, {"type": "pong"})
+        ]
+
+    assert asyncio.run(scenario()) == [True, False, False, False]
+    assert seen == [("u", 1)]
+    assert [r["for"] for r in replies] == ["ping", "ping"]
+    stats = dispatcher.stats()
+    assert stats["unknown"] == 1
+    assert {k: stats["types"]["ping"][k] for k in ("handled", "invalid", "errors")} == \
+        {"handled": 1, "invalid": 1, "errors": 1}
+    assert stats["types"]["ping"]["latency"]["count"] == 2
+
+
+def test_call_ended_reaches_a_peer_on_another_node():
+    from backplane import FakeRedis, RedisBackplane
+
+    async def scenario():
+        server.db = server.InMemoryDB()
+        redis = FakeRedis()
+        nodes = {}
+        for name in ("a", "b"):
+            node = server.ConnectionManager(presence_window=0, backplane=RedisBackplane(redis, name))
+            await node.backplane.start(node.receive_envelope, lambda node=node: list(node.users.values()))
+            nodes[name] = node
+        alice, bob = FakeSocket(), FakeSocket()
+        await nodes["a"].connect(alice, "alice", "alice")
+        await nodes["b"].connect(bob, "bob", "bob")
+        await asyncio.sleep(0.01)
+        server.manager = nodes["a"]
+        await server.ws_end_call("alice", server.CallLogFrame(from_user_id="alice", to_user_id="bob", duration=42))
+        await asyncio.sleep(0.01)
+        for node in nodes.values():
+            await node.backplane.close()
+        return bob
+
+    bob = asyncio.run(scenario())
+    bob_frames = [json.loads(frame) for frame in bob.sent]
+    assert {"type": "call-ended", "from_user_id": "alice"} in bob_frames
+    call_log = next(f["message"] for f in bob_frames if f["type"] == "receive-message")
+    assert (call_log["call_status"], call_log["duration"]) == ("completed", 42)
+
+
+def test_snapshot_supersedes_queued_presence_deltas():
+    async def scenario():
+        manager = server.ConnectionManager(presence_window=0)
+        slow = FakeSocket(delay=10)
+        connect_fake(manager, "slow", slow)
+        await manager.send_personal_message({"type": "first"}, "slow")
+        await asyncio.sleep(0)  # writer blocks on the first frame
+
+        outbox = manager.outboxes["slow"]
+        outbox.put("users-update", json.dumps({"type": "users-update", "version": 1}))
+        outbox.put("receive-message", json.dumps({"type": "receive-message"}))
+        outbox.put("user-joined", json.dumps({"type": "user-joined", "version": 2}))
+        outbox.put("users-update", json.dumps({"type": "users-update", "version": 2}))
+        outbox.put("user-left", json.dumps({"type": "user-left", "version": 3}))
+        return [json.loads(entry[1]) for entry in outbox.queue], outbox.coalesced
+
+    queued, coalesced = asyncio.run(scenario())
+    # Versions stay consecutive from the snapshot on, so the client never sees a gap
+    assert [(f["type"], f.get("version")) for f in queued] == [
+        ("receive-message", None), ("users-update", 2), ("user-left", 3)
+    ]
+    assert coalesced == 2
+
+
+def test_presence_frames_carry_exactly_one_version():
+    async def scenario():
+        manager = server.ConnectionManager(presence_window=0)
+        sockets = {name: FakeSocket() for name in ("r1", "r2")}
+        for name, ws in sockets.items():
+            connect_fake(manager, name, ws)
+        manager.presence_seq["r2"] = 4
+        msg_type, body = manager._presence_body([{"type": "user-left", "user_id": "x", "version": 99}])
+        encoded = {}
+        for name in sockets:
+            manager._send_presence(name, msg_type, body, encoded)
+        await asyncio.sleep(0.01)
+        return sockets, encoded
+
+    sockets, encoded = asyncio.run(scenario())
+    assert json.loads(sockets["r1"].sent[0]) == {"version": 1, "type": "user-left", "user_id": "x"}
+    assert json.loads(sockets["r2"].sent[0])["version"] == 5
+    assert sorted(encoded) == [1, 5]
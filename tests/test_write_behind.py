@@ -0,0 +1,175 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add backend to path
+backend_path = Path(__file__).parent.parent / "backend"
+sys.path.append(str(backend_path))
+
+from server import InMemoryDB
+from write_behind import WriteBehind
+
+
+def make_message(i):
+    return {
+        "id": f"msg-{i}",
+        "from_user_id": "a",
+        "to_user_id": "b",
+        "message": f"message {i}",
+        "timestamp": f"2024-01-01T00:00:{i:02d}+00:00",
+        "read": False,
+    }
+
+
+class FlakyCollection:
+    """Rejects bulk writes and one specific document"""
+
+    def __init__(self, bad_id):
+        self.bad_id = bad_id
+        self.docs = []
+
+    async def insert_many(self, docs):
+        raise RuntimeError("batch rejected")
+
+    async def insert_one(self, doc):
+        if doc["id"] == self.bad_id:
+            raise RuntimeError("bad row")
+        self.docs.append(doc)
+
+
+def test_writes_are_batched_and_merged():
+    async def scenario():
+        db = InMemoryDB()
+        writer = WriteBehind(lambda: db.messages, max_batch=100, flush_interval=0.05)
+        for i in range(10):
+            await writer.insert(make_message(i))
+        # Folded into the pending insert, then merged with each other
+        await writer.update("msg-3", {"read": True})
+        await writer.update("msg-3", {"message": "edited"})
+        assert await db.messages.find_one({"id": "msg-0"}) is None
+        await asyncio.sleep(0.1)
+        return db, writer
+
+    db, writer = asyncio.run(scenario())
+
+    assert writer.counters["batches"] == 1
+    assert writer.counters["inserted"] == 10 and writer.counters["merged"] == 2
+    doc = asyncio.run(db.messages.find_one({"id": "msg-3"}))
+    assert doc["read"] is True and doc["message"] == "edited"
+
+
+def test_full_batch_flushes_without_waiting_for_the_timer():
+    async def scenario():
+        db = InMemoryDB()
+        writer = WriteBehind(lambda: db.messages, max_batch=5, flush_interval=60)
+        for i in range(5):
+            await writer.insert(make_message(i))
+        await asyncio.sleep(0)
+        await writer.update("msg-1", {"read": True})
+        await writer.close()
+        return db, writer
+
+    db, writer = asyncio.run(scenario())
+
+    assert writer.counters["batches"] == 2 and writer.pending == 0
+    assert asyncio.run(db.messages.find_one({"id": "msg-1"}))["read"] is True
+
+
+def test_failed_batch_is_retried_row_by_row():
+    collection = FlakyCollection("msg-2")
+    writer = WriteBehind(lambda: collection, flush_interval=0)
+
+    async def scenario():
+        for i in range(4):
+            writer._inserts[f"msg-{i}"] = make_message(i)
+        await writer.flush()
+
+    asyncio.run(scenario())
+
+    assert [doc["id"] for doc in collection.docs] == ["msg-0", "msg-1", "msg-3"]
+    assert writer.counters["failed"] == 1 and writer.counters["inserted"] == 3
+
+
+class OutageCollection:
+    """Fails every write until ``outages`` attempts have been made"""
+
+    def __init__(self, outages):
+        self.outages = outages
+        self.attempts = 0
+        self.docs = {}
+
+    async def insert_many(self, docs):
+        self.attempts += 1
+        if self.attempts <= self.outages:
+            raise ConnectionError("database down")
+        for doc in docs:
+            self.docs[doc["id"]] = dict(doc)
+
+    async def insert_one(self, doc):
+        raise ConnectionError("database down")
+
+
+def test_failed_writes_are_retried_with_backoff():
+    collection = OutageCollection(outages=2)
+    writer = WriteBehind(lambda: collection, flush_interval=0, retry_delay=0.01)
+
+    async def scenario():
+        await writer.insert(make_message(1))
+        assert writer.holds("msg-1")
+        # Held for its retry: merged in rather than racing the failed insert
+        await writer.update("msg-1", {"read": True})
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    assert collection.docs["msg-1"]["read"] is True
+    assert writer.counters["retried"] == 2 and writer.counters["abandoned"] == 0
+    assert not writer.holds("msg-1")
+
+
+def test_writes_are_abandoned_after_max_retries():
+    collection = OutageCollection(outages=100)
+    writer = WriteBehind(lambda: collection, flush_interval=0, max_retries=2, retry_delay=0.01)
+
+    async def scenario():
+        await writer.insert(make_message(1))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    assert collection.attempts == 3
+    assert writer.counters["abandoned"] == 1 and writer.stats()["held"] == 0
+
+
+class SlowCollection:
+    """Holds every bulk insert until released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.docs = []
+
+    async def insert_many(self, docs):
+        await self.release.wait()
+        self.docs.extend(docs)
+
+
+def test_pending_writes_cover_the_batch_being_written():
+    async def scenario():
+        collection = SlowCollection()
+        writer = WriteBehind(lambda: collection, flush_interval=60)
+        await writer.insert(make_message(1))
+        flush = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        # In flight: neither buffered nor stored, but still visible to readers
+        await writer.insert(make_message(2))
+        await writer.update("msg-1", {"read": True})
+        await writer.update("msg-9", {"deleted": True})
+        inserts, updates = writer.pending_writes()
+        collection.release.set()
+        await flush
+        return inserts, updates, writer.pending_writes()
+
+    inserts, updates, after = asyncio.run(scenario())
+    assert sorted(inserts) == ["msg-1", "msg-2"] and inserts["msg-1"]["read"] is True
+    assert updates == {"msg-9": {"deleted": True}}
+    assert sorted(after[0]) == ["msg-2"]